@@ -0,0 +1,46 @@
+"""
+Benchmark runner for Cerberus DeepCrystal
+Usage (from backend/):  python -m benchmarks <command> [options]
+Author: Sudeepa Wanigarathna
+"""
+
+import sys
+import os
+import importlib
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COMMANDS = {
+    "load": ("benchmarks.load_test", "End-to-end HTTP load test with open-loop arrivals"),
+    "db-scale": ("benchmarks.db_scale", "Synthetic report/certificate bulk load and query scaling"),
+    "multiview": ("benchmarks.multiview", "Batched multi-view scans vs separate single-view scans"),
+    "profiles": ("benchmarks.profiles", "Compute cost and accuracy of each tier's execution profile"),
+    "export": ("benchmarks.export", "Streaming report export throughput and memory per format"),
+    "workers": ("benchmarks.workers", "Per-worker memory with and without the pre-fork model load"),
+    "webhooks": ("benchmarks.webhooks", "Webhook delivery throughput, lag and retries against local receivers"),
+    "verify-flood": ("benchmarks.verify_flood", "Certificate verification under a flood of random ids, filter off vs on"),
+    "valuation": ("benchmarks.valuation", "Vectorized parcel valuation vs pricing stones one at a time"),
+    "audit": ("benchmarks.audit", "Audit log record cost, write throughput, index queries and chain verification"),
+    "scan-stream": ("benchmarks.scan_stream", "Time to first result of streamed scans vs the full report"),
+    "feed": ("benchmarks.feed", "Live scan feed fan-out to many subscribers, with slow readers dropped"),
+    "pipeline": ("benchmarks.pipeline", "Per-stage scan pipeline timings, one request at a time vs batched"),
+    "mineral-import": ("benchmarks.mineral_import", "Bulk mineral import per source format vs the per-row seed path"),
+    "spectra": ("benchmarks.spectra", "Spectral library matching latency and accuracy vs library size"),
+    "quality-gate": ("benchmarks.quality_gate", "Upload quality gate verdicts on degraded photos and its cost vs a scan"),
+    "replay": ("benchmarks.replay", "Scan capture cost and offline replay throughput and agreement per worker count"),
+    "archive": ("benchmarks.archive", "Report archival to Parquet: throughput, hot table size and hot vs archived lookups"),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        print("Usage: python -m benchmarks <command> [options]\n\nCommands:")
+        for name, (_, desc) in COMMANDS.items():
+            print(f"  {name:<12} {desc}")
+        return 1
+    module = importlib.import_module(COMMANDS[argv[0]][0])
+    return module.main(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
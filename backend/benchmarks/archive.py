@@ -0,0 +1,102 @@
+"""
+Report archive benchmark for Cerberus DeepCrystal
+Bulk-loads --reports synthetic reports spread over two years into a
+throwaway SQLite database, archives those older than --after-days and
+prints the archive throughput, the size of analysis_reports (with its
+indexes, vacuumed) before and after, the size of the Parquet archive and of
+its index table, and report lookup latency for hot rows vs archived rows.
+
+Usage (from backend/):
+    python -m benchmarks archive --reports 200000 --after-days 90
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import percentile
+
+
+def _table_mb(engine, table: str) -> float:
+    """Pages of a table and its indexes (SQLite dbstat)."""
+    with engine.connect() as conn:
+        size = conn.exec_driver_sql("SELECT SUM(d.pgsize) FROM dbstat d JOIN sqlite_schema s ON s.name = d.name "
+                                    "WHERE s.tbl_name = ?", (table,)).scalar()
+    return (size or 0) / 1e6
+
+
+def _lookup_ms(fn, keys: list) -> list:
+    times = []
+    for key in keys:
+        start = time.perf_counter()
+        if fn(key) is None:
+            raise RuntimeError(f"report {key} not found")
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks archive", description=__doc__.split("\n")[1])
+    p.add_argument("--reports", type=lambda s: int(float(s)), default=200_000)
+    p.add_argument("--after-days", type=float, default=90)
+    p.add_argument("--lookups", type=int, default=500)
+    p.add_argument("--seed", type=int, default=42)
+    args = p.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-archive-")
+    db_path = os.path.join(workdir, "archive.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    try:
+        from benchmarks.db_scale import SyntheticGenerator, bulk_load
+        from database import AnalysisReport, SessionLocal, engine, init_db
+        from services.archive import ReportArchive, vacuum
+        init_db()
+        samples = {"session_ids": [], "cert_ids": []}
+        start = time.perf_counter()
+        bulk_load(engine, SyntheticGenerator(args.seed), args.reports, 20_000, samples)
+        vacuum(engine)
+        hot_before = _table_mb(engine, "analysis_reports")
+        print(f"  loaded {args.reports:,} reports in {time.perf_counter() - start:.1f}s, "
+              f"analysis_reports {hot_before:.1f} MB")
+
+        archive = ReportArchive(os.path.join(workdir, "archive"))
+        result = archive.archive(engine, args.after_days)
+        vacuum(engine)
+        db = SessionLocal()
+        try:
+            status = archive.status(db)
+            rng = random.Random(args.seed)
+            keys = rng.sample(samples["session_ids"], min(args.lookups, len(samples["session_ids"])))
+            hot_keys = [k for (k,) in db.query(AnalysisReport.session_id).filter(AnalysisReport.session_id.in_(keys))]
+            cold_keys = [k for k in keys if k not in set(hot_keys)]
+            hot_ms = _lookup_ms(lambda k: db.query(AnalysisReport).filter(AnalysisReport.session_id == k).first(),
+                                hot_keys)
+            db.expunge_all()
+            cold_ms = _lookup_ms(lambda k: archive.get(db, k), cold_keys)
+        finally:
+            db.close()
+
+        print(f"  archived {result['archived']:,} reports older than {args.after_days:g} days in "
+              f"{result['seconds']}s ({result['archived'] / max(result['seconds'], 1e-9):,.0f}/s), "
+              f"{result['files']} Parquet files")
+        print(f"  analysis_reports {hot_before:.1f} -> {_table_mb(engine, 'analysis_reports'):.1f} MB "
+              f"({status['hot_reports']:,} hot rows); archive {status['archive_mb']:.1f} MB + index table "
+              f"{_table_mb(engine, 'archived_reports'):.1f} MB")
+        print(f"\n  {'lookup':<22}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}")
+        for label, times in (("hot row", hot_ms), ("archived row", cold_ms)):
+            if times:
+                print(f"  {label:<22}{len(times):>7}{percentile(times, 0.5):>9.2f}{percentile(times, 0.99):>9.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Audit log benchmark for Cerberus DeepCrystal
+Producer threads record scan-like events (with certificate ids) as fast as
+they can for --duration seconds while the writer batches, fsyncs and rolls
+segments (--segment-mb, small so that sealing and the hash chain are
+exercised). Reports the cost of record() on the request path, the sustained
+write rate and fsyncs, then time-range and certificate queries against the
+index and the time to verify the hash chain.
+
+Usage (from backend/):
+    python -m benchmarks audit --threads 4 --duration 10
+    python -m benchmarks audit --rate 20000 --duration 30 --segment-mb 16
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import percentile
+
+
+def produce(log, thread: int, stop: threading.Event, rate: float, costs: list, issued: list):
+    """Records events until stopped; every 64th call is timed."""
+    i, interval = 0, (1.0 / rate if rate else 0.0)
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        cert_id = f"DC-{thread:02d}{i:010d}"
+        started = time.perf_counter_ns() if i % 64 == 0 else None
+        log.record("scan.completed", client=f"client-{i % 97}", session_id=f"s-{thread}-{i}", cert_id=cert_id,
+                   mode="gov", mineral="Ruby", confidence=0.93, views=1)
+        if started is not None:
+            costs.append(time.perf_counter_ns() - started)
+            issued.append((time.time(), cert_id))
+        i += 1
+        if interval:
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def run(args, root: str) -> dict:
+    from services.audit_log import AuditLog, verify_all
+    log = AuditLog(root=root, segment_bytes=args.segment_mb * 1024 * 1024)
+    log.start()
+    stop = threading.Event()
+    costs, issued = [[] for _ in range(args.threads)], [[] for _ in range(args.threads)]
+    per_thread = args.rate / args.threads if args.rate else 0.0
+    threads = [threading.Thread(target=produce, args=(log, t, stop, per_thread, costs[t], issued[t]))
+               for t in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    produced_s = time.perf_counter() - started
+    backlog = len(log._queue)
+    log.flush(timeout=300)
+    drained_s = time.perf_counter() - started
+    status = log.status()
+
+    samples = [s for thread in issued for s in thread]
+    rng = random.Random(args.seed)
+    t0, t1 = min(s[0] for s in samples), max(s[0] for s in samples)
+    range_ms, range_counts = [], []
+    for _ in range(args.queries):
+        a = rng.uniform(t0, t1)
+        q = time.perf_counter()
+        range_counts.append(len(log.query(start=a, end=a + 0.1, limit=100000)))
+        range_ms.append((time.perf_counter() - q) * 1000)
+    cert_ms, cert_misses = [], 0
+    for _, cert_id in rng.sample(samples, min(args.queries, len(samples))):
+        q = time.perf_counter()
+        found = log.query(cert_id=cert_id)
+        cert_ms.append((time.perf_counter() - q) * 1000)
+        cert_misses += len(found) != 1
+    log.stop()
+    q = time.perf_counter()
+    chain = verify_all(root)
+    verify_s = time.perf_counter() - q
+    disk = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+    all_costs = sorted(c for thread in costs for c in thread)
+    range_ms.sort()
+    cert_ms.sort()
+    return {
+        "threads": args.threads,
+        "target_rate": args.rate or None,
+        "recorded": status["recorded"],
+        "written": status["written"],
+        "produce_s": round(produced_s, 2),
+        "record_rate_per_s": round(status["recorded"] / produced_s),
+        "write_rate_per_s": round(status["written"] / drained_s),
+        "backlog_at_stop": backlog,
+        "record_ns": {q: round(percentile(all_costs, p)) for q, p in (("p50", 0.5), ("p99", 0.99), ("max", 1.0))},
+        "fsyncs": status["fsyncs"],
+        "sealed_segments": status["sealed_segments"],
+        "disk_mb": round(disk / 1024 / 1024, 1),
+        "bytes_per_event": round(disk / max(status["written"], 1), 1),
+        "range_query_ms": {q: round(percentile(range_ms, p), 2) for q, p in (("p50", 0.5), ("p95", 0.95))},
+        "range_query_events_p50": sorted(range_counts)[len(range_counts) // 2],
+        "cert_query_ms": {q: round(percentile(cert_ms, p), 2) for q, p in (("p50", 0.5), ("p95", 0.95))},
+        "cert_query_misses": cert_misses,
+        "verify_s": round(verify_s, 2),
+        "chain_ok": chain["ok"],
+    }
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks audit", description=__doc__.split("\n")[1])
+    p.add_argument("--threads", type=int, default=4, help="Producer threads (stand-ins for request handlers)")
+    p.add_argument("--duration", type=float, default=10.0, help="Seconds of recording")
+    p.add_argument("--rate", type=float, default=0, help="Total events per second (default: as fast as possible)")
+    p.add_argument("--segment-mb", type=int, default=8, help="Segment size before it is sealed")
+    p.add_argument("--queries", type=int, default=200, help="Time-range and certificate queries each")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write results to this JSON file")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-audit-")
+    try:
+        results = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    r = results
+    print(f"{r['recorded']:,} events from {r['threads']} threads in {r['produce_s']} s: "
+          f"recorded {r['record_rate_per_s']:,}/s, written {r['write_rate_per_s']:,}/s "
+          f"(backlog at stop {r['backlog_at_stop']:,})")
+    print(f"record(): p50 {r['record_ns']['p50']} ns · p99 {r['record_ns']['p99']} ns · max {r['record_ns']['max']:,} ns")
+    print(f"{r['fsyncs']} fsyncs, {r['sealed_segments']} sealed segments, {r['disk_mb']} MB on disk "
+          f"({r['bytes_per_event']} B/event incl. index)")
+    print(f"100 ms time-range query: p50 {r['range_query_ms']['p50']} ms ({r['range_query_events_p50']} events) · "
+          f"p95 {r['range_query_ms']['p95']} ms")
+    print(f"Certificate query: p50 {r['cert_query_ms']['p50']} ms · p95 {r['cert_query_ms']['p95']} ms "
+          f"({r['cert_query_misses']} misses)")
+    print(f"Hash chain verified in {r['verify_s']} s: {'OK' if r['chain_ok'] else 'BROKEN'}")
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json_out}")
+    return 0 if r["chain_ok"] and not r["cert_query_misses"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+Database scale benchmark for Cerberus DeepCrystal
+Bulk-loads synthetic AnalysisReport / BlockchainCert rows drawn from the real
+GEM_DATA distribution into SQLite (and optionally a local PostgreSQL), growing
+the tables step by step, and times the queries the API actually issues:
+history listing, report lookup, certificate verification and mineral search.
+Queries whose latency grows roughly linearly with table size are flagged.
+
+Usage (from backend/):
+    python -m benchmarks db-scale --scales 1e5,1e6
+    python -m benchmarks db-scale --scales 1e5,1e6,1e7 --postgres-url postgresql://localhost/deepcrystal_bench
+The report, certificate and rollup tables of a --sqlite-path / --postgres-url
+database are dropped first; one that already holds reports needs --reset.
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, AnalysisReport, BlockchainCert, Mineral, ReportRollup
+from services.ml_pipeline import GEM_DATA
+from data.seed_database import seed_database
+from services.rollups import default_range, query_stats, record_reports
+
+INCLUSION_KEYS = ["curved_growth_lines", "gas_bubbles", "rutile_silk", "fracture_filling", "flame_fusion_indicators",
+                  "heat_treatment_markers", "fingerprint_inclusions", "needles", "crystals", "feathers"]
+CRACK_KEYS = ["surface_cracks", "internal_fractures", "chips", "abrasions"]
+CLARITY_GRADES = ["VVS (Very Very Slightly Included)", "VS (Very Slightly Included)", "SI (Slightly Included)", "I (Included)"]
+TREATMENT_TYPES = ["Natural (Untreated)", "Heat Treated", "Glass Filled", "Beryllium Diffusion", "Resin Filled",
+                   "Laser Drilled", "Coated", "Synthetic"]
+TREATMENT_WEIGHTS = [0.62, 0.22, 0.04, 0.03, 0.03, 0.02, 0.02, 0.02]
+MODES, MODE_WEIGHTS = ["free", "pro", "lab"], [0.55, 0.35, 0.10]
+SEARCH_TERMS = ["sapphire", "ruby", "emerald", "quartz", "garnet", "spinel", "topaz", "Al", "SiO", "beryl"]
+LINEAR_SLOPE = 0.5  # log-log slope above which a query is flagged as scaling with table size
+
+
+class SyntheticGenerator:
+    """
+    Generates report/certificate row pairs. Gem frequency follows GEM_DATA with
+    cheaper stones scanned more often; formulas, hardness, price bands and
+    origins come from the gem's own profile.
+    """
+
+    def __init__(self, seed: int = 42, days: int = 730):
+        self.rng = random.Random(seed)
+        self.nrng = np.random.default_rng(seed)
+        self.names = list(GEM_DATA.keys())
+        self.weights = [1.0 / math.sqrt(max(GEM_DATA[n]["price_max"], 1)) for n in self.names]
+        self.now = datetime.utcnow()
+        self.span_s = days * 86400
+
+    def rows(self, count: int):
+        rng, nrng = self.rng, self.nrng
+        gems = rng.choices(self.names, self.weights, k=count)
+        treatments = rng.choices(TREATMENT_TYPES, TREATMENT_WEIGHTS, k=count)
+        modes = rng.choices(MODES, MODE_WEIGHTS, k=count)
+        natural = nrng.uniform(0.45, 0.92, count).round(4)
+        confidence = nrng.uniform(0.70, 0.99, count).round(4)
+        synthetic = nrng.uniform(0.02, 0.20, count).round(4)
+        treated = nrng.uniform(0.05, 0.30, count).round(4)
+        size = natural * nrng.lognormal(0.0, 0.6, count) ** 1.5
+        spread = nrng.uniform(0.7, 1.3, count)
+        base_min = np.array([GEM_DATA[g]["price_min"] for g in gems], dtype=np.float64)
+        base_max = np.array([GEM_DATA[g]["price_max"] for g in gems], dtype=np.float64)
+        price_min = (base_min * size).round(2)
+        price_max = (base_max * size * spread).round(2)
+        inclusions = nrng.uniform(0.0, 0.6, (count, len(INCLUSION_KEYS))).round(3).tolist()
+        cracks = nrng.uniform(0.0, 0.3, (count, len(CRACK_KEYS))).round(3).tolist()
+        grades = nrng.integers(0, len(CLARITY_GRADES), count).tolist()
+        offsets = nrng.integers(0, self.span_s, count).tolist()
+        ids = nrng.integers(0, 2 ** 63, (count, 4), dtype=np.int64).tolist()
+
+        reports, certs = [], []
+        for i, (name, treatment, mode) in enumerate(zip(gems, treatments, modes)):
+            gem = GEM_DATA[name]
+            a, b, c, d = ids[i]
+            session_id = str(uuid.UUID(int=(a << 64 | b) & ((1 << 128) - 1), version=4))
+            cert_id = f"CDC-{c & 0xFFFFFFFF:08X}-{d & 0xFFFF:04X}"
+            created = self.now - timedelta(seconds=offsets[i])
+            pmin, pmax = float(price_min[i]), float(price_max[i])
+            origins = [{"country": country, "probability": round(p * rng.uniform(0.7, 1.3), 3)}
+                       for country, p in gem["origins"]]
+            origins.sort(key=lambda o: o["probability"], reverse=True)
+            inclusion = dict(zip(INCLUSION_KEYS, inclusions[i]))
+            inclusion["summary"] = "Synthetic benchmark row."
+            crack = dict(zip(CRACK_KEYS, cracks[i]))
+            crack["overall_clarity_grade"] = CLARITY_GRADES[grades[i]]
+            crack["damage_description"] = "No significant surface damage detected."
+            reports.append({
+                "session_id": session_id,
+                "blockchain_id": cert_id,
+                "mineral_name": name,
+                "chemical_formula": gem["formula"],
+                "crystal_system": gem["crystal_system"],
+                "mohs_hardness": f"{gem['mohs'][0]}–{gem['mohs'][1]}",
+                "specific_gravity": None,
+                "natural_probability": float(natural[i]),
+                "synthetic_probability": float(synthetic[i]),
+                "treatment_probability": float(treated[i]),
+                "treatment_type": treatment,
+                "inclusion_analysis": inclusion,
+                "crack_assessment": crack,
+                "price_min_local": round(pmin * 308, 2),
+                "price_max_local": round(pmax * 308, 2),
+                "price_min_usd": pmin,
+                "price_max_usd": pmax,
+                "currency_local": "LKR",
+                "origin_prediction": origins,
+                "confidence_score": float(confidence[i]),
+                "mode": mode,
+                "created_at": created,
+            })
+            certs.append({
+                "cert_id": cert_id,
+                "session_id": session_id,
+                "mineral_name": name,
+                "confidence_score": float(confidence[i]),
+                "hash_value": f"{a & 0xFFFFFFFFFFFFFFFF:016x}{b:016x}{c:016x}{d:016x}",
+                "qr_path": f"/static/qrcodes/{cert_id}.png",
+                "issued_at": created,
+                "is_valid": True,
+            })
+        return reports, certs
+
+
+def make_engine(url: str):
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(url)
+
+
+def holds_reports(url: str) -> bool:
+    """Whether the database already has analysis reports (which bench_target would drop)."""
+    engine = make_engine(url)
+    try:
+        with engine.connect() as conn:
+            if not inspect(conn).has_table(AnalysisReport.__tablename__):
+                return False
+            return conn.execute(text(f"SELECT 1 FROM {AnalysisReport.__tablename__} LIMIT 1")).first() is not None
+    finally:
+        engine.dispose()
+
+
+def bulk_load(engine, generator: SyntheticGenerator, count: int, batch: int, samples: dict):
+    """Executemany inserts (plus their rollups) in large transactions; keeps a reservoir of keys for lookups."""
+    reports_t, certs_t = AnalysisReport.__table__, BlockchainCert.__table__
+    loaded = 0
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            conn.exec_driver_sql("PRAGMA journal_mode=MEMORY")
+        while loaded < count:
+            n = min(batch, count - loaded)
+            reports, certs = generator.rows(n)
+            conn.execute(reports_t.insert(), reports)
+            conn.execute(certs_t.insert(), certs)
+            record_reports(conn, reports)
+            for r in reports[:: max(1, n // 50)]:
+                samples["session_ids"].append(r["session_id"])
+                samples["cert_ids"].append(r["blockchain_id"])
+            loaded += n
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE analysis_reports"))
+            conn.execute(text("ANALYZE blockchain_certs"))
+            conn.execute(text("ANALYZE report_rollups"))
+
+
+def time_query(fn, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {"median_ms": round(timings[len(timings) // 2], 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3)}
+
+
+def run_queries(Session, samples: dict, repeats: int, rng: random.Random) -> dict:
+    """The same ORM queries the routers issue."""
+    db = Session()
+    try:
+        return {
+            "history_listing": time_query(lambda: db.query(AnalysisReport)
+                                          .order_by(AnalysisReport.created_at.desc()).limit(20).all(), repeats),
+            "report_lookup": time_query(lambda: db.query(AnalysisReport)
+                                        .filter(AnalysisReport.session_id == rng.choice(samples["session_ids"]))
+                                        .first(), repeats),
+            "cert_verification": time_query(lambda: db.query(BlockchainCert)
+                                            .filter(BlockchainCert.cert_id == rng.choice(samples["cert_ids"]))
+                                            .first(), repeats),
+            "cert_miss": time_query(lambda: db.query(BlockchainCert)
+                                    .filter(BlockchainCert.cert_id == f"CDC-{uuid.uuid4().hex[:8].upper()}-0000")
+                                    .first(), repeats),
+            "mineral_search": time_query(lambda: db.query(Mineral)
+                                         .filter(Mineral.name.ilike(f"%{rng.choice(SEARCH_TERMS)}%") |
+                                                 Mineral.chemical_formula.ilike(f"%{rng.choice(SEARCH_TERMS)}%"))
+                                         .limit(50).all(), repeats),
+            "dashboard_stats": time_query(lambda: query_stats(db, *default_range(30)), repeats),
+        }
+    finally:
+        db.close()
+
+
+def growth_flags(results: list) -> dict:
+    """Least-squares slope of log(latency) vs log(rows); ~1.0 means linear in table size."""
+    flags = {}
+    if len(results) < 2:
+        return flags
+    xs = [math.log(r["rows"]) for r in results]
+    for query in results[0]["queries"]:
+        ys = [math.log(max(r["queries"][query]["median_ms"], 1e-3)) for r in results]
+        mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+        denom = sum((x - mx) ** 2 for x in xs)
+        slope = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / denom if denom else 0.0
+        flags[query] = {"slope": round(slope, 3), "linear": slope > LINEAR_SLOPE}
+    return flags
+
+
+def bench_target(label: str, url: str, scales: list, args) -> dict:
+    print(f"\n══ {label}: {url}")
+    engine = make_engine(url)
+    Base.metadata.drop_all(bind=engine, tables=[AnalysisReport.__table__, BlockchainCert.__table__,
+                                                  ReportRollup.__table__])
+    Base.metadata.create_all(bind=engine)
+    seed_database(engine)
+    Session = sessionmaker(bind=engine)
+    generator = SyntheticGenerator(args.seed)
+    samples = {"session_ids": [], "cert_ids": []}
+    rng = random.Random(args.seed)
+    results, rows = [], 0
+    for scale in scales:
+        start = time.perf_counter()
+        bulk_load(engine, generator, scale - rows, args.batch, samples)
+        load_s = time.perf_counter() - start
+        rate = (scale - rows) / load_s if load_s else 0
+        rows = scale
+        queries = run_queries(Session, samples, args.repeats, rng)
+        results.append({"rows": rows, "load_s": round(load_s, 2), "load_rows_per_s": round(rate), "queries": queries})
+        print(f"\n  {rows:>12,} rows  (loaded in {load_s:.1f} s, {rate:,.0f} rows/s)")
+        for name, q in queries.items():
+            print(f"    {name:<20} median {q['median_ms']:>10.3f} ms   p95 {q['p95_ms']:>10.3f} ms")
+    flags = growth_flags(results)
+    if flags:
+        print("\n  Growth with table size (log-log slope):")
+        for name, f in flags.items():
+            print(f"    {name:<20} {f['slope']:>6.2f}  {'⚠ grows linearly with table size' if f['linear'] else 'ok'}")
+    engine.dispose()
+    return {"target": label, "scales": results, "growth": flags}
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks db-scale", description=__doc__.split("\n")[1])
+    p.add_argument("--scales", type=lambda s: sorted(int(float(x)) for x in s.split(",")), default=[100_000, 1_000_000],
+                   help="Comma-separated cumulative row counts, e.g. 1e5,1e6,1e7")
+    p.add_argument("--sqlite-path", help="SQLite file to use (default: throwaway temp file); "
+                                         "its report, certificate and rollup tables are dropped and recreated")
+    p.add_argument("--no-sqlite", action="store_true", help="Skip the SQLite target")
+    p.add_argument("--postgres-url", help="Also benchmark this PostgreSQL database (tables are dropped and recreated)")
+    p.add_argument("--reset", action="store_true",
+                   help="Allow dropping the tables of a --sqlite-path / --postgres-url database that already holds reports")
+    p.add_argument("--batch", type=int, default=20_000, help="Rows per executemany batch")
+    p.add_argument("--repeats", type=int, default=50, help="Timed executions per query per scale")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write full results to this JSON file")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    targets, tmpdir = [], None
+    if not args.no_sqlite:
+        path = args.sqlite_path
+        if not path:
+            tmpdir = tempfile.mkdtemp(prefix="deepcrystal-dbscale-")
+            path = os.path.join(tmpdir, "bench.db")
+        targets.append(("sqlite", f"sqlite:///{os.path.abspath(path)}"))
+    if args.postgres_url:
+        targets.append(("postgresql", args.postgres_url))
+    if not args.reset:
+        in_use = [url for label, url in targets if not (tmpdir and label == "sqlite") and holds_reports(url)]
+        if in_use:
+            print(f"Refusing to drop existing reports in {', '.join(in_use)}; pass --reset to overwrite them.")
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            return 1
+
+    try:
+        results = [bench_target(label, url, args.scales, args) for label, url in targets]
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
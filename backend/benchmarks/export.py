@@ -0,0 +1,113 @@
+"""
+Report export benchmark for Cerberus DeepCrystal
+Bulk-loads synthetic reports (see db_scale) and streams them through every
+export format, reporting rows/s, output MB/s, CPU share of wall time and peak
+RSS growth during the export. CPU share near 100% means the encoder, not the
+disk or network, is the bottleneck; flat RSS across row counts means the
+export runs in constant memory.
+
+Usage (from backend/):
+    python -m benchmarks export --rows 1e6 --formats ndjson,csv,parquet
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base
+from benchmarks.db_scale import SyntheticGenerator, bulk_load, make_engine
+from services.export import EXPORT_FORMATS, stream_reports
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return 0.0  # not Linux
+
+
+class PeakRSS:
+    """Samples resident memory every 20 ms while the block runs."""
+
+    def __enter__(self):
+        self.start = self.peak = _rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(0.02):
+            self.peak = max(self.peak, _rss_mb())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def growth_mb(self) -> float:
+        return round(self.peak - self.start, 1)
+
+
+def run_export(engine, fmt: str, out_path: str) -> dict:
+    with PeakRSS() as rss, open(out_path, "wb") as out:
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        for chunk in stream_reports(engine, fmt):
+            out.write(chunk)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+    size = os.path.getsize(out_path)
+    return {"format": fmt, "seconds": round(elapsed, 2), "bytes": size,
+            "mb_per_s": round(size / 2 ** 20 / elapsed, 1), "cpu_share": round(cpu / elapsed, 2),
+            "rss_growth_mb": rss.growth_mb}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks export", description=__doc__.split("\n")[1])
+    p.add_argument("--rows", type=lambda s: int(float(s)), default=200_000)
+    p.add_argument("--formats", default=",".join(EXPORT_FORMATS))
+    p.add_argument("--db-url", help="Existing database to export from instead of a synthetic SQLite file")
+    p.add_argument("--batch", type=int, default=20_000)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write full results to this JSON file")
+    args = p.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="deepcrystal-export-")
+    try:
+        url = args.db_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        engine = make_engine(url)
+        if not args.db_url:
+            Base.metadata.create_all(bind=engine)
+            print(f"Loading {args.rows:,} synthetic reports...")
+            bulk_load(engine, SyntheticGenerator(args.seed), args.rows, args.batch, {"session_ids": [], "cert_ids": []})
+        results = []
+        print(f"\n  {'format':<9}{'seconds':>9}{'rows/s':>12}{'MB':>9}{'MB/s':>8}{'cpu':>6}{'rss +MB':>9}")
+        for fmt in args.formats.split(","):
+            r = run_export(engine, fmt, os.path.join(tmpdir, f"export.{fmt}"))
+            r["rows_per_s"] = round(args.rows / r["seconds"]) if r["seconds"] and not args.db_url else None
+            results.append(r)
+            print(f"  {fmt:<9}{r['seconds']:>9.2f}{r['rows_per_s'] or 0:>12,}{r['bytes'] / 2 ** 20:>9.1f}"
+                  f"{r['mb_per_s']:>8.1f}{r['cpu_share']:>6.0%}{r['rss_growth_mb']:>9.1f}")
+        engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Live scan feed benchmark for Cerberus DeepCrystal
+Opens --subscribers feed streams in one process (each read by its own task,
+the way the server reads a StreamingResponse) and publishes --rate events/s
+through ScanFeed for --duration seconds. A --slow fraction of the readers
+stall for --stall seconds after every read, to show them being dropped
+instead of slowing down everyone else. Reports per-event fan-out time,
+publish-to-read latency of the healthy readers, and drops.
+
+Usage (from backend/):
+    python -m benchmarks feed --subscribers 100,1000,5000 --rate 20 --slow 0.01
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FEED_MAX_AGE", "3600")
+
+from benchmarks.load_test import percentile
+
+
+async def run_step(subscribers: int, rate: float, duration: float, slow: float, stall: float) -> dict:
+    from services.scan_feed import ScanFeed, sse_frame
+    feed = ScanFeed()
+    published_at = {}
+    latencies, reads = [], [0]
+    n_slow = int(subscribers * slow)
+
+    async def reader(i: int):
+        is_slow = i < n_slow
+        async for chunk in feed.stream(feed.subscribe()):
+            if is_slow:
+                await asyncio.sleep(stall)
+                continue
+            now = time.perf_counter()
+            for frame in chunk.split("\n\n"):
+                if frame.startswith("id: "):
+                    latencies.append(now - published_at[int(frame[4:frame.index("\n")])])
+                    reads[0] += 1
+
+    tasks = [asyncio.create_task(reader(i)) for i in range(subscribers)]
+    await asyncio.sleep(0.2)  # let every reader subscribe
+    summary = {"session_id": "0" * 36, "blockchain_id": "CDC-00000000-0000", "mineral_name": "Ruby",
+               "confidence_score": 0.93, "natural_probability": 0.81, "treatment_type": "Heat Treated",
+               "price_min_usd": 1200.0, "price_max_usd": 5400.0, "mode": "pro", "created_at": "2026-01-01T00:00:00"}
+    fanout = []
+    start = time.perf_counter()
+    event_id = 0
+    while time.perf_counter() - start < duration:
+        event_id += 1
+        t0 = time.perf_counter()
+        published_at[event_id] = t0
+        feed.publish(event_id, sse_frame("scan", summary, event_id))
+        fanout.append(time.perf_counter() - t0)
+        await asyncio.sleep(max(0.0, start + event_id / rate - time.perf_counter()))
+    await asyncio.sleep(0.5)  # drain
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    healthy = subscribers - n_slow
+    latencies.sort()
+    fanout.sort()
+    return {
+        "subscribers": subscribers, "events": event_id, "slow": n_slow, "dropped": feed.dropped,
+        "delivered": reads[0], "expected": event_id * healthy,
+        "fanout_ms_p50": round(percentile(fanout, 0.5) * 1000, 3), "fanout_ms_p99": round(percentile(fanout, 0.99) * 1000, 3),
+        "latency_ms_p50": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "latency_ms_p99": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks feed", description=__doc__.split("\n")[1])
+    p.add_argument("--subscribers", type=lambda s: [int(float(x)) for x in s.split(",")], default=[100, 1000, 5000])
+    p.add_argument("--rate", type=float, default=20.0, help="Published events per second")
+    p.add_argument("--duration", type=float, default=6.0, help="Seconds per step")
+    p.add_argument("--slow", type=float, default=0.01, help="Fraction of readers that stall")
+    p.add_argument("--stall", type=float, default=4.0, help="Seconds a slow reader stalls per read")
+    args = p.parse_args(argv)
+
+    print(f"  {'subscribers':>11}{'events':>8}{'delivered':>18}{'fan-out p50':>14}{'p99':>12}"
+          f"{'latency p50':>14}{'p99':>12}{'slow':>6}{'dropped':>9}")
+    for n in args.subscribers:
+        r = asyncio.run(run_step(n, args.rate, args.duration, args.slow, args.stall))
+        delivered = f"{r['delivered']}/{r['expected']}"
+        print(f"  {n:>11}{r['events']:>8}{delivered:>18}{r['fanout_ms_p50']:>11} ms{r['fanout_ms_p99']:>9} ms"
+              f"{r['latency_ms_p50']:>11} ms{r['latency_ms_p99']:>9} ms{r['slow']:>6}{r['dropped']:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
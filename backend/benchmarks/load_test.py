@@ -0,0 +1,386 @@
+"""
+End-to-end HTTP load test for Cerberus DeepCrystal
+Starts the FastAPI app in-process (ASGI transport) or under Uvicorn against a
+throwaway SQLite database and the offline stub model, then drives a weighted
+mix of endpoints with open-loop (Poisson) arrivals at increasing rates.
+Reports per-endpoint latency percentiles, error rates and the saturation point.
+
+In-process mode shares one event loop between the load generator and the app,
+so a handler that blocks the loop also stalls the generator; use
+--server uvicorn when probing past the saturation point.
+
+Usage (from backend/):
+    python -m benchmarks load --rates 5,10,20,40 --duration 15
+    python -m benchmarks load --server uvicorn --workers 2 --mix scan=1,history=3,search=3,verify=3
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import httpx
+import numpy as np
+from PIL import Image, ImageDraw
+
+ENDPOINTS = ("scan", "history", "search", "verify")
+DEFAULT_MIX = "scan=1,history=3,search=3,verify=3"
+SEARCH_TERMS = ["sapphire", "ruby", "emerald", "quartz", "garnet", "spinel", "topaz", "Al", "SiO", "beryl"]
+
+
+class Sample:
+    __slots__ = ("endpoint", "latency", "ok", "status")
+
+    def __init__(self, endpoint: str, latency: float, ok: bool, status):
+        self.endpoint = endpoint
+        self.latency = latency
+        self.ok = ok
+        self.status = status
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' in mix. Choose from: {list(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+def make_images(count: int, seed: int = 7, sizes: Optional[list] = None) -> list:
+    """
+    Synthetic 'stone on a plain background' JPEGs of varying colour and size,
+    with shading and sensor noise so they pass the upload quality gate.
+    """
+    rng = random.Random(seed)
+    noise = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        size = rng.choice(sizes or [(640, 480), (1024, 768), (1280, 960)])
+        img = Image.new("RGB", size, tuple(rng.randint(200, 255) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        w, h = size
+        r = rng.randint(min(w, h) // 6, min(w, h) // 3)
+        cx, cy = w // 2 + rng.randint(-w // 8, w // 8), h // 2 + rng.randint(-h // 8, h // 8)
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=tuple(rng.randint(0, 200) for _ in range(3)))
+        yy, xx = np.ogrid[:h, :w]
+        shade = 1.15 - 0.3 * np.clip(np.hypot(xx - cx, yy - cy) / r, 0, 1)  # brighter towards the table
+        stone = (np.hypot(xx - cx, yy - cy) <= r)[..., None]
+        pixels = np.asarray(img, dtype=np.float32) * np.where(stone, shade[..., None], 1.0)
+        pixels += noise.normal(0.0, 4.0, pixels.shape)
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+        images.append(buf.getvalue())
+    return images
+
+
+def percentile(sorted_values: list, q: float):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    if lo == hi:
+        return sorted_values[lo]
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class LoadContext:
+    """Shared state for request generation (payloads and issued certificate IDs)."""
+
+    def __init__(self, images: list, verify_miss_ratio: float, seed: int):
+        self.images = images
+        self.cert_ids = []
+        self.verify_miss_ratio = verify_miss_ratio
+        self.rng = random.Random(seed)
+
+    async def issue(self, client: httpx.AsyncClient, endpoint: str):
+        """Send one request; returns (status_code, ok)."""
+        rng = self.rng
+        if endpoint == "scan":
+            manual = {"carat_weight": round(rng.uniform(0.3, 5.0), 2)} if rng.random() < 0.5 else {}
+            mode = rng.choice(["free", "pro", "lab"])
+            res = await client.post(
+                "/api/analysis/scan",
+                files={"image": ("stone.jpg", rng.choice(self.images), "image/jpeg")},
+                data={"mode": mode, "manual_data": json.dumps(manual)},
+                headers={"X-Tier": mode},
+            )
+            if res.status_code == 200:
+                self.cert_ids.append(res.json()["blockchain_id"])
+            return res.status_code, res.status_code == 200
+        if endpoint == "history":
+            res = await client.get("/api/analysis/history", params={"limit": 20})
+            return res.status_code, res.status_code == 200
+        if endpoint == "search":
+            res = await client.get("/api/database/search", params={"q": rng.choice(SEARCH_TERMS)})
+            return res.status_code, res.status_code == 200
+        # verify: known certificate, or a bogus ID where 404 is the correct answer
+        if not self.cert_ids or rng.random() < self.verify_miss_ratio:
+            res = await client.get(f"/api/blockchain/verify/CDC-{uuid.uuid4().hex[:8].upper()}-0000")
+            return res.status_code, res.status_code == 404
+        res = await client.get(f"/api/blockchain/verify/{rng.choice(self.cert_ids)}")
+        return res.status_code, res.status_code == 200
+
+
+async def _timed(client, ctx: LoadContext, endpoint: str, scheduled: float, samples: list):
+    loop = asyncio.get_running_loop()
+    try:
+        status, ok = await ctx.issue(client, endpoint)
+    except Exception as e:
+        status, ok = type(e).__name__, False
+    # Latency is measured from the scheduled arrival, not the actual send, so a
+    # stalled event loop or server shows up in the numbers (no coordinated omission).
+    samples.append(Sample(endpoint, loop.time() - scheduled, ok, status))
+
+
+async def run_step(client, ctx: LoadContext, rate: float, duration: float, mix: dict,
+                   max_inflight: int, drain_timeout: float, seed: int) -> dict:
+    """Open-loop arrivals: requests are fired on a Poisson schedule regardless of responses."""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    names, weights = list(mix.keys()), list(mix.values())
+    samples, tasks = [], set()
+    start = loop.time()
+    next_at = start
+    offered = 0
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at - start >= duration:
+            break
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = rng.choices(names, weights)[0]
+        offered += 1
+        if len(tasks) >= max_inflight:
+            samples.append(Sample(endpoint, 0.0, False, "dropped"))
+            continue
+        task = asyncio.create_task(_timed(client, ctx, endpoint, next_at, samples))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(set(tasks), timeout=drain_timeout)
+        for task in list(tasks):
+            task.cancel()
+            samples.append(Sample("unfinished", drain_timeout, False, "timeout"))
+    elapsed = loop.time() - start
+    return summarize(samples, rate, offered, elapsed)
+
+
+def summarize(samples: list, rate: float, offered: int, elapsed: float) -> dict:
+    def stats(group):
+        lat = sorted(s.latency * 1000 for s in group if s.ok)
+        errors = sum(1 for s in group if not s.ok)
+        return {
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": round(errors / len(group), 4) if group else 0.0,
+            "throughput_rps": round(len(lat) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": _round(percentile(lat, 0.50)),
+            "p90_ms": _round(percentile(lat, 0.90)),
+            "p99_ms": _round(percentile(lat, 0.99)),
+            "max_ms": _round(lat[-1] if lat else None),
+        }
+
+    by_endpoint = {}
+    for s in samples:
+        by_endpoint.setdefault(s.endpoint, []).append(s)
+    statuses = {}
+    for s in samples:
+        if not s.ok:
+            statuses[str(s.status)] = statuses.get(str(s.status), 0) + 1
+    return {
+        "offered_rps": rate,
+        "offered_requests": offered,
+        "elapsed_s": round(elapsed, 2),
+        "overall": stats(samples),
+        "endpoints": {name: stats(group) for name, group in sorted(by_endpoint.items())},
+        "error_statuses": statuses,
+    }
+
+
+def _round(v):
+    return None if v is None else round(v, 2)
+
+
+def find_saturation(steps: list, slo_p99_ms: float, max_error_rate: float):
+    """First offered rate where throughput lags the offered load, errors climb or p99 breaks the SLO."""
+    last_ok = None
+    for step in steps:
+        overall = step["overall"]
+        reasons = []
+        if overall["throughput_rps"] < 0.9 * step["offered_requests"] / max(step["elapsed_s"], 1e-9):
+            reasons.append("throughput below 90% of offered load")
+        if overall["error_rate"] > max_error_rate:
+            reasons.append(f"error rate {overall['error_rate']:.1%}")
+        if overall["p99_ms"] is not None and overall["p99_ms"] > slo_p99_ms:
+            reasons.append(f"p99 {overall['p99_ms']:.0f} ms > SLO {slo_p99_ms:.0f} ms")
+        if reasons:
+            return {"saturated_at_rps": step["offered_rps"], "last_sustainable_rps": last_ok, "reasons": reasons}
+        last_ok = step["offered_rps"]
+    return {"saturated_at_rps": None, "last_sustainable_rps": last_ok, "reasons": []}
+
+
+def print_step(step: dict):
+    print(f"\n── offered {step['offered_rps']:g} req/s · {step['offered_requests']} requests in {step['elapsed_s']} s")
+    print(f"  {'endpoint':<12}{'reqs':>7}{'err%':>8}{'rps':>9}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    rows = list(step["endpoints"].items()) + [("ALL", step["overall"])]
+    for name, s in rows:
+        fmt = lambda v: "-" if v is None else f"{v:.1f}"
+        print(f"  {name:<12}{s['requests']:>7}{s['error_rate'] * 100:>7.1f}%{s['throughput_rps']:>9.1f}"
+              f"{fmt(s['p50_ms']):>10}{fmt(s['p90_ms']):>10}{fmt(s['p99_ms']):>10}{fmt(s['max_ms']):>10}")
+    if step["error_statuses"]:
+        print(f"  errors by status: {step['error_statuses']}")
+
+
+def prepare_environment(workdir: str) -> dict:
+    """Point the app at a throwaway database and the offline stub model, then seed minerals."""
+    env = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "DEEPCRYSTAL_MODEL": "stub",
+        "SCAN_QUOTAS": "0",  # one client scanning far beyond any tier's daily quota
+    }
+    os.environ.update(env)
+    os.chdir(workdir)
+    from data.seed_database import seed_database
+    seed_database()
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_uvicorn(workdir: str, workers: int, env: dict):
+    port = free_port()
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+           "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=workdir, env={**os.environ, **env})
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("Uvicorn exited during startup.")
+        try:
+            if httpx.get(base_url + "/", timeout=1.0).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError("Uvicorn did not become ready within 60 s.")
+
+
+async def drive(client, args, mix: dict) -> dict:
+    ctx = LoadContext(make_images(args.images, args.seed), args.verify_miss_ratio, args.seed)
+    print(f"Warming up ({args.warmup} scans)...")
+    for _ in range(args.warmup):
+        await ctx.issue(client, "scan")
+
+    steps = []
+    for i, rate in enumerate(args.rates):
+        step = await run_step(client, ctx, rate, args.duration, mix, args.max_inflight,
+                              args.drain_timeout, args.seed + i)
+        print_step(step)
+        steps.append(step)
+    saturation = find_saturation(steps, args.slo_p99_ms, args.max_error_rate)
+    return {"server": args.server, "workers": args.workers, "mix": mix, "steps": steps, "saturation": saturation}
+
+
+async def run(args, mix: dict, workdir: str) -> dict:
+    env = prepare_environment(workdir)
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.server == "inprocess":
+        from main import app
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest",
+                                         limits=limits, timeout=timeout) as client:
+                return await drive(client, args, mix)
+
+    proc, base_url = start_uvicorn(workdir, args.workers, env)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+            return await drive(client, args, mix)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks load", description=__doc__.split("\n")[1])
+    p.add_argument("--server", choices=["inprocess", "uvicorn"], default="inprocess")
+    p.add_argument("--workers", type=int, default=1, help="Uvicorn worker processes (uvicorn mode only)")
+    p.add_argument("--rates", type=lambda s: [float(x) for x in s.split(",")], default=[5, 10, 20, 40],
+                   help="Comma-separated offered arrival rates (req/s), one step each")
+    p.add_argument("--duration", type=float, default=15.0, help="Seconds per rate step")
+    p.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. scan=1,history=3,search=3,verify=3")
+    p.add_argument("--images", type=int, default=16, help="Distinct synthetic images to upload")
+    p.add_argument("--warmup", type=int, default=5, help="Sequential scans before measuring")
+    p.add_argument("--verify-miss-ratio", type=float, default=0.0, help="Fraction of verify calls using unknown IDs")
+    p.add_argument("--max-inflight", type=int, default=512, help="Arrivals beyond this are counted as dropped")
+    p.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout (s)")
+    p.add_argument("--drain-timeout", type=float, default=30.0, help="Wait for in-flight requests after each step (s)")
+    p.add_argument("--slo-p99-ms", type=float, default=2000.0)
+    p.add_argument("--max-error-rate", type=float, default=0.01)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write full results to this JSON file")
+    p.add_argument("--keep", action="store_true", help="Keep the throwaway working directory")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    mix = parse_mix(args.mix)
+    json_out = os.path.abspath(args.json_out) if args.json_out else None
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-load-")
+    print(f"Cerberus DeepCrystal load test · server={args.server} · workdir={workdir}")
+    try:
+        results = asyncio.run(run(args, mix, workdir))
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    sat = results["saturation"]
+    if sat["saturated_at_rps"] is None:
+        print(f"\nNo saturation up to {args.rates[-1]:g} req/s.")
+    else:
+        print(f"\nSaturation at {sat['saturated_at_rps']:g} req/s "
+              f"(last sustainable: {sat['last_sustainable_rps']}) — {'; '.join(sat['reasons'])}")
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
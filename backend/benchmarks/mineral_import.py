@@ -0,0 +1,113 @@
+"""
+Mineral import benchmark for Cerberus DeepCrystal
+Writes --records synthetic mineral references (variants of the built-in gems)
+as CSV, NDJSON and JSON, imports each file into a fresh SQLite database with
+MineralImporter, then imports it again (every row an update). Also reports
+the peak Python memory of a validation pass (sources are streamed, so it
+stays flat) and compares with the previous seeding approach (one lookup,
+insert and commit per species) on the first --baseline records.
+
+Usage (from backend/):
+    python -m benchmarks mineral-import --records 100000 --baseline 2000
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Mineral
+from data.seed_database import seed_records
+from services.mineral_import import import_file
+
+
+def make_records(n: int) -> list:
+    templates = [r for r in seed_records()]
+    return [dict(templates[i % len(templates)], name=f"{templates[i % len(templates)]['name']} {i}") for i in range(n)]
+
+
+def write_sources(records: list, workdir: str) -> dict:
+    paths = {fmt: os.path.join(workdir, f"minerals.{fmt}") for fmt in ("csv", "ndjson", "json")}
+    columns = sorted({k for r in records for k in r})
+    with open(paths["csv"], "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(records)
+    with open(paths["ndjson"], "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+    with open(paths["json"], "w", encoding="utf-8") as f:
+        json.dump({"minerals": records}, f)
+    return paths
+
+
+def fresh_engine(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def per_row(engine, records: list) -> float:
+    """The previous seed path: a lookup by name, then insert and commit, per species."""
+    db = sessionmaker(bind=engine)()
+    start = time.perf_counter()
+    for r in records:
+        if not db.query(Mineral).filter(Mineral.name == r["name"]).first():
+            db.add(Mineral(**r))
+            db.commit()
+    seconds = time.perf_counter() - start
+    db.close()
+    return seconds
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks mineral-import", description=__doc__.split("\n")[1])
+    p.add_argument("--records", type=lambda s: int(float(s)), default=100_000)
+    p.add_argument("--baseline", type=lambda s: int(float(s)), default=2000, help="Records for the per-row baseline")
+    args = p.parse_args(argv)
+
+    records = make_records(args.records)
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-minerals-")
+    try:
+        paths = write_sources(records, workdir)
+        print(f"  {'source':>8}{'MB':>8}{'insert s':>10}{'rec/s':>10}{'update s':>10}{'rec/s':>10}{'peak MB':>9}{'rows':>9}")
+        rates = []
+        for fmt, path in paths.items():
+            engine = fresh_engine(os.path.join(workdir, f"{fmt}.db"))
+            first = import_file(engine, path)
+            second = import_file(engine, path)
+            tracemalloc.start()  # separate validation-only pass: tracing slows the import itself down
+            import_file(engine, path, dry_run=True)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with engine.connect() as conn:
+                rows = conn.execute(select(func.count()).select_from(Mineral)).scalar()
+            engine.dispose()
+            rates.append(first["records_per_s"])
+            print(f"  {fmt:>8}{os.path.getsize(path) / 1e6:>8.1f}{first['seconds']:>10.2f}{first['records_per_s']:>10,}"
+                  f"{second['seconds']:>10.2f}{second['records_per_s']:>10,}{peak / 1e6:>9.1f}{rows:>9,}")
+
+        engine = fresh_engine(os.path.join(workdir, "baseline.db"))
+        seconds = per_row(engine, records[:args.baseline])
+        engine.dispose()
+        rate = args.baseline / seconds
+        print(f"\n  per-row baseline: {args.baseline:,} records in {seconds:.2f} s ({rate:,.0f}/s); "
+              f"bulk import is {min(rates) / rate:.0f}-{max(rates) / rate:.0f}x faster")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+Multi-view scan benchmark for Cerberus DeepCrystal
+Compares analysing k views of a stone as one batched pass (analyze_views)
+against k separate single-view scans. Uses the configured model backend
+(DEEPCRYSTAL_MODEL=stub for an offline run).
+
+Usage (from backend/):
+    python -m benchmarks multiview --views 1,2,4,8 --repeats 10
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import make_images
+from services.ml_pipeline import analyze_image_mock, analyze_views
+
+
+def _median_ms(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks multiview", description=__doc__.split("\n")[1])
+    p.add_argument("--views", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8])
+    p.add_argument("--repeats", type=int, default=10)
+    args = p.parse_args(argv)
+
+    images = make_images(max(args.views), seed=11)
+    analyze_image_mock(images[0])  # load model + text bank
+    print(f"  {'views':>5}{'batched ms':>14}{'separate ms':>14}{'speedup':>10}{'vs first row':>14}")
+    single = None
+    for k in args.views:
+        batched = _median_ms(lambda: analyze_views(images[:k]), args.repeats)
+        separate = _median_ms(lambda: [analyze_image_mock(im) for im in images[:k]], args.repeats)
+        single = single or batched
+        print(f"  {k:>5}{batched:>14.1f}{separate:>14.1f}{separate / batched:>9.2f}x{batched / single:>13.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
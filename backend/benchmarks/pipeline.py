@@ -0,0 +1,76 @@
+"""
+Scan pipeline benchmark for Cerberus DeepCrystal
+Runs --scans distinct single-view scans through the staged scan pipeline one
+request at a time and with analyze_requests in batches of --batch sizes,
+then prints where the time goes per stage and the runner's own overhead
+(wall time not spent inside a stage). A last pass re-scans the same photos
+with manual inputs to show the encoder stage's cache. Uses the configured
+model backend (DEEPCRYSTAL_MODEL=stub for an offline run).
+
+Usage (from backend/):
+    python -m benchmarks pipeline --scans 64 --batch 1,8,32 --mode pro
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import make_images
+from services.ml_pipeline import SCAN_PIPELINE, analyze_requests, analyze_views
+from services.profiles import get_profile
+
+
+def _stage_ms() -> dict:
+    return {name: s["total_ms"] for name, s in SCAN_PIPELINE.stats()["stages"].items()}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks pipeline", description=__doc__.split("\n")[1])
+    p.add_argument("--scans", type=int, default=64)
+    p.add_argument("--batch", type=lambda s: [int(x) for x in s.split(",")], default=[1, 8, 32])
+    p.add_argument("--mode", default="pro", help="Execution profile (free, pro, lab, ...)")
+    args = p.parse_args(argv)
+
+    profile = {**get_profile(args.mode), "cache_results": False}
+    images = make_images(args.scans, seed=21)
+    analyze_views([images[0]], None, profile)  # load model + text bank
+
+    runs = {}
+    SCAN_PIPELINE.reset_stats()
+    start = time.perf_counter()
+    for im in images:
+        analyze_views([im], None, profile)
+    runs["one by one"] = (time.perf_counter() - start, _stage_ms())
+    for size in args.batch:
+        SCAN_PIPELINE.reset_stats()
+        start = time.perf_counter()
+        analyze_requests([([im], None) for im in images], profile, batch_size=size)
+        runs[f"batches of {size}"] = (time.perf_counter() - start, _stage_ms())
+
+    SCAN_PIPELINE.reset_stats()
+    analyze_requests([([im], None) for im in images], profile)
+    filled = _stage_ms()
+    start = time.perf_counter()
+    analyze_requests([([im], {"carat_weight": 2.0}) for im in images], profile)
+    runs["repeat (cached embeds)"] = (time.perf_counter() - start,
+                                      {name: ms - filled[name] for name, ms in _stage_ms().items()})
+    cache = SCAN_PIPELINE.stats()["stages"]["embed"]["cache"]
+
+    stages = [stage.name for stage in SCAN_PIPELINE.stages]
+    width = max(len(name) for name in runs) + 2
+    print(f"  {'ms per scan':<{width}}{'total':>9}" + "".join(f"{name[:10]:>11}" for name in stages) + f"{'runner':>9}")
+    for name, (seconds, stage_ms) in runs.items():
+        total = seconds * 1000 / args.scans
+        per_stage = [stage_ms.get(s, 0.0) / args.scans for s in stages]
+        print(f"  {name:<{width}}{total:>9.2f}" + "".join(f"{v:>11.2f}" for v in per_stage)
+              + f"{max(0.0, total - sum(per_stage)):>9.2f}")
+    print(f"\n  encoder cache: {cache['hits']} hits, {cache['misses']} misses (capacity {cache['capacity']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Execution profile benchmark for Cerberus DeepCrystal
+Runs the same scan workload through every execution profile (free, pro, lab,
+...) and reports compute cost (wall and CPU time per scan, throughput, cache
+hit rate) next to accuracy, so tiers can be priced against hardware.
+
+Accuracy is top-1 against folder labels when --dataset points at a directory
+of <Gem Name>/<image> files; otherwise synthetic images are used and accuracy
+is reported as agreement with the reference profile's predictions.
+
+Usage (from backend/):
+    python -m benchmarks profiles --images 32 --passes 2
+    python -m benchmarks profiles --dataset ~/gem-photos --reference lab
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import make_images
+from services.ml_pipeline import analyze_views, GEM_DATA
+from services.profiles import EXECUTION_PROFILES, get_profile, result_cache
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_dataset(root: str) -> list:
+    """[(label, image_bytes)] from <root>/<Gem Name>/*.jpg; unknown folder names are skipped."""
+    samples = []
+    for label in sorted(os.listdir(root)):
+        folder = os.path.join(root, label)
+        if label not in GEM_DATA or not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(folder, name), "rb") as f:
+                    samples.append((label, f.read()))
+    return samples
+
+
+def run_profile(name: str, samples: list, passes: int) -> dict:
+    profile = get_profile(name)
+    result_cache.clear()
+    predictions, wall = [], []
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for _ in range(passes):
+        for _, image in samples:
+            t0 = time.perf_counter()
+            result = analyze_views([image], None, profile)
+            wall.append((time.perf_counter() - t0) * 1000)
+            predictions.append(result["gem_key"])
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    wall.sort()
+    n = len(wall)
+    return {
+        "profile": name,
+        "settings": EXECUTION_PROFILES[name],
+        "scans": n,
+        "median_ms": round(wall[n // 2], 2),
+        "mean_ms": round(sum(wall) / n, 2),
+        "p95_ms": round(wall[min(n - 1, int(n * 0.95))], 2),
+        "cpu_ms_per_scan": round(cpu * 1000 / n, 2),
+        "throughput_per_s": round(n / elapsed, 2),
+        "cache_hit_rate": round(result_cache.hits / n, 3) if profile["cache_results"] else 0.0,
+        "predictions": predictions[:len(samples)],
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks profiles", description=__doc__.split("\n")[1])
+    p.add_argument("--profiles", default=",".join(EXECUTION_PROFILES), help="Comma-separated profile names")
+    p.add_argument("--dataset", help="Directory of <Gem Name>/<image> files for labelled accuracy")
+    p.add_argument("--images", type=int, default=32, help="Synthetic images when no dataset is given")
+    p.add_argument("--passes", type=int, default=2, help="Times each image is scanned (exercises result caching)")
+    p.add_argument("--reference", default="lab", help="Profile whose predictions define agreement without a dataset")
+    p.add_argument("--json", dest="json_out", help="Write full results to this JSON file")
+    args = p.parse_args(argv)
+
+    names = [n for n in args.profiles.split(",") if n in EXECUTION_PROFILES]
+    if args.dataset:
+        samples = load_dataset(args.dataset)
+        if not samples:
+            print(f"No labelled images found under {args.dataset}.")
+            return 1
+    else:
+        samples = [(None, img) for img in make_images(args.images, seed=23)]
+    analyze_views([samples[0][1]])  # load model + text bank outside the timings
+
+    results = {name: run_profile(name, samples, args.passes) for name in names}
+    reference = results.get(args.reference) or results[names[-1]]
+    baseline_cpu = results.get("pro", reference)["cpu_ms_per_scan"]
+    for r in results.values():
+        if args.dataset:
+            correct = sum(pred == label for pred, (label, _) in zip(r["predictions"], samples))
+            r["accuracy"] = round(correct / len(samples), 4)
+        else:
+            agree = sum(a == b for a, b in zip(r["predictions"], reference["predictions"]))
+            r["agreement"] = round(agree / len(samples), 4)
+        r["relative_cost"] = round(r["cpu_ms_per_scan"] / baseline_cpu, 3) if baseline_cpu else None
+
+    metric = "accuracy" if args.dataset else f"agree/{reference['profile']}"
+    print(f"\n  {len(samples)} images x {args.passes} passes")
+    print(f"  {'profile':<8}{'median ms':>11}{'p95 ms':>9}{'cpu ms':>9}{'scans/s':>9}{'cache':>8}{'cost':>7}{metric:>13}")
+    for r in results.values():
+        score = r.get("accuracy", r.get("agreement"))
+        print(f"  {r['profile']:<8}{r['median_ms']:>11.1f}{r['p95_ms']:>9.1f}{r['cpu_ms_per_scan']:>9.1f}"
+              f"{r['throughput_per_s']:>9.1f}{r['cache_hit_rate']:>8.0%}{r['relative_cost']:>6.2f}x{score:>13.1%}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(list(results.values()), f, indent=2)
+        print(f"\nResults written to {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Upload quality gate benchmark for Cerberus DeepCrystal
+Generates --photos synthetic stone photos per size and a degraded copy of
+each (out of focus, overexposed, underexposed, greyscale, thumbnail), runs
+them through the quality gate and prints the verdicts and the gate's cost
+per photo size next to the cost of one scan through the model, i.e. what a
+rejected photo saves. Uses the configured model backend
+(DEEPCRYSTAL_MODEL=stub for an offline run).
+
+Usage (from backend/):
+    python -m benchmarks quality-gate --photos 24 --sizes 640,1280,3000
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+from collections import Counter
+
+from PIL import Image, ImageEnhance, ImageFilter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import make_images, percentile
+from services.quality_gate import QualityGate
+
+DEGRADATIONS = {
+    "good": lambda img: img,
+    "blurred": lambda img: img.filter(ImageFilter.GaussianBlur(max(img.size) / 80)),
+    "overexposed": lambda img: ImageEnhance.Brightness(img).enhance(8.0),
+    "underexposed": lambda img: ImageEnhance.Brightness(img).enhance(0.05),
+    "greyscale": lambda img: img.convert("L").convert("RGB"),
+    "thumbnail": lambda img: img.resize((96, round(96 * img.size[1] / img.size[0]))),
+}
+
+
+def degrade(data: bytes, kind: str) -> bytes:
+    img = DEGRADATIONS[kind](Image.open(io.BytesIO(data)).convert("RGB"))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks quality-gate", description=__doc__.split("\n")[1])
+    p.add_argument("--photos", type=int, default=24, help="Photos per size")
+    p.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[640, 1280, 3000],
+                   help="Long side of the photos in pixels (4:3)")
+    p.add_argument("--mode", default="pro", help="Execution profile used for the model comparison")
+    args = p.parse_args(argv)
+
+    gate = QualityGate(enabled=True)
+    photos = {size: make_images(args.photos, seed=size, sizes=[(size, size * 3 // 4)]) for size in args.sizes}
+
+    print(f"  {'gate cost (good photos)':<26}{'p50 ms':>9}{'p99 ms':>9}")
+    for size, images in photos.items():
+        gate.inspect(images[0])  # warm up
+        ms = sorted(gate.inspect(im)["ms"] for im in images)
+        print(f"  {f'{size}x{size * 3 // 4}':<26}{percentile(ms, 0.5):>9.2f}{percentile(ms, 0.99):>9.2f}")
+
+    print(f"\n  {'verdicts':<16}" + "".join(f"{v:>9}" for v in ("pass", "flag", "reject")) + "   reasons")
+    for kind in DEGRADATIONS:
+        verdicts, reasons = Counter(), Counter()
+        for images in photos.values():
+            for im in images:
+                report = gate.inspect(degrade(im, kind))
+                verdicts[report["verdict"]] += 1
+                reasons.update(f"{r['check']}.{r['severity']}" for r in report["reasons"])
+        print(f"  {kind:<16}" + "".join(f"{verdicts[v]:>9}" for v in ("pass", "flag", "reject"))
+              + "   " + ", ".join(f"{name} {n}" for name, n in reasons.most_common(3)))
+
+    from services.ml_pipeline import analyze_views
+    from services.profiles import get_profile
+    profile = {**get_profile(args.mode), "cache_results": False}
+    images = photos[args.sizes[0]]
+    analyze_views([images[0]], None, profile)  # load model + text bank
+    start = time.perf_counter()
+    for im in images:
+        analyze_views([im], None, profile)
+    scan_ms = (time.perf_counter() - start) * 1000 / len(images)
+    status = gate.status()
+    print(f"\n  one {args.mode} scan through the model: {scan_ms:.1f} ms per photo "
+          f"({args.sizes[0]} px); the gate: {status['mean_ms']} ms mean")
+    print(f"  photos checked {status['photos_checked']}, rejection rate {status['rejection_rate']:.1%}, "
+          f"flag rate {status['flag_rate']:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
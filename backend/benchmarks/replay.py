@@ -0,0 +1,92 @@
+"""
+Scan capture and replay benchmark for Cerberus DeepCrystal
+Runs --scans synthetic scans (free, pro and lab in turn) through the
+pipeline and a capture recorder in a throwaway directory, reporting what
+recording a scan adds to the scan path. Then replays the capture set
+offline through the current configuration with each --workers count and
+prints replay throughput and top-1 agreement (100% expected: the same
+configuration), and once through --env, the candidate configuration.
+Uses DEEPCRYSTAL_MODEL=stub unless set.
+
+Usage (from backend/):
+    python -m benchmarks replay --scans 60 --workers 1,2,4 --env SPECTRAL_WEIGHT=0
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import make_images, percentile
+
+MODES = ("free", "pro", "lab")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks replay", description=__doc__.split("\n")[1])
+    p.add_argument("--scans", type=int, default=60)
+    p.add_argument("--size", type=int, default=640, help="Photo width in pixels (4:3)")
+    p.add_argument("--workers", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4])
+    p.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                   help="Candidate configuration for the last replay, e.g. TTA_STRATEGY=vote")
+    p.add_argument("--seed", type=int, default=11)
+    args = p.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-replay-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["BLOB_STORE_DIR"] = os.path.join(workdir, "blobs")
+    os.environ.setdefault("DEEPCRYSTAL_MODEL", "stub")
+    try:
+        from database import init_db
+        from services.blob_store import blob_store
+        from services.ml_pipeline import analyze_views
+        from services.profiles import get_profile
+        from services.replay import CaptureRecorder, compare, load_captures, replay
+        init_db()
+
+        recorder = CaptureRecorder(os.path.join(workdir, "captures"), rate=1.0)
+        photos = make_images(args.scans, seed=args.seed, sizes=[(args.size, args.size * 3 // 4)])
+        analyze_views(photos[:1], None, get_profile("pro"))  # load model + text bank
+        scan_ms, record_ms = [], []
+        for i, photo in enumerate(photos):
+            profile = {**get_profile(MODES[i % len(MODES)]), "cache_results": False}
+            manual = {"refractive_index": 1.76} if profile["name"] == "lab" else None
+            start = time.perf_counter()
+            result = analyze_views([photo], manual, profile)
+            scan_ms.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            recorder.record([photo], manual, None, profile, result)
+            record_ms.append((time.perf_counter() - start) * 1000)
+        blob_store.flush()
+        scan_ms.sort()
+        record_ms.sort()
+        print(f"  {args.scans} scans: scan p50 {percentile(scan_ms, 0.5):.1f} ms; recording a capture "
+              f"p50 {percentile(record_ms, 0.5):.2f} ms, p99 {percentile(record_ms, 0.99):.2f} ms")
+
+        captures = load_captures([recorder.root])
+        recorded = {c["id"]: {"id": c["id"], "output": c["output"], "stage_ms": c["stage_ms"]} for c in captures}
+        candidate_env = dict(pair.split("=", 1) for pair in args.env)
+        runs = [(w, {}) for w in args.workers] + ([(max(args.workers), candidate_env)] if candidate_env else [])
+        print(f"\n  {'replay':<34}{'workers':>8}{'seconds':>9}{'scans/s':>9}{'top-1 agree':>13}{'|conf d| p95':>14}")
+        for workers, env in runs:
+            start = time.perf_counter()
+            results = replay(captures, env, workers, os.environ["BLOB_STORE_DIR"])
+            elapsed = time.perf_counter() - start
+            summary = compare(captures, recorded, results)
+            label = " ".join(f"{k}={v}" for k, v in env.items()) or "current configuration"
+            print(f"  {label:<34}{workers:>8}{elapsed:>9.1f}{len(captures) / elapsed:>9.1f}"
+                  f"{summary['top1_agreement']:>13.1%}{summary['confidence_delta']['p95_abs']:>14.4f}")
+        print(f"\n  (replay time includes starting the workers and loading the model in each; "
+              f"{os.cpu_count()} CPU(s) here)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Streamed scan benchmark for Cerberus DeepCrystal
+Runs --scans scans through /api/analysis/scan and through the streaming
+variant /api/analysis/scan/stream, one at a time, and reports when the
+client saw the first result (the identification event) and the full report.
+Each scan uses a fresh random photo so the result cache never answers.
+Requests are handed straight to the ASGI app (no sockets).
+
+Usage (from backend/):
+    python -m benchmarks scan-stream --scans 20 --size 1024
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import make_images, percentile
+
+
+def make_upload(rng, size: int, mode: str) -> tuple:
+    """Multipart body and headers for one scan of a random synthetic stone photo."""
+    import httpx
+    photo = make_images(1, seed=int(rng.integers(1 << 31)), sizes=[(size, size)])[0]
+    request = httpx.Request("POST", "http://bench/", files={"image": ("stone.jpg", photo, "image/jpeg")},
+                            data={"mode": mode})
+    body = request.read()
+    return body, [(k.lower().encode(), v.encode()) for k, v in request.headers.items()]
+
+
+async def post(app, path: str, body: bytes, headers: list) -> dict:
+    """One POST through the ASGI app; returns the status and when each event (or the body) arrived."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"host", b"bench"), *headers], "client": ("127.0.0.1", 40000), "server": ("bench", 80)}
+    started = time.perf_counter()
+    sent = False
+    out = {"status": None, "events": {}, "body_ms": None}
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.sleep(3600)  # no disconnect while the response streams
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            elapsed = (time.perf_counter() - started) * 1000
+            for line in message.get("body", b"").decode().splitlines():
+                if line.startswith("event:"):
+                    out["events"].setdefault(line[6:].strip(), elapsed)
+            if not message.get("more_body"):
+                out["body_ms"] = elapsed
+
+    await app(scope, receive, send)
+    return out
+
+
+def summary(values: list) -> dict:
+    values = sorted(values)
+    return {"p50_ms": round(percentile(values, 0.5), 1), "p95_ms": round(percentile(values, 0.95), 1)}
+
+
+async def run(args) -> dict:
+    import main
+    rng = np.random.default_rng(args.seed)
+    plain, first, complete = [], [], []
+    async with main.app.router.lifespan_context(main.app):
+        await post(main.app, "/api/analysis/scan", *make_upload(rng, args.size, args.mode))  # warm up
+        for _ in range(args.scans):
+            result = await post(main.app, "/api/analysis/scan", *make_upload(rng, args.size, args.mode))
+            if result["status"] != 200:
+                raise RuntimeError(f"/scan returned {result['status']}")
+            plain.append(result["body_ms"])
+            result = await post(main.app, "/api/analysis/scan/stream", *make_upload(rng, args.size, args.mode))
+            if "complete" not in result["events"]:
+                raise RuntimeError(f"/scan/stream ended without a complete event: {result}")
+            first.append(result["events"]["identification"])
+            complete.append(result["events"]["complete"])
+    return {"scans": args.scans, "size": args.size, "mode": args.mode, "scan": summary(plain),
+            "stream_first_result": summary(first), "stream_complete": summary(complete)}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks scan-stream", description=__doc__.split("\n")[1])
+    p.add_argument("--scans", type=int, default=20)
+    p.add_argument("--size", type=int, default=1024, help="Photo width and height in pixels")
+    p.add_argument("--mode", default="pro", choices=["free", "pro", "lab"])
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write results to this JSON file")
+    args = p.parse_args(argv)
+
+    json_out = os.path.abspath(args.json_out) if args.json_out else None
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-stream-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'stream.db')}"
+    os.environ.setdefault("DEEPCRYSTAL_MODEL", "stub")
+    os.environ["SCAN_QUOTAS"] = "0"
+    os.chdir(workdir)  # QR codes, embeddings and the audit log land in the throwaway directory
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"  {args.scans} scans, {args.size} px, mode {args.mode}")
+    for label, key in (("/scan full report", "scan"), ("/scan/stream first result", "stream_first_result"),
+                       ("/scan/stream full report", "stream_complete")):
+        print(f"  {label:<28} p50 {results[key]['p50_ms']:>8} ms   p95 {results[key]['p95_ms']:>8} ms")
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
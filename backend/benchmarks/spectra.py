@@ -0,0 +1,117 @@
+"""
+Spectral library matching benchmark for Cerberus DeepCrystal
+Builds synthetic Raman libraries of --refs references (--minerals minerals,
+each with its own set of lines; references vary in line position, width,
+noise and fluorescence background) in a throwaway directory, then matches
+--queries noisy measured spectra and typed peak lists against each. Prints
+build time, library size on disk, match latency (vectorized over the whole
+library) next to scoring the references one at a time, and top-1 accuracy.
+
+Usage (from backend/):
+    python -m benchmarks spectra --refs 1000,10000,50000 --queries 200
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import percentile
+from services.catalogue import get_catalogue
+from services.spectral_library import KINDS, COSINE_WEIGHT, SpectralLibrary, from_peaks, prepare
+
+RAMAN_AXIS = np.arange(80.0, 1820.0, 0.9)  # a typical 785 nm instrument's sampling
+
+
+def make_minerals(count: int, rng) -> list:
+    """(name, line positions, line heights) per synthetic mineral."""
+    minerals = []
+    for i in range(count):
+        n = int(rng.integers(3, 9))
+        minerals.append((f"Mineral-{i:04d}", np.sort(rng.uniform(150, 1700, n)), rng.uniform(0.2, 1.0, n)))
+    return minerals
+
+
+def measure(mineral: tuple, rng, noise: float = 0.02) -> tuple:
+    """A measured spectrum of a mineral: shifted, broadened lines, fluorescence background and noise."""
+    _, lines, heights = mineral
+    lines = lines + rng.normal(0, 2.0, len(lines))
+    width = rng.uniform(4, 10)
+    y = (heights[:, None] / (1 + ((RAMAN_AXIS[None, :] - lines[:, None]) / (width / 2)) ** 2)).sum(axis=0)
+    y += rng.uniform(0, 1.5) * np.exp(-((RAMAN_AXIS - rng.uniform(600, 1600)) / 900) ** 2)  # fluorescence
+    y += rng.normal(0, noise, len(RAMAN_AXIS))
+    return RAMAN_AXIS, y * rng.uniform(100, 5000)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks spectra", description=__doc__.split("\n")[1])
+    p.add_argument("--refs", type=lambda s: [int(float(x)) for x in s.split(",")], default=[1000, 10000, 50000])
+    p.add_argument("--minerals", type=int, default=500)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--seed", type=int, default=5)
+    args = p.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    minerals = make_minerals(args.minerals, rng)
+    catalogue = get_catalogue()
+    print(f"  {'references':>10}{'build s':>9}{'MB':>8}{'p50 ms':>9}{'p99 ms':>9}{'one by one':>12}"
+          f"{'top-1 spectrum':>16}{'top-1 peaks':>13}")
+    for refs in args.refs:
+        root = tempfile.mkdtemp(prefix="deepcrystal-spectra-")
+        try:
+            library = SpectralLibrary(root)
+            records = ((("raman",) + (minerals[i % len(minerals)][0], f"ref-{i}") + measure(minerals[i % len(minerals)], rng))
+                       for i in range(refs))
+            start = time.perf_counter()
+            library.build(records)
+            build_s = time.perf_counter() - start
+            size_mb = sum(os.path.getsize(os.path.join(root, f)) for f in os.listdir(root)) / 1e6
+
+            picks = rng.integers(0, min(refs, len(minerals)), args.queries)
+            queries = [prepare("raman", *measure(minerals[i], rng, noise=0.05)) for i in picks]
+            library.match({"raman": queries[0]}, catalogue)  # page the library in
+            times, hits = [], 0
+            for i, query in zip(picks, queries):
+                t0 = time.perf_counter()
+                result = library.match({"raman": query}, catalogue, top=1)
+                times.append((time.perf_counter() - t0) * 1000)
+                hits += result["matches"][0]["mineral"] == minerals[i][0]
+            typed_hits = 0
+            for i in picks:
+                _, lines, heights = minerals[i]
+                strongest = lines[np.argsort(heights)[::-1][:4]] + rng.normal(0, 2.0, min(4, len(lines)))
+                result = library.match({"raman": from_peaks("raman", list(strongest))}, catalogue, top=1)
+                typed_hits += result["matches"][0]["mineral"] == minerals[i][0]
+
+            # The same scoring, one reference at a time
+            shelf = library._shelves["raman"]
+            vector, peaks = queries[0]
+            q = peaks[~np.isnan(peaks)]
+            sample = min(refs, 2000)
+            t0 = time.perf_counter()
+            for r in range(sample):
+                ref = np.asarray(shelf.vectors[r])
+                ref_peaks = shelf.peaks_t[:shelf.ref_peaks[r], r]
+                close = np.exp(-0.5 * ((ref_peaks[None, :] - q[:, None]) / KINDS["raman"]["tolerance"]) ** 2)
+                peak_score = 0.5 * (close.max(axis=1).mean() + close.max(axis=0).mean())
+                _ = COSINE_WEIGHT * float(ref @ vector) + (1 - COSINE_WEIGHT) * peak_score
+            loop_ms = (time.perf_counter() - t0) * 1000 * refs / sample
+
+            times.sort()
+            print(f"  {refs:>10}{build_s:>9.1f}{size_mb:>8.1f}{percentile(times, 0.5):>9.2f}"
+                  f"{percentile(times, 0.99):>9.2f}{loop_ms:>12.1f}{hits / len(picks):>16.1%}"
+                  f"{typed_hits / len(picks):>13.1%}")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
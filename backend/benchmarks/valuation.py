@@ -0,0 +1,73 @@
+"""
+Parcel valuation benchmark for Cerberus DeepCrystal
+Values random parcels of built-in gems with value_parcel (one vectorized pass)
+and with quote() called once per stone (how a client would price a lot
+through the scan path), checks both give the same per-stone prices, and
+reports the time per parcel.
+
+Usage (from backend/):
+    python -m benchmarks valuation --stones 10,100,1000,10000 --repeats 5
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ml_pipeline import GEM_DATA
+from services.valuation import TREATMENT_FACTORS, quote, value_parcel
+
+
+def make_parcel(n: int, seed: int) -> tuple:
+    rng = random.Random(seed)
+    gems, treatments = list(GEM_DATA), list(TREATMENT_FACTORS)
+    return ([rng.choice(gems) for _ in range(n)], [round(rng.uniform(0.2, 12.0), 2) for _ in range(n)],
+            [rng.choice(treatments) for _ in range(n)], [round(rng.uniform(0.3, 1.0), 3) for _ in range(n)])
+
+
+def _median_ms(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks valuation", description=__doc__.split("\n")[1])
+    p.add_argument("--stones", type=lambda s: [int(float(x)) for x in s.split(",")], default=[10, 100, 1000, 10000])
+    p.add_argument("--repeats", type=int, default=5)
+    p.add_argument("--currency", default="LKR")
+    p.add_argument("--seed", type=int, default=42)
+    args = p.parse_args(argv)
+
+    print(f"  {'stones':>7}{'parcel ms':>12}{'per-stone ms':>14}{'speedup':>10}{'stones/s':>14}")
+    for n in args.stones:
+        gems, carats, treatments, naturals = make_parcel(n, args.seed)
+
+        def vectorized():
+            return value_parcel(GEM_DATA, gems, carats, treatments, naturals, currency=args.currency)
+
+        def per_stone():
+            return [quote(GEM_DATA[g], c, t, q, currency=args.currency)
+                    for g, c, t, q in zip(gems, carats, treatments, naturals)]
+
+        items, quotes = vectorized()["items"], per_stone()
+        mismatched = sum((i["min_usd"], i["max_usd"], i["min_local"], i["max_local"])
+                         != (q["min_usd"], q["max_usd"], q["min_local"], q["max_local"]) for i, q in zip(items, quotes))
+        if mismatched:
+            print(f"  {n:>7}  {mismatched} stones priced differently by the two paths")
+            return 1
+        parcel_ms = _median_ms(vectorized, args.repeats)
+        loop_ms = _median_ms(per_stone, args.repeats)
+        print(f"  {n:>7}{parcel_ms:>12.2f}{loop_ms:>14.2f}{loop_ms / parcel_ms:>9.1f}x{n / parcel_ms * 1000:>14,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
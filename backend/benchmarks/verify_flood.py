@@ -0,0 +1,171 @@
+"""
+Certificate verification flood benchmark for Cerberus DeepCrystal
+Loads --certs synthetic certificates, then floods /api/blockchain/verify with
+random (never issued) ids at increasing open-loop rates while a probe
+verifies real certificates at --probe-rate. Requests are handed straight to
+the ASGI app (no sockets), so the numbers are the server's own cost per
+request; one process on one core stands in for one worker. Each rate runs
+with the certificate filter off (every id is a database lookup) and on.
+
+Usage (from backend/):
+    python -m benchmarks verify-flood --certs 200000 --rates 1000,2500,5000,10000
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import percentile
+
+
+def load_certs(engine, count: int, seed: int) -> list:
+    from database import BlockchainCert
+    rng = random.Random(f"certs-{seed}")
+    cert_ids, batch = [], []
+    with engine.begin() as conn:
+        for i in range(count):
+            cert_id = f"CDC-{rng.getrandbits(32):08X}-{rng.getrandbits(16):04X}"
+            cert_ids.append(cert_id)
+            batch.append({"cert_id": cert_id, "session_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                          "mineral_name": "Ruby", "confidence_score": 0.9, "hash_value": "0" * 64,
+                          "qr_path": f"/static/qrcodes/{cert_id}.png", "is_valid": True})
+            if len(batch) == 10_000 or i == count - 1:
+                conn.execute(BlockchainCert.__table__.insert(), batch)
+                batch = []
+    return cert_ids
+
+
+async def call(app, path: str) -> int:
+    """One GET through the ASGI app; returns the status code."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 40000), "server": ("bench", 80)}
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run_step(app, cert_ids: list, rate: float, probe_rate: float, duration: float, rng) -> dict:
+    loop = asyncio.get_running_loop()
+    flood, probe, tasks = [], [], []
+
+    async def timed(path, scheduled, samples, expected):
+        status = await call(app, path)
+        samples.append((loop.time() - scheduled, status == expected))
+
+    start = loop.time()
+    next_flood = start + rng.expovariate(rate)
+    next_probe = start + rng.expovariate(probe_rate)
+    while True:
+        now = loop.time()
+        if now - start >= duration:
+            break
+        while next_flood <= now:  # launch every arrival that is due (open loop)
+            bogus = f"CDC-{rng.getrandbits(32):08X}-{rng.getrandbits(16):04X}"
+            tasks.append(asyncio.create_task(timed(f"/api/blockchain/verify/{bogus}", next_flood, flood, 404)))
+            next_flood += rng.expovariate(rate)
+        while next_probe <= now:
+            tasks.append(asyncio.create_task(
+                timed(f"/api/blockchain/verify/{rng.choice(cert_ids)}", next_probe, probe, 200)))
+            next_probe += rng.expovariate(probe_rate)
+        await asyncio.sleep(max(0.0, min(next_flood, next_probe) - loop.time()))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    def stats(samples):
+        latencies = sorted(s[0] * 1000 for s in samples)
+        return {"requests": len(samples), "errors": sum(not ok for _, ok in samples),
+                **{q: round(percentile(latencies, p), 2) if latencies else None
+                   for q, p in (("p50_ms", 0.5), ("p99_ms", 0.99), ("max_ms", 1.0))}}
+
+    return {"rate": rate, "achieved_rps": round((len(flood) + len(probe)) / elapsed),
+            "flood": stats(flood), "probe": stats(probe)}
+
+
+async def run(args) -> dict:
+    import main
+    from database import engine, init_db
+    from services.cert_registry import registry
+    init_db()
+    print(f"Loading {args.certs:,} certificates...")
+    cert_ids = load_certs(engine, args.certs, args.seed)
+    registry.enabled = False  # the lifespan must not build the filter; each mode sets it up below
+    results = {"certs": args.certs, "steps": []}
+    async with main.app.router.lifespan_context(main.app):
+        for mode in args.modes:
+            if mode == "on":
+                registry.rebuild()
+            else:
+                registry.filter, registry.revoked = None, {}
+            for i, rate in enumerate(args.rates):
+                await call(main.app, f"/api/blockchain/verify/{cert_ids[0]}")  # warm up
+                step = await run_step(main.app, cert_ids, rate, args.probe_rate, args.duration,
+                                      random.Random(f"flood-{args.seed}-{i}"))
+                step["filter"] = mode
+                results["steps"].append(step)
+                f, p = step["flood"], step["probe"]
+                print(f"  filter {mode:<3}{rate:>9,.0f}/s offered {step['achieved_rps']:>8,}/s done   "
+                      f"bogus p50 {f['p50_ms']:>8} ms p99 {f['p99_ms']:>9} ms   "
+                      f"valid p50 {p['p50_ms']:>8} ms p99 {p['p99_ms']:>9} ms   errors {f['errors'] + p['errors']}")
+        results["registry"] = registry.status()
+    return results
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks verify-flood", description=__doc__.split("\n")[1])
+    p.add_argument("--certs", type=lambda s: int(float(s)), default=200_000, help="Issued certificates in the database")
+    p.add_argument("--rates", type=lambda s: [float(x) for x in s.split(",")], default=[1000, 2500, 5000, 10000],
+                   help="Flood rates of random ids (requests/s)")
+    p.add_argument("--probe-rate", type=float, default=50.0, help="Verifications of real certificates per second")
+    p.add_argument("--duration", type=float, default=5.0, help="Seconds per rate step")
+    p.add_argument("--modes", type=lambda s: s.split(","), default=["off", "on"], help="Filter off,on")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write results to this JSON file")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    json_out = os.path.abspath(args.json_out) if args.json_out else None
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-verify-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'verify.db')}"
+    os.environ.setdefault("DEEPCRYSTAL_MODEL", "stub")
+    os.environ["SCAN_QUOTAS"] = "0"
+    os.chdir(workdir)
+    started = time.perf_counter()
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"Done in {time.perf_counter() - started:.0f} s. Filter: {results['registry']['filter_bytes']:,} bytes, "
+          f"{results['registry']['rejected']:,} rejected in memory, {results['registry']['false_positives']} false positives")
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
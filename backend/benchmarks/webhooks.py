@@ -0,0 +1,185 @@
+"""
+Webhook delivery benchmark for Cerberus DeepCrystal
+Starts stand-in receivers (one per destination, each on its own port, so
+per-host concurrency limits apply separately) that verify signatures, answer
+after --latency-ms and fail a --fail-rate fraction of requests with 503. Events
+are queued into the outbox either all at once (burst) or at --rate per second,
+and the dispatcher delivers them. Reports delivery throughput, lag
+(event created -> delivered) and retries, and checks every event arrived once.
+
+Usage (from backend/):
+    python -m benchmarks webhooks --events 5000 --destinations 4 --latency-ms 20
+    python -m benchmarks webhooks --rate 200 --duration 20 --fail-rate 0.1
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import free_port, percentile
+
+
+class Receiver:
+    """Minimal ASGI webhook endpoint: checks the signature, sleeps, then answers 200 or 503."""
+
+    def __init__(self, secret: str, latency: float, fail_rate: float, seed: int):
+        self.secret = secret
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.received = {}  # delivery id -> successful receipts
+        self.requests = 0
+        self.bad_signatures = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        from services.webhooks import sign
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        headers = dict(scope["headers"])
+        self.requests += 1
+        if headers.get(b"x-deepcrystal-signature", b"").decode() != sign(self.secret, body):
+            self.bad_signatures += 1
+        await asyncio.sleep(self.latency)
+        status = 503 if self.rng.random() < self.fail_rate else 200
+        if status == 200:
+            delivery = json.loads(body)["delivery_id"]
+            self.received[delivery] = self.received.get(delivery, 0) + 1
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-length", b"0")]})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def start_receiver(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           lifespan="off", access_log=False))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+def queue_events(engine, dispatcher, client_id: str, count: int):
+    with engine.begin() as conn:
+        for i in range(count):
+            dispatcher.enqueue(conn, client_id, "scan.completed", {"session_id": f"bench-{i}", "mineral_name": "Ruby"})
+
+
+async def run(args) -> dict:
+    from database import engine, init_db, SessionLocal
+    from services.webhooks import dispatcher
+    init_db()
+    receivers, servers = [], []
+    db = SessionLocal()
+    try:
+        for d in range(args.destinations):
+            port = free_port()
+            subscription = dispatcher.subscribe(db, "bench-client", f"http://127.0.0.1:{port}/hook")
+            receiver = Receiver(subscription.secret, args.latency_ms / 1000, args.fail_rate, args.seed + d)
+            receivers.append(receiver)
+            servers.append(await start_receiver(receiver, port))
+    finally:
+        db.close()
+
+    await dispatcher.start()
+    start = time.perf_counter()
+    queued = 0
+    if args.rate:
+        interval, next_at = 1.0 / args.rate, time.perf_counter()
+        while time.perf_counter() - start < args.duration:
+            await asyncio.to_thread(queue_events, engine, dispatcher, "bench-client", 1)
+            dispatcher.notify()
+            queued += 1
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    else:
+        await asyncio.to_thread(queue_events, engine, dispatcher, "bench-client", args.events)
+        dispatcher.notify()
+        queued = args.events
+    expected = queued * args.destinations
+    deadline = time.perf_counter() + args.timeout
+    while dispatcher.delivered + dispatcher.failed < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    lags = sorted(dispatcher._lags)
+    stats = await asyncio.to_thread(dispatcher.stats)
+    await dispatcher.stop()
+    for server, task in servers:
+        server.should_exit = True
+        await task
+
+    received = sum(len(r.received) for r in receivers)
+    return {
+        "events": queued,
+        "deliveries_expected": expected,
+        "delivered": dispatcher.delivered,
+        "failed": dispatcher.failed,
+        "retries": dispatcher.retried,
+        "duplicates": sum(n - 1 for r in receivers for n in r.received.values()),
+        "missing": expected - received,
+        "bad_signatures": sum(r.bad_signatures for r in receivers),
+        "receiver_requests": sum(r.requests for r in receivers),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(dispatcher.delivered / elapsed, 1) if elapsed else None,
+        "lag_ms": {q: round(percentile(lags, p) * 1000, 1) if lags else None
+                   for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))},
+        "outbox": stats["outbox"],
+    }
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks webhooks", description=__doc__.split("\n")[1])
+    p.add_argument("--events", type=int, default=2000, help="Events queued at once (burst mode)")
+    p.add_argument("--rate", type=float, default=0, help="Queue events at this rate per second instead of a burst")
+    p.add_argument("--duration", type=float, default=10.0, help="Seconds of queuing in rate mode")
+    p.add_argument("--destinations", type=int, default=2, help="Subscribed receivers (each gets every event)")
+    p.add_argument("--latency-ms", type=float, default=10.0, help="Receiver response time")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    p.add_argument("--timeout", type=float, default=120.0, help="Give up waiting for deliveries after this (s)")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write results to this JSON file")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    json_out = os.path.abspath(args.json_out) if args.json_out else None
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-webhooks-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'webhooks.db')}"
+    os.environ.setdefault("WEBHOOK_BACKOFF_BASE", "0.05")  # retries within the run
+    os.environ["WEBHOOK_ALLOW_PRIVATE"] = "1"  # the stand-in receivers listen on 127.0.0.1
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    lag = results["lag_ms"]
+    print(f"{results['delivered']:,}/{results['deliveries_expected']:,} deliveries in {results['elapsed_s']} s "
+          f"= {results['throughput_per_s']:,} /s  ({results['retries']} retries, {results['failed']} gave up)")
+    print(f"Lag created -> delivered: p50 {lag['p50']} ms · p95 {lag['p95']} ms · p99 {lag['p99']} ms · max {lag['max']} ms")
+    print(f"Missing {results['missing']}, duplicates {results['duplicates']}, bad signatures {results['bad_signatures']}")
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Multi-worker memory benchmark for Cerberus DeepCrystal
+Starts Gunicorn with 1, 2, 4... workers, with and without the pre-fork model
+load (PRELOAD_MODEL), drives scans through every configuration and reads
+GET /api/admin/memory. Reports each worker's unique memory (USS) and the
+total proportional memory (PSS) of master + workers, i.e. what the
+deployment really costs as workers are added.
+
+Usage (from backend/, Linux):
+    python -m benchmarks workers --workers 1,2,4
+    python -m benchmarks workers --model clip --workers 1,2,4,8 --scans 64
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from benchmarks.load_test import BACKEND_DIR, free_port, make_images, prepare_environment
+
+
+def start_gunicorn(workdir: str, workers: int, preload: bool, env: dict):
+    port = free_port()
+    cmd = [sys.executable, "-m", "gunicorn", "main:app", "-c", os.path.join(BACKEND_DIR, "gunicorn.conf.py"),
+           "--pythonpath", BACKEND_DIR, "--log-level", "warning"]
+    env = {**os.environ, **env, "BIND": f"127.0.0.1:{port}", "WEB_CONCURRENCY": str(workers),
+           "PRELOAD_MODEL": "1" if preload else "0"}
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("Gunicorn exited during startup.")
+        try:
+            if httpx.get(base_url + "/", timeout=1.0).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError("Gunicorn did not become ready within 300 s.")
+
+
+async def drive(base_url: str, images: list, scans: int, concurrency: int) -> dict:
+    """Runs scans concurrently so every worker loads what it needs, then reads the memory report."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+        queue = asyncio.Queue()
+        for i in range(scans):
+            queue.put_nowait(images[i % len(images)])
+        failures = 0
+
+        async def scanner():
+            nonlocal failures
+            while not queue.empty():
+                image = queue.get_nowait()
+                r = await client.post("/api/analysis/scan", files={"image": ("stone.jpg", image, "image/jpeg")},
+                                      data={"mode": "pro"})
+                failures += r.status_code != 200
+
+        await asyncio.gather(*[scanner() for _ in range(concurrency)])
+        report = (await client.get("/api/admin/memory")).json()
+    report["failed_scans"] = failures
+    return report
+
+
+def measure(workdir: str, env: dict, workers: int, preload: bool, args) -> dict:
+    proc, base_url = start_gunicorn(workdir, workers, preload, env)
+    try:
+        report = asyncio.run(drive(base_url, make_images(args.images, args.seed), args.scans,
+                                   max(args.concurrency, 2 * workers)))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    uss = [w["uss_mib"] for w in report["workers"]]
+    return {
+        "workers": workers,
+        "preload": preload,
+        "master_uss_mib": report["master"]["uss_mib"] if report["master"] else None,
+        "worker_uss_mib": round(sum(uss) / len(uss), 1) if uss else None,
+        "total_pss_mib": report["totals"]["pss_mib"],
+        "total_rss_mib": report["totals"]["rss_mib"],
+        "failed_scans": report["failed_scans"],
+        "report": report,
+    }
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m benchmarks workers", description=__doc__.split("\n")[1])
+    p.add_argument("--workers", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4],
+                   help="Comma-separated worker counts")
+    p.add_argument("--model", choices=["stub", "clip"], default="stub", help="Vision model backend")
+    p.add_argument("--scans", type=int, default=32, help="Scans per configuration before measuring")
+    p.add_argument("--concurrency", type=int, default=8, help="Concurrent scan requests (at least 2 per worker)")
+    p.add_argument("--images", type=int, default=8, help="Distinct synthetic images to upload")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", help="Write full results to this JSON file")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    json_out = os.path.abspath(args.json_out) if args.json_out else None
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-workers-")
+    results = []
+    try:
+        env = {**prepare_environment(workdir), "DEEPCRYSTAL_MODEL": args.model}
+        print(f"{'workers':>7} {'preload':>8} {'master USS':>11} {'worker USS':>11} {'total PSS':>10} "
+              f"{'total RSS':>10}   (MiB)")
+        for workers in args.workers:
+            for preload in (False, True):
+                row = measure(workdir, env, workers, preload, args)
+                results.append(row)
+                master = "-" if row["master_uss_mib"] is None else f"{row['master_uss_mib']:.1f}"
+                print(f"{workers:>7} {'yes' if preload else 'no':>8} {master:>11} {row['worker_uss_mib']:>11.1f} "
+                      f"{row['total_pss_mib']:>10.1f} {row['total_rss_mib']:>10.1f}"
+                      + (f"   {row['failed_scans']} scans failed" if row["failed_scans"] else ""))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if len(args.workers) > 1:
+        lo, hi = min(args.workers), max(args.workers)
+        for preload in (False, True):
+            pss = {r["workers"]: r["total_pss_mib"] for r in results if r["preload"] == preload}
+            print(f"Marginal PSS per extra worker ({'preload' if preload else 'no preload'}): "
+                  f"{(pss[hi] - pss[lo]) / (hi - lo):.1f} MiB")
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
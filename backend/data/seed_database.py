@@ -8,60 +8,42 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import engine, Base, Mineral, SessionLocal, init_db
+from database import engine, Base, init_db
 from services.ml_pipeline import GEM_DATA
+from services.catalogue import mineral_fields
+from services.mineral_import import MineralImporter
 
 EXTENDED_MINERALS = []
 
 
-def seed_database():
-    init_db()
-    db = SessionLocal()
-
-    print("Seeding mineral database...")
-
-    # Seed from ML pipeline GEM_DATA
+def seed_records():
+    """Minerals rows for the built-in gems (GEM_DATA) followed by EXTENDED_MINERALS."""
     for name, data in GEM_DATA.items():
-        existing = db.query(Mineral).filter(Mineral.name == name).first()
-        if not existing:
-            m = Mineral(
-                name=name,
-                chemical_formula=data["formula"],
-                crystal_system=data["crystal_system"],
-                mohs_hardness_min=data["mohs"][0],
-                mohs_hardness_max=data["mohs"][1],
-                specific_gravity_min=data["sg"][0],
-                specific_gravity_max=data["sg"][1],
-                refractive_index_min=data["ri"][0],
-                refractive_index_max=data["ri"][1],
-                luster=data["luster"],
-                transparency=data["transparency"],
-                streak=data["streak"],
-                geological_class=data["geological_class"],
-                category=data["category"],
-                color=data.get("color", "Variable"),
-                known_origins=", ".join([f"{c} ({p:.0%})" for c, p in data["origins"]]),
-                common_treatments=", ".join(data["treatments"]),
-                price_min_usd=data["price_min"],
-                price_max_usd=data["price_max"],
-                price_unit="per carat",
-                uv_fluorescence=data.get("uv", ""),
-                cleavage="See technical references",
-                fracture="Conchoidal",
-                description=f"{name} gemstone data from Cerberus DeepCrystal knowledge base.",
-            )
-            db.add(m)
+        yield dict(
+            name=name,
+            **mineral_fields(name, data),
+            price_unit="per carat",
+            cleavage="See technical references",
+            fracture="Conchoidal",
+            description=f"{name} gemstone data from Cerberus DeepCrystal knowledge base.",
+        )
+    yield from EXTENDED_MINERALS
+
+
+def seed_database(target_engine=None):
+    """Seed the configured database, or `target_engine` when given (benchmarks, tests)."""
+    if target_engine is None:
+        init_db()
+        target_engine = engine
+    else:
+        Base.metadata.create_all(bind=target_engine)
 
-    # Seed extended minerals
-    for mineral_data in EXTENDED_MINERALS:
-        existing = db.query(Mineral).filter(Mineral.name == mineral_data["name"]).first()
-        if not existing:
-            m = Mineral(**{k: v for k, v in mineral_data.items()})
-            db.add(m)
-
-    db.commit()
-    print(f"Database seeded. Total minerals: {db.query(Mineral).count()}")
-    db.close()
+    print("Seeding mineral database...")
+    # Existing rows are kept; one set-based insert instead of a lookup per gem (see services/mineral_import.py)
+    stats = MineralImporter(target_engine, on_conflict="skip").run(seed_records())
+    for err in stats["errors"]:
+        print(f"  skipped seed record {err['record']}: {err['error']}")
+    print(f"Database seeded. Added {stats['inserted']} minerals, {stats['skipped']} already present.")
 
 
 if __name__ == "__main__":
@@ -3,7 +3,7 @@ Database setup for Cerberus DeepCrystal
 PostgreSQL + SQLAlchemy connection
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, Boolean, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, Date, DateTime, Boolean, JSON, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -88,9 +88,31 @@ class AnalysisReport(Base):
     origin_prediction = Column(JSON)
     confidence_score = Column(Float)
     mode = Column(String, default="pro")  # free, pro, lab
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ArchiveFile(Base):
+    """A Parquet file of the report archive (see services/archive.py)."""
+    __tablename__ = "archive_files"
+    id = Column(Integer, primary_key=True)
+    path = Column(String, unique=True)  # relative to ARCHIVE_DIR
+    reports = Column(Integer)
+    size = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class ArchivedReport(Base):
+    """Slim index of a report moved to the report archive."""
+    __tablename__ = "archived_reports"
+    session_id = Column(String, primary_key=True)
+    blockchain_id = Column(String, index=True)
+    mineral_name = Column(String)
+    created_at = Column(DateTime)
+    file_id = Column(Integer)
+    row_group = Column(Integer)
+    row = Column(Integer)  # within the row group
+
+
 class BlockchainCert(Base):
     __tablename__ = "blockchain_certs"
     id = Column(Integer, primary_key=True, index=True)
@@ -104,6 +126,110 @@ class BlockchainCert(Base):
     is_valid = Column(Boolean, default=True)
 
 
+class CertRevocation(Base):
+    """A revoked certificate (kept in memory by services/cert_registry.py for /verify)."""
+    __tablename__ = "cert_revocations"
+    id = Column(Integer, primary_key=True)
+    cert_id = Column(String, unique=True, index=True)
+    reason = Column(String, nullable=True)
+    revoked_by = Column(String, nullable=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ReportRollup(Base):
+    """Aggregates of analysis_reports per day, mineral and mode (maintained by services/rollups.py)."""
+    __tablename__ = "report_rollups"
+    __table_args__ = (UniqueConstraint("day", "mineral_name", "mode", name="uq_report_rollup"),)
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, index=True)
+    mineral_name = Column(String)
+    mode = Column(String)
+    scans = Column(Integer, default=0)
+    confidence_sum = Column(Float, default=0.0)
+    natural_probability_sum = Column(Float, default=0.0)
+    synthetic_probability_sum = Column(Float, default=0.0)
+    price_min_usd_sum = Column(Float, default=0.0)
+    price_max_usd_sum = Column(Float, default=0.0)
+    # scans per dominant treatment
+    treatment_natural = Column(Integer, default=0)
+    treatment_heat = Column(Integer, default=0)
+    treatment_glass_filled = Column(Integer, default=0)
+    treatment_diffusion = Column(Integer, default=0)
+    treatment_resin_filled = Column(Integer, default=0)
+    treatment_laser_drilled = Column(Integer, default=0)
+    treatment_coated = Column(Integer, default=0)
+    treatment_synthetic = Column(Integer, default=0)
+    treatment_other = Column(Integer, default=0)
+    # scans per price band of price_max_usd
+    price_band_0 = Column(Integer, default=0)  # < $100
+    price_band_1 = Column(Integer, default=0)  # $100 - 1k
+    price_band_2 = Column(Integer, default=0)  # $1k - 10k
+    price_band_3 = Column(Integer, default=0)  # $10k - 100k
+    price_band_4 = Column(Integer, default=0)  # >= $100k
+
+
+class ScanQuota(Base):
+    """Persisted token bucket of one client on one tier (see services/quotas.py); full buckets have no row."""
+    __tablename__ = "scan_quotas"
+    __table_args__ = (UniqueConstraint("tier", "client_id", name="uq_scan_quota"),)
+    id = Column(Integer, primary_key=True)
+    tier = Column(String)
+    client_id = Column(String)
+    tokens = Column(Float)
+    updated_at = Column(DateTime)
+
+
+class WebhookSubscription(Base):
+    """A client's webhook endpoint (see services/webhooks.py)."""
+    __tablename__ = "webhook_subscriptions"
+    id = Column(Integer, primary_key=True)
+    client_id = Column(String, index=True)
+    url = Column(String)
+    secret = Column(String)  # HMAC key for X-DeepCrystal-Signature
+    events = Column(JSON)
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class WebhookOutbox(Base):
+    """One pending or finished delivery of an event to a subscription."""
+    __tablename__ = "webhook_outbox"
+    __table_args__ = (Index("ix_webhook_outbox_due", "status", "next_attempt_at"),)
+    id = Column(Integer, primary_key=True)
+    subscription_id = Column(Integer, index=True)
+    event = Column(String)
+    payload = Column(JSON)
+    status = Column(String, default="pending")  # pending, delivered, failed, cancelled
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime)
+    lease_owner = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+
+
+class EvidenceBlob(Base):
+    """An original upload kept as evidence, stored by content hash (see services/blob_store.py)."""
+    __tablename__ = "evidence_blobs"
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer)
+    content_type = Column(String)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    has_thumbnail = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ReportBlob(Base):
+    """Links a report to the evidence blob of each of its views."""
+    __tablename__ = "report_blobs"
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String, index=True)
+    sha256 = Column(String(64), index=True)
+    view = Column(Integer, default=0)
+    filename = Column(String, nullable=True)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -114,3 +240,6 @@ def get_db():
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist
+    for index in AnalysisReport.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
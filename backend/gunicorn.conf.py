@@ -0,0 +1,30 @@
+"""
+Gunicorn configuration for Cerberus DeepCrystal (multi-worker deployment, Linux/macOS)
+Usage (from backend/):  gunicorn main:app -c gunicorn.conf.py
+
+The app, the vision model and the prompt embedding bank are loaded once in
+the master and shared copy-on-write by every worker (services/prefork.py).
+Set PRELOAD_MODEL=0 to have each worker load its own copy instead.
+Author: Sudeepa Wanigarathna
+"""
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "1") == "1"
+preload_app = PRELOAD_MODEL
+
+
+def when_ready(server):
+    if PRELOAD_MODEL:
+        from services.prefork import prepare_for_fork
+        prepare_for_fork()
+
+
+def post_fork(server, worker):
+    from services.prefork import after_fork
+    after_fork(server.cfg.workers)
@@ -4,20 +4,53 @@ Author: Sudeepa Wanigarathna
 Backend: FastAPI
 """
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
 
-from routers import analysis, blockchain, database, auth
+from routers import analysis, blockchain, database, auth, admin, webhooks, evidence
+from services.audit_log import audit
+from services.blob_store import blob_store
+from services.catalogue import catalogue
+from services.cert_registry import registry, VerifyFastPathMiddleware
+from services.quotas import AdmissionMiddleware, quotas, QUOTA_ENFORCEMENT
+from services.scan_feed import scan_feed
+from services.webhooks import dispatcher
+
+quotas.configure({name: tier["scans_per_day"] for name, tier in auth.TIERS.items()})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    catalogue.start_watcher()  # no-op unless CATALOGUE_WATCH_INTERVAL > 0
+    if QUOTA_ENFORCEMENT:
+        quotas.start()
+    await dispatcher.start()
+    audit.start()
+    registry.start()  # certificate filter, built in the background
+    await scan_feed.start()
+    yield
+    await scan_feed.stop()
+    registry.stop()
+    await dispatcher.stop()
+    quotas.stop()
+    blob_store.flush(timeout=30)  # evidence uploads still being written
+    audit.stop()  # writes and fsyncs the queued audit events
+
 
 app = FastAPI(
     title="Cerberus DeepCrystal API",
     description="Advanced AI-Powered Mineral & Gemstone Forensic Laboratory",
     version="1.0.0",
     contact={"name": "Sudeepa Wanigarathna"},
+    lifespan=lifespan,
 )
 
+# Scan quotas are checked before the upload body is read (inside CORS, so 429s carry CORS headers)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(VerifyFastPathMiddleware)  # unknown/revoked certificate ids never reach routing
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,6 +67,9 @@ app.include_router(analysis.router, prefix="/api/analysis", tags=["Analysis"])
 app.include_router(blockchain.router, prefix="/api/blockchain", tags=["Blockchain"])
 app.include_router(database.router, prefix="/api/database", tags=["Database"])
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
+app.include_router(webhooks.router, prefix="/api/webhooks", tags=["Webhooks"])
+app.include_router(evidence.router, prefix="/api/evidence", tags=["Evidence"])
 
 
 @app.get("/")
@@ -16,6 +16,10 @@ class ManualInputs(BaseModel):
     hardness_result: Optional[float] = None
     carat_weight: Optional[float] = None
     uv_fluorescence: Optional[str] = None
+    # Lab mode: typed peak positions, e.g. "418, 378, 750" (full spectra are uploaded as files)
+    raman: Optional[str] = None
+    ftir: Optional[str] = None
+    uv_vis: Optional[str] = None
 
 
 class InclusionAnalysis(BaseModel):
@@ -77,6 +81,54 @@ class OpticalProperties(BaseModel):
     dispersion: Optional[float] = None
 
 
+class SimilarScan(BaseModel):
+    session_id: str
+    similarity: float
+    mineral_name: Optional[str] = None
+    blockchain_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+class ViewConfidence(BaseModel):
+    view: int
+    filename: Optional[str] = None
+    top_gem: str
+    top_probability: float
+    fused_gem_probability: float
+
+
+class TTAReport(BaseModel):
+    augmentations: int
+    strategy: str
+    agreement: float  # share of augmentations agreeing with the aggregate top-1
+
+
+class SpectralMatch(BaseModel):
+    kind: str  # raman, ftir, uv_vis
+    mineral: str
+    source: str  # reference spectrum id
+    score: float  # cosine and peak-position score combined
+    cosine: float
+    peak_score: float
+    gems: List[str] = []  # catalogue gems this mineral supports
+
+
+class QualityReason(BaseModel):
+    check: str  # resolution, stone_area, sharpness, exposure, colour, graphic, unreadable
+    severity: str  # flag or reject
+    message: str
+    value: Optional[float] = None
+    threshold: Optional[float] = None
+    view: int = 0
+    filename: Optional[str] = None
+
+
+class QualityReport(BaseModel):
+    verdict: str  # pass or flag (rejected uploads get 422 instead of a report)
+    reasons: List[QualityReason] = []
+    ms: float
+
+
 class AnalysisRequest(BaseModel):
     manual_inputs: Optional[ManualInputs] = None
     mode: str = "pro"  # free, pro, lab
@@ -107,6 +159,12 @@ class AnalysisResponse(BaseModel):
     mode: str
     analysis_timestamp: datetime
     qr_code_url: Optional[str] = None
+    view_confidences: List[ViewConfidence] = []
+    tta: Optional[TTAReport] = None
+    quality: Optional[QualityReport] = None
+    spectral_matches: Optional[List[SpectralMatch]] = None
+    seen_before: bool = False
+    similar_scans: List[SimilarScan] = []
 
 
 class MineralDB(BaseModel):
@@ -134,6 +192,11 @@ class MineralDB(BaseModel):
     description: Optional[str] = None
     uv_fluorescence: Optional[str] = None
     inclusion_patterns: Optional[str] = None
+    transparency: Optional[str] = None
+    optical_properties: Optional[str] = None
+    birefringence: Optional[float] = None
+    pleochroism: Optional[str] = None
+    price_unit: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -148,3 +211,42 @@ class BlockchainCertResponse(BaseModel):
     qr_code_url: str
     verification_url: str
     is_valid: bool
+
+
+class ParcelStone(BaseModel):
+    gem: str  # catalogue name, e.g. "Blue Sapphire"
+    carat: float
+    treatment: str = "Natural (Untreated)"  # display name or treatment_probs key ("heat_treated")
+    natural_probability: float = 1.0
+
+
+class ValuationRequest(BaseModel):
+    stones: List[ParcelStone]
+    currency: str = "LKR"
+    include_stones: bool = True  # per-stone prices in "items"
+
+
+class CatalogueDocument(BaseModel):
+    prompt_templates: Optional[List[str]] = None  # each contains "{gem}"
+    gems: Dict[str, Optional[Dict[str, Any]]] = {}  # GEM_DATA-style entries; null removes a gem
+
+
+class CertRevocationRequest(BaseModel):
+    reason: Optional[str] = None
+
+
+class WebhookSubscriptionRequest(BaseModel):
+    url: str
+    events: Optional[List[str]] = None  # default: every event
+
+
+class WebhookSubscriptionResponse(BaseModel):
+    id: int
+    url: str
+    events: List[str]
+    active: bool
+    created_at: datetime
+    secret: Optional[str] = None  # only returned when the subscription is created
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,210 @@
+"""
+Admin router for Cerberus DeepCrystal
+Runtime gem catalogue management (see services/catalogue.py), per-worker
+memory reporting (see services/prefork.py), scan quota counters
+(see services/quotas.py), webhook delivery stats (see services/webhooks.py),
+evidence store stats (see services/blob_store.py), audit log queries
+(see services/audit_log.py), the exchange rate table (see
+services/valuation.py), the certificate filter (see
+services/cert_registry.py), the live scan feed (see
+services/scan_feed.py), scan pipeline stage timings (see
+services/pipeline.py), the upload quality gate (see
+services/quality_gate.py), the spectral reference library (see
+services/spectral_library.py), scan captures (see services/replay.py) and
+the report archive (see services/archive.py).
+When ADMIN_TOKEN is set, requests must carry it in the X-Admin-Token header.
+Endpoints that change data or serve retained photos (catalogue PUT,
+certificate revocation, evidence) refuse every request while it is unset.
+"""
+
+import os
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from database import get_db
+from models.schemas import CatalogueDocument
+from services.archive import report_archive
+from services.audit_log import audit, verify_all
+from services.blob_store import blob_store
+from services.catalogue import catalogue, CatalogueError
+from services.cert_registry import registry
+from services.ml_pipeline import SCAN_PIPELINE
+from services.prefork import memory_report
+from services.quality_gate import quality_gate
+from services.quotas import quotas
+from services.replay import recorder
+from services.scan_feed import scan_feed
+from services.spectral_library import spectral_library
+from services.valuation import rates
+from services.webhooks import dispatcher
+
+router = APIRouter()
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Like require_admin, but fails closed: without ADMIN_TOKEN configured nobody gets in."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="ADMIN_TOKEN is not set on the server; this endpoint is disabled.")
+    require_admin(x_admin_token)
+
+
+@router.get("/catalogue", dependencies=[Depends(require_admin)])
+def catalogue_status():
+    return catalogue.status()
+
+
+@router.post("/catalogue/reload", dependencies=[Depends(require_admin)])
+def reload_catalogue():
+    """Re-reads CATALOGUE_FILE; only new or changed prompts are encoded."""
+    try:
+        return catalogue.reload()
+    except (CatalogueError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Catalogue rejected: {e}")
+
+
+@router.put("/catalogue", dependencies=[Depends(require_admin_token)])
+def replace_catalogue(document: CatalogueDocument):
+    """Writes the catalogue overlay to CATALOGUE_FILE and reloads it (nodes watching the file follow)."""
+    try:
+        return catalogue.write(document.model_dump())
+    except (CatalogueError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Catalogue rejected: {e}")
+
+
+@router.get("/rates", dependencies=[Depends(require_admin)])
+def rate_table():
+    return rates.status()
+
+
+@router.post("/rates/reload", dependencies=[Depends(require_admin)])
+def reload_rates():
+    """Re-reads RATES_FILE now instead of waiting for the next change check."""
+    try:
+        return rates.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Exchange rates rejected: {e}")
+
+
+@router.get("/spectra", dependencies=[Depends(require_admin)])
+def spectra_status():
+    """References and minerals per spectrum kind, and matching latency in this worker."""
+    return spectral_library.status()
+
+
+@router.post("/spectra/reload", dependencies=[Depends(require_admin)])
+def reload_spectra():
+    """Re-opens the library files after `python -m services.spectral_library build`."""
+    try:
+        return spectral_library.load()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Spectral library rejected: {e}")
+
+
+@router.get("/certificates", dependencies=[Depends(require_admin)])
+def certificate_filter():
+    """Size, fill and hit counters of this worker's certificate filter."""
+    return registry.status()
+
+
+@router.post("/certificates/rebuild", dependencies=[Depends(require_admin)])
+def rebuild_certificate_filter():
+    return registry.rebuild()
+
+
+@router.get("/feed", dependencies=[Depends(require_admin)])
+def scan_feed_status():
+    """Subscribers, published/dropped counters and ring buffer of this worker's live scan feed."""
+    return scan_feed.status()
+
+
+@router.get("/pipeline", dependencies=[Depends(require_admin)])
+def pipeline_stats():
+    """Calls, items, time and cache hits per scan pipeline stage in this worker."""
+    return SCAN_PIPELINE.stats()
+
+
+@router.get("/quality", dependencies=[Depends(require_admin)])
+def quality_stats():
+    """Photos checked by the quality gate in this worker: verdicts, reasons, rejection rate and cost."""
+    return quality_gate.status()
+
+
+@router.get("/captures", dependencies=[Depends(require_admin)])
+def capture_status():
+    """Capture rate, directory and scans recorded by this worker for replay."""
+    return recorder.status()
+
+
+@router.get("/archive", dependencies=[Depends(require_admin)])
+def archive_status(db: Session = Depends(get_db)):
+    """Hot and archived report counts, archive size on disk and archive lookups served by this worker."""
+    return report_archive.status(db)
+
+
+@router.get("/memory", dependencies=[Depends(require_admin)])
+def worker_memory():
+    """RSS/PSS/USS of the Gunicorn master and every worker (or just this process without Gunicorn)."""
+    return memory_report()
+
+
+@router.get("/quotas", dependencies=[Depends(require_admin)])
+def quota_status():
+    """Admission counters of this worker and the per-tier daily scan limits."""
+    return quotas.status()
+
+
+@router.get("/webhooks", dependencies=[Depends(require_admin)])
+def webhook_stats():
+    """Outbox backlog, delivery throughput and lag (created -> delivered) of this worker's dispatcher."""
+    return dispatcher.stats()
+
+
+@router.get("/evidence", dependencies=[Depends(require_admin)])
+def evidence_stats():
+    """Stored evidence blobs, bytes, report links and this worker's write/dedup counters."""
+    return blob_store.stats()
+
+
+def _epoch(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+@router.get("/audit", dependencies=[Depends(require_admin_token)])
+def audit_events(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cert_id: Optional[str] = None,
+    event: Optional[str] = None,
+    limit: int = 1000,
+):
+    """
+    Audit events of every worker, oldest first. `start` is inclusive and `end`
+    exclusive (UTC when no offset is given); `cert_id` uses the certificate index.
+    """
+    if not 1 <= limit <= 100000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100000.")
+    events = audit.query(start=_epoch(start), end=_epoch(end), cert_id=cert_id, event_type=event, limit=limit)
+    return {"count": len(events), "events": events}
+
+
+@router.get("/audit/status", dependencies=[Depends(require_admin_token)])
+def audit_status():
+    """This worker's audit writer: queued/written events, fsyncs and the open segment."""
+    return audit.status()
+
+
+@router.get("/audit/verify", dependencies=[Depends(require_admin_token)])
+def audit_verify():
+    """Recomputes the hash chain of every audit stream."""
+    return verify_all(audit.root)
@@ -4,18 +4,36 @@ Handles image upload and manual data input for gem analysis.
 Author: Sudeepa Wanigarathna
 """
 
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import uuid
 import json
-from datetime import datetime
+import asyncio
+import time
+from datetime import date, datetime
 
-from database import get_db, AnalysisReport, init_db
-from models.schemas import AnalysisResponse, ManualInputs
-from services.ml_pipeline import analyze_image_mock
+from database import get_db, engine, SessionLocal, AnalysisReport, ArchivedReport, BlockchainCert, init_db
+from models.schemas import AnalysisResponse, ManualInputs, SimilarScan, ValuationRequest, ViewConfidence
+from services.ml_pipeline import analyze_views, get_gem_data, report_row, MAX_VIEWS
+from services.archive import ArchiveUnavailable, report_archive
+from services.audit_log import audit
+from services.blob_store import queue_views, report_links, retains_evidence
 from services.blockchain import generate_certification
+from services.cert_registry import registry
+from services.embedding_store import get_embedding_store
+from services.export import EXPORT_FORMATS, parquet_available, stream_reports
+from services.profiles import get_profile
+from services.quality_gate import quality_gate, REJECT
+from services.scan_feed import scan_feed, report_summary, sse_frame, FEED_RING_SIZE
+from services.spectral_library import KINDS as SPECTRUM_KINDS, SpectrumError, from_peaks, parse_peaks, parse_spectrum, prepare
+from services.quotas import exhausted_detail, quotas, request_client
+from services.replay import recorder
+from services.webhooks import dispatcher
+from services.rollups import default_range, query_stats, record_reports
+from services.valuation import rates, value_parcel, ValuationError
 
 router = APIRouter()
 
@@ -23,24 +41,70 @@ router = APIRouter()
 init_db()
 
 
-@router.post("/scan", response_model=AnalysisResponse)
-async def scan_gemstone(
-    image: Optional[UploadFile] = File(None),
-    manual_data: Optional[str] = Form(None),  # JSON string
-    mode: str = Form("pro"),
-    db: Session = Depends(get_db)
-):
-    """
-    Primary analysis endpoint.
-    Accepts image upload + optional manual gemological test inputs.
-    Returns full forensic report.
-    """
-    if image is None:
-        raise HTTPException(status_code=400, detail="At least one image is required for analysis.")
+def _describe_matches(db: Session, matches: list) -> List[SimilarScan]:
+    """Attach report details to (session_id, similarity) pairs from the embedding store."""
+    if not matches:
+        return []
+    session_ids = [sid for sid, _ in matches]
+    reports = {r.session_id: r for r in db.query(AnalysisReport).filter(AnalysisReport.session_id.in_(session_ids)).all()}
+    cold = [sid for sid in session_ids if sid not in reports]
+    if cold:  # archived reports keep these columns in the archive index
+        reports.update((r.session_id, r) for r in
+                       db.query(ArchivedReport).filter(ArchivedReport.session_id.in_(cold)).all())
+    return [
+        SimilarScan(
+            session_id=sid,
+            similarity=sim,
+            mineral_name=reports[sid].mineral_name if sid in reports else None,
+            blockchain_id=reports[sid].blockchain_id if sid in reports else None,
+            created_at=reports[sid].created_at if sid in reports else None,
+        )
+        for sid, sim in matches
+    ]
+
+
+async def _read_spectra(uploads: dict, manual_inputs_dict: dict, profile: dict, mode: str) -> Optional[dict]:
+    """Uploaded spectra files, or typed peak positions, prepared for library matching ({kind: (vector, peaks)})."""
+    typed = {kind: manual_inputs_dict[kind] for kind in SPECTRUM_KINDS if str(manual_inputs_dict.get(kind) or "").strip()}
+    files = {kind: f for kind, f in uploads.items() if f is not None}
+    if not typed and not files:
+        return None
+    if not profile["spectra"]:
+        raise HTTPException(status_code=400, detail=f"Mode '{mode}' does not take spectral data; spectral library matching requires lab mode.")
+    spectra = {}
+    for kind in SPECTRUM_KINDS:
+        try:
+            if kind in files:
+                x, y, _ = parse_spectrum(await files[kind].read())
+                spectra[kind] = prepare(kind, x, y)
+            elif kind in typed:
+                spectra[kind] = from_peaks(kind, parse_peaks(str(typed[kind])))
+        except SpectrumError as e:
+            raise HTTPException(status_code=400, detail=f"Spectral data ({kind}): {e}")
+    return spectra
 
-    image_bytes = await image.read()
-    if len(image_bytes) == 0:
-        raise HTTPException(status_code=400, detail="Uploaded image is empty.")
+
+async def _prepare_scan(request: Request, image: Optional[List[UploadFile]], manual_data: Optional[str], mode: str,
+                        spectrum_files: Optional[dict] = None):
+    """Checks and reads a scan upload; returns (views, evidence, manual_inputs, profile, quality, spectra)."""
+    if not image:
+        raise HTTPException(status_code=400, detail="At least one image is required for analysis.")
+    if len(image) > MAX_VIEWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_VIEWS} views can be analysed per stone.")
+    admission = getattr(request.state, "admission", None)
+    if admission and quotas.tier(mode) != admission["tier"]:
+        quotas.refund_admission(admission)
+        if admission["declared"]:
+            raise HTTPException(status_code=400, detail=f"Scan mode '{mode}' does not match the quota tier '{admission['tier']}'. Send the mode in the X-Tier header (or ?mode=) so the quota can be checked before upload.")
+        # Mode only in the form: admitted against the default tier, now charged to the mode's own tier
+        admitted, limit, remaining, retry_after = quotas.admit(admission["client"], mode)
+        admission.update(tier=quotas.tier(mode), limit=limit, remaining=remaining, refunded=not admitted)
+        if not admitted:
+            wait, detail = exhausted_detail(admission["tier"], limit, retry_after)
+            raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(wait)})
+    profile = get_profile(mode)
+    if len(image) > profile["max_views"]:
+        raise HTTPException(status_code=400, detail=f"Mode '{mode}' analyses at most {profile['max_views']} view(s) per stone; multi-view fusion requires lab mode.")
 
     # Parse manual inputs
     manual_inputs_dict = {}
@@ -49,20 +113,31 @@ async def scan_gemstone(
             manual_inputs_dict = json.loads(manual_data)
         except Exception:
             manual_inputs_dict = {}
+    spectra = await _read_spectra(spectrum_files or {}, manual_inputs_dict, profile, mode)
 
-    # Run ML pipeline
-    result = analyze_image_mock(image_bytes, manual_inputs_dict)
-    gem = result["gem"]
-    gem_name = result["gem_key"]
+    views = await asyncio.gather(*(f.read() for f in image))
+    if any(len(v) == 0 for v in views):
+        raise HTTPException(status_code=400, detail="Uploaded image is empty.")
+    # Quality gate: unusable photos are refused here, before inference and without charging the quota
+    quality = None
+    if quality_gate.enabled:
+        quality = await asyncio.to_thread(quality_gate.check_views, list(views), [f.filename for f in image])
+        if quality["verdict"] == REJECT:
+            raise HTTPException(status_code=422, detail={
+                "message": "The photo is not good enough for a reliable analysis.",
+                "reasons": [r for r in quality["reasons"] if r["severity"] == REJECT],
+                "flags": [r for r in quality["reasons"] if r["severity"] != REJECT],
+            })
+    # Evidence retention (gov): hash now, write to the blob store in the background during inference
+    evidence = await asyncio.to_thread(queue_views, list(views)) if retains_evidence(mode) else []
+    return list(views), evidence, manual_inputs_dict, profile, quality, spectra
 
-    # Generate session + blockchain cert
-    session_id = str(uuid.uuid4())
-    cert = generate_certification(session_id, gem_name, result["base_confidence"])
 
-    # Build response
-    response = AnalysisResponse(
-        session_id=session_id,
-        blockchain_id=cert["cert_id"],
+def _identification_fields(result: dict, manual_inputs_dict: dict, filenames: List[str], mode: str) -> dict:
+    """Report fields known as soon as the stone is classified."""
+    gem = result["gem"]
+    gem_name = result["gem_key"]
+    return dict(
         mineral_name=gem_name,
         common_name=gem_name,
         chemical_formula=gem["formula"],
@@ -71,13 +146,26 @@ async def scan_gemstone(
         specific_gravity=f"{gem['sg'][0]:.2f}–{gem['sg'][1]:.2f}",
         geological_class=gem["geological_class"],
         optical_properties={
-            "refractive_index": f"{result['ri'][0]:.3f}–{result['ri'][1]:.3f}",
-            "birefringence": round(result['ri'][1] - result['ri'][0], 4),
+            "refractive_index": f"{result['ri'][0]:.3f}–{result['ri'][1]:.3f}" if result['ri'][0] is not None else "N/A (opaque)",
+            "birefringence": round(result['ri'][1] - result['ri'][0], 4) if result['ri'][0] is not None else None,
             "pleochroism": manual_inputs_dict.get("pleochroism", "Variable"),
             "luster": gem["luster"],
             "transparency": gem["transparency"],
             "dispersion": None
         },
+        confidence_score=result["base_confidence"],
+        mode=mode,
+        view_confidences=[
+            ViewConfidence(**vc, filename=filenames[vc["view"]]) for vc in result["view_confidences"]
+        ],
+        tta=result["tta"],
+        spectral_matches=result["spectral_matches"],
+    )
+
+
+def _treatment_fields(result: dict) -> dict:
+    """Natural/synthetic, treatment, inclusion and damage analysis."""
+    return dict(
         natural_probability=result["natural_prob"],
         synthetic_probability=result["synthetic_prob"],
         treatment_analysis={
@@ -89,74 +177,352 @@ async def scan_gemstone(
         crack_assessment={
             **result["crack_data"]
         },
+    )
+
+
+def _valuation_fields(result: dict) -> dict:
+    """Price, origin and recommendations."""
+    return dict(
         price_estimation={
             **result["price"]
         },
         origin_predictions=result["origins"],
-        confidence_score=result["base_confidence"],
         method_used=["CNN (Simulated EfficientNet-B7)", "Vision Transformer", "YOLO v8 (Inclusion Detection)", "GAN Anomaly Detector", "Ensemble Regression"],
         recommendations=result["recommendations"],
         disclaimer="⚠️ AI Screening Result. For high-value transactions, professional laboratory testing is recommended.",
-        mode=mode,
-        analysis_timestamp=datetime.utcnow(),
-        qr_code_url=cert["qr_path"]
     )
 
-    # Persist to DB
+
+def _certificate_fields(db: Session, result: dict, session_id: str, cert: dict) -> dict:
+    """Certificate id and QR, plus the near-duplicate check (which also remembers this scan's photo)."""
+    store = get_embedding_store()
+    similar_scans = _describe_matches(db, store.find_duplicates(result["embedding"]))
+    store.add(session_id, result["embedding"])
+    return dict(
+        blockchain_id=cert["cert_id"],
+        qr_code_url=cert["qr_path"],
+        seen_before=bool(similar_scans),
+        similar_scans=similar_scans,
+    )
+
+
+def _persist_scan(db: Session, request: Request, result: dict, session_id: str, cert: dict, mode: str,
+                  manual_inputs_dict: dict, evidence: list, filenames: List[str]):
+    """Stores the report and certificate, queues the webhook and records the audit events."""
+    gem_name = result["gem_key"]
     report = AnalysisReport(
+        **report_row(result, session_id, cert["cert_id"], mode, manual_inputs_dict),
+        created_at=datetime.utcnow()
+    )
+    db.add(report)
+    record_reports(db, [report])
+    db.add(BlockchainCert(
+        cert_id=cert["cert_id"],
         session_id=session_id,
-        blockchain_id=cert["cert_id"],
         mineral_name=gem_name,
-        chemical_formula=gem["formula"],
-        crystal_system=gem["crystal_system"],
-        mohs_hardness=f"{gem['mohs'][0]}–{gem['mohs'][1]}",
-        specific_gravity=manual_inputs_dict.get("specific_gravity"),
-        natural_probability=result["natural_prob"],
-        synthetic_probability=result["synthetic_prob"],
-        treatment_probability=result["treatment_probs"].get("heat_treated", 0),
-        treatment_type=result["treatment_probs"]["dominant_treatment"],
-        inclusion_analysis=result["inclusion_data"],
-        crack_assessment=result["crack_data"],
-        price_min_local=result["price"]["min_local"],
-        price_max_local=result["price"]["max_local"],
-        price_min_usd=result["price"]["min_usd"],
-        price_max_usd=result["price"]["max_usd"],
-        currency_local="LKR",
-        origin_prediction=result["origins"],
         confidence_score=result["base_confidence"],
-        mode=mode
-    )
-    db.add(report)
+        hash_value=cert["hash_value"],
+        qr_path=cert["qr_path"],
+        is_valid=True
+    ))
+    db.add_all(report_links(session_id, evidence, filenames))
+    queued = dispatcher.enqueue(db, request_client(request), "scan.completed", {
+        "session_id": session_id,
+        "blockchain_id": cert["cert_id"],
+        "mineral_name": gem_name,
+        "confidence_score": result["base_confidence"],
+        "natural_probability": result["natural_prob"],
+        "mode": mode,
+        "report_url": f"/api/analysis/report/{session_id}",
+    })
     db.commit()
+    admission = getattr(request.state, "admission", None)
+    if admission:
+        admission["persisted"] = True  # charged from here on
+    registry.issued(cert["cert_id"])
+    scan_feed.notify()
+    if queued:
+        dispatcher.notify()
+    client = request_client(request)
+    audit.record("scan.completed", client=client, session_id=session_id, cert_id=cert["cert_id"], mode=mode,
+                 mineral=gem_name, confidence=result["base_confidence"], views=len(filenames), evidence=evidence or None)
+    audit.record("certificate.issued", client=client, session_id=session_id, cert_id=cert["cert_id"],
+                 hash_value=cert["hash_value"])
+
+
+@router.post("/scan", response_model=AnalysisResponse)
+async def scan_gemstone(
+    request: Request,
+    image: Optional[List[UploadFile]] = File(None),  # one or more views of the same stone
+    manual_data: Optional[str] = Form(None),  # JSON string
+    mode: str = Form("pro"),
+    raman: Optional[UploadFile] = File(None),  # lab mode: spectra as two-column text files
+    ftir: Optional[UploadFile] = File(None),
+    uv_vis: Optional[UploadFile] = File(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Primary analysis endpoint.
+    Accepts one or more image uploads (views of the same stone) + optional
+    manual gemological test inputs (and, in lab mode, Raman/FTIR/UV-Vis
+    spectra, matched against the spectral library). Returns full forensic report.
+    """
+    views, evidence, manual_inputs_dict, profile, quality, spectra = await _prepare_scan(
+        request, image, manual_data, mode, {"raman": raman, "ftir": ftir, "uv_vis": uv_vis})
+    filenames = [f.filename for f in image]
+
+    # Run ML pipeline
+    result = analyze_views(views, manual_inputs_dict, profile, spectra)
 
+    # Generate session + blockchain cert
+    session_id = str(uuid.uuid4())
+    cert = generate_certification(session_id, result["gem_key"], result["base_confidence"])
+
+    # Build response
+    response = AnalysisResponse(
+        session_id=session_id,
+        **_identification_fields(result, manual_inputs_dict, filenames, mode),
+        **_treatment_fields(result),
+        **_valuation_fields(result),
+        **_certificate_fields(db, result, session_id, cert),
+        quality=quality,
+        analysis_timestamp=datetime.utcnow(),
+    )
+
+    # Persist to DB
+    _persist_scan(db, request, result, session_id, cert, mode, manual_inputs_dict, evidence, filenames)
+    if recorder.wants(result):
+        await asyncio.to_thread(recorder.record, views, manual_inputs_dict, spectra, profile, result)
     return response
 
 
+SCAN_STAGES = ("identification", "treatment", "valuation", "certificate")
+_stream_tasks = set()  # running streamed scans (kept referenced until they finish)
+
+
+def _sse(event: str, data: dict) -> str:
+    return sse_frame(event, jsonable_encoder(data))
+
+
+async def _run_streamed_scan(queue: asyncio.Queue, request: Request, views: list, evidence: list,
+                             manual_inputs_dict: dict, profile: dict, filenames: List[str], mode: str,
+                             quality: Optional[dict], spectra: Optional[dict]):
+    """
+    Runs one scan stage by stage, putting (event, data) on `queue` as each
+    stage finishes. Runs as its own task so a scan whose client went away
+    is still stored and certified.
+    """
+    started = time.perf_counter()
+    timings = {}
+
+    def emit(event: str, data: dict):
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        timings[event] = elapsed
+        queue.put_nowait((event, {**data, "elapsed_ms": elapsed}))
+
+    db = SessionLocal()
+    loop = asyncio.get_running_loop()
+    fields = {}
+
+    def identified(partial: dict):
+        """Runs on the event loop once the pipeline has classified the stone (its later stages still running)."""
+        fields.update(session_id=session_id, **_identification_fields(partial, manual_inputs_dict, filenames, mode),
+                      quality=quality)
+        emit("identification", fields)
+
+    try:
+        session_id = str(uuid.uuid4())
+        # Inference and the certificate (hash + QR image) run off the event loop so earlier events go out meanwhile
+        result = await asyncio.to_thread(analyze_views, views, manual_inputs_dict, profile, spectra,
+                                         lambda partial: loop.call_soon_threadsafe(identified, partial))
+        if not fields:  # the callback is queued before the thread's result, so this is only a safeguard
+            identified(result)
+        treatment = _treatment_fields(result)
+        emit("treatment", treatment)
+        valuation = _valuation_fields(result)
+        emit("valuation", valuation)
+        cert = await asyncio.to_thread(generate_certification, session_id, result["gem_key"], result["base_confidence"])
+        certificate = _certificate_fields(db, result, session_id, cert)
+        emit("certificate", certificate)
+        response = AnalysisResponse(**fields, **treatment, **valuation, **certificate,
+                                    analysis_timestamp=datetime.utcnow())
+        _persist_scan(db, request, result, session_id, cert, mode, manual_inputs_dict, evidence, filenames)
+        total = round((time.perf_counter() - started) * 1000, 1)
+        emit("complete", {"report": response, "timings": {
+            "first_result_ms": timings["identification"], "total_ms": total,
+            "stages_ms": {stage: timings[stage] for stage in SCAN_STAGES},
+            "quality_gate_ms": quality["ms"] if quality else None}})
+        if recorder.wants(result):
+            await asyncio.to_thread(recorder.record, views, manual_inputs_dict, spectra, profile, result)
+    except Exception as e:
+        db.rollback()
+        print(f"Streamed scan failed: {e}")
+        admission = getattr(request.state, "admission", None)
+        if admission:  # the stream already answered 200, so the middleware did not refund
+            quotas.refund_admission(admission)
+        queue.put_nowait(("error", {"detail": "Analysis failed."}))
+    finally:
+        db.close()
+
+
+@router.post("/scan/stream")
+async def scan_gemstone_stream(
+    request: Request,
+    image: Optional[List[UploadFile]] = File(None),
+    manual_data: Optional[str] = Form(None),
+    mode: str = Form("pro"),
+    raman: Optional[UploadFile] = File(None),
+    ftir: Optional[UploadFile] = File(None),
+    uv_vis: Optional[UploadFile] = File(None),
+):
+    """
+    Streaming variant of /scan (Server-Sent Events). Emits `identification`
+    (mineral, confidence) as soon as the pipeline has classified the stone,
+    while its remaining stages run; `treatment` (natural/synthetic,
+    treatments, inclusions, damage) and `valuation` (price, origin,
+    recommendations) when the pipeline finishes; `certificate` (certificate
+    id, QR, near-duplicates) once it is issued; then `complete` with the full report (same as /scan) and the
+    time to first result vs total. Upload errors (including photos refused by
+    the quality gate, 422) are returned as plain HTTP errors before the stream
+    starts; later failures as an `error` event.
+    """
+    views, evidence, manual_inputs_dict, profile, quality, spectra = await _prepare_scan(
+        request, image, manual_data, mode, {"raman": raman, "ftir": ftir, "uv_vis": uv_vis})
+    queue = asyncio.Queue()
+    task = asyncio.create_task(_run_streamed_scan(queue, request, views, evidence, manual_inputs_dict, profile,
+                                                  [f.filename for f in image], mode, quality, spectra))
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    async def events():
+        while True:
+            event, data = await queue.get()
+            yield _sse(event, data)
+            if event in ("complete", "error"):
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/valuate")
+def valuate_parcel(request: ValuationRequest):
+    """
+    Values a parcel (lot) of stones with the same pricing as scans: per-stone
+    USD/local ranges, lot totals, price-band distribution and breakdowns by
+    gem and treatment.
+    """
+    stones = request.stones
+    try:
+        return value_parcel(
+            get_gem_data(),
+            [s.gem for s in stones], [s.carat for s in stones],
+            [s.treatment for s in stones], [s.natural_probability for s in stones],
+            currency=request.currency, include_stones=request.include_stones,
+        )
+    except ValuationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/currencies")
+def list_currencies():
+    """Local currencies available for valuation (units per USD)."""
+    table = rates.get()
+    return {"base": table["base"], "as_of": table["as_of"], "rates": table["rates"]}
+
+
 @router.get("/history")
 async def get_analysis_history(limit: int = 20, db: Session = Depends(get_db)):
     """Return the last N analysis reports."""
     reports = db.query(AnalysisReport).order_by(AnalysisReport.created_at.desc()).limit(limit).all()
-    return [
-        {
-            "session_id": r.session_id,
-            "blockchain_id": r.blockchain_id,
-            "mineral_name": r.mineral_name,
-            "confidence_score": r.confidence_score,
-            "natural_probability": r.natural_probability,
-            "treatment_type": r.treatment_type,
-            "price_min_usd": r.price_min_usd,
-            "price_max_usd": r.price_max_usd,
-            "mode": r.mode,
-            "created_at": r.created_at.isoformat()
-        }
-        for r in reports
-    ]
+    return [report_summary(r) for r in reports]
+
+
+@router.get("/feed")
+async def live_scan_feed(request: Request, backlog: int = 0, last_event_id: Optional[int] = None):
+    """
+    Live feed of new reports (Server-Sent Events): one `scan` event per report,
+    with the /history summary as data and the report id as event id. `backlog`
+    replays the newest N reports first. A reconnecting client (Last-Event-ID
+    header, or ?last_event_id=) gets what it missed, or a `resync` event when
+    that is too far back and it should reload /history.
+    """
+    if not 0 <= backlog <= FEED_RING_SIZE:
+        raise HTTPException(status_code=400, detail=f"backlog must be between 0 and {FEED_RING_SIZE}.")
+    header = request.headers.get("last-event-id", "")
+    if header.isdigit():
+        last_event_id = int(header)
+    subscriber = scan_feed.subscribe(last_event_id, backlog)
+    return StreamingResponse(scan_feed.stream(subscriber), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/stats")
+async def get_stats(
+    days: int = 30,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    mode: Optional[str] = None,
+    mineral: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Aggregate scan statistics per day, mineral, mode, treatment and price band (from the rollups)."""
+    if not 1 <= days <= 3660:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 3660.")
+    default_start, default_end = default_range(days)
+    return query_stats(db, start or default_start, end or default_end, mode=mode, mineral=mineral)
+
+
+@router.get("/export")
+def export_reports(
+    request: Request,
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    mineral: Optional[str] = None,
+    mode: Optional[str] = None,
+):
+    """
+    Streams every matching report as NDJSON, CSV or Parquet (Export Reports,
+    lab tier). `start` is inclusive and `end` exclusive on created_at.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Choose from: {list(EXPORT_FORMATS)}")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow on the server.")
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"deepcrystal-reports-{datetime.utcnow():%Y%m%dT%H%M%S}.{extension}"
+    audit.record("report.exported", client=request_client(request), format=format, start=start, end=end,
+                 mineral=mineral, mode=mode)
+    return StreamingResponse(
+        stream_reports(engine, format, start=start, end=end, mineral=mineral, mode=mode),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/similar/{session_id}", response_model=List[SimilarScan])
+async def get_similar_scans(session_id: str, k: int = 10, db: Session = Depends(get_db)):
+    """Nearest previously analysed photos to this scan's image embedding."""
+    store = get_embedding_store()
+    embedding = store.get(session_id)
+    if embedding is None:
+        raise HTTPException(status_code=404, detail="No image embedding stored for this session.")
+    return _describe_matches(db, store.search(embedding, k=min(max(k, 1), 100), exclude=session_id))
 
 
 @router.get("/report/{session_id}")
-async def get_report(session_id: str, db: Session = Depends(get_db)):
-    """Retrieve a specific analysis report by session ID."""
+async def get_report(session_id: str, request: Request, db: Session = Depends(get_db)):
+    """Retrieve a specific analysis report by session ID (from the archive once it is no longer hot)."""
     report = db.query(AnalysisReport).filter(AnalysisReport.session_id == session_id).first()
+    if report is None:
+        try:
+            report = await asyncio.to_thread(report_archive.get, db, session_id)
+        except ArchiveUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    cert_id = (report["blockchain_id"] if isinstance(report, dict) else report.blockchain_id) if report else None
+    audit.record("report.accessed", client=request_client(request), session_id=session_id,
+                 cert_id=cert_id, found=report is not None)
     if not report:
         raise HTTPException(status_code=404, detail="Report not found.")
     return report
@@ -1,28 +1,75 @@
 """
 Blockchain verification router for Cerberus DeepCrystal
+Verification consults the in-memory certificate registry first (see
+services/cert_registry.py): ids that were never issued and revoked
+certificates are answered without a database session, normally by
+VerifyFastPathMiddleware before the request reaches this router.
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from database import get_db, BlockchainCert
+from database import get_db, BlockchainCert, CertRevocation, SessionLocal
+from models.schemas import CertRevocationRequest
+from routers.admin import require_admin_token
+from services.audit_log import audit
+from services.cert_registry import registry, verify_payload
+from services.quotas import request_client
 
 router = APIRouter()
 
 
+def _not_found(cert_id: str) -> HTTPException:
+    return HTTPException(status_code=404, detail=f"Certificate {cert_id} not found in the Cerberus DeepCrystal ledger.")
+
+
 @router.get("/verify/{cert_id}")
-async def verify_certificate(cert_id: str, db: Session = Depends(get_db)):
-    cert = db.query(BlockchainCert).filter(BlockchainCert.cert_id == cert_id).first()
-    if not cert:
-        raise HTTPException(status_code=404, detail=f"Certificate {cert_id} not found in the Cerberus DeepCrystal ledger.")
-    return {
-        "cert_id": cert.cert_id,
-        "mineral_name": cert.mineral_name,
-        "confidence_score": cert.confidence_score,
-        "hash_value": cert.hash_value,
-        "issued_at": cert.issued_at.isoformat(),
-        "is_valid": cert.is_valid,
-        "qr_code_url": cert.qr_path
-    }
+async def verify_certificate(cert_id: str, request: Request):
+    # No get_db dependency: rejected and revoked ids never open a session
+    if getattr(request.state, "cert_checked", False):
+        state, payload = "maybe", None  # the fast-path middleware already asked the registry
+    else:
+        state, payload = registry.check(cert_id)
+    if state == "maybe":
+        db = SessionLocal()
+        try:
+            cert = db.query(BlockchainCert).filter(BlockchainCert.cert_id == cert_id).first()
+            revocation = None
+            if cert is not None and not cert.is_valid:
+                revocation = db.query(CertRevocation).filter(CertRevocation.cert_id == cert_id).first()
+            payload = verify_payload(cert, revocation) if cert is not None else None
+        finally:
+            db.close()
+        if payload is None:
+            registry.missed()
+    audit.record("certificate.verified", client=request_client(request), cert_id=cert_id,
+                 found=payload is not None, valid=payload["is_valid"] if payload else None)
+    if payload is None:
+        raise _not_found(cert_id)
+    return payload
+
+
+@router.post("/revoke/{cert_id}", dependencies=[Depends(require_admin_token)])
+def revoke_certificate(cert_id: str, body: CertRevocationRequest, request: Request, db: Session = Depends(get_db)):
+    """Revokes a certificate; /verify reports it as revoked from now on (other workers within CERT_SYNC_INTERVAL)."""
+    client = request_client(request)
+    payload = registry.revoke(db, cert_id, body.reason, client)
+    if payload is None:
+        raise _not_found(cert_id)
+    audit.record("certificate.revoked", client=client, cert_id=cert_id, reason=body.reason)
+    return payload
+
+
+@router.get("/revoked")
+async def list_revocations(limit: int = 50, db: Session = Depends(get_db)):
+    revocations = db.query(CertRevocation).order_by(CertRevocation.revoked_at.desc()).limit(limit).all()
+    return [
+        {
+            "cert_id": r.cert_id,
+            "reason": r.reason,
+            "revoked_at": r.revoked_at.isoformat()
+        }
+        for r in revocations
+    ]
 
 
 @router.get("/all")
@@ -0,0 +1,76 @@
+"""
+Evidence router for Cerberus DeepCrystal
+Serves the original photos retained for audit (services/blob_store.py).
+Blobs are immutable and addressed by SHA-256, so responses carry a strong
+ETag and long-lived cache headers, and Range requests are honoured. Requests
+must carry ADMIN_TOKEN in the X-Admin-Token header (503 while it is unset).
+"""
+
+import re
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from database import get_db, EvidenceBlob, ReportBlob
+from routers.admin import require_admin_token
+from services.audit_log import audit
+from services.blob_store import blob_store
+from services.quotas import request_client
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+_IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+def _blob(db: Session, sha256: str) -> EvidenceBlob:
+    if not _SHA256.match(sha256):
+        raise HTTPException(status_code=400, detail="Evidence id must be a lowercase SHA-256 hex digest.")
+    blob = db.query(EvidenceBlob).filter(EvidenceBlob.sha256 == sha256).first()
+    if blob is None or not blob_store.exists(sha256):
+        raise HTTPException(status_code=404, detail="Evidence blob not found (or still being written).")
+    return blob
+
+
+@router.get("/report/{session_id}")
+def report_evidence(session_id: str, request: Request, db: Session = Depends(get_db)):
+    """The retained photos of a report, one entry per view."""
+    links = db.query(ReportBlob).filter(ReportBlob.session_id == session_id).order_by(ReportBlob.view).all()
+    audit.record("evidence.listed", client=request_client(request), session_id=session_id, views=len(links))
+    if not links:
+        raise HTTPException(status_code=404, detail="No evidence retained for this report.")
+    blobs = {b.sha256: b for b in db.query(EvidenceBlob).filter(EvidenceBlob.sha256.in_([l.sha256 for l in links]))}
+    return [
+        {
+            "view": link.view,
+            "filename": link.filename,
+            "sha256": link.sha256,
+            "stored": link.sha256 in blobs,
+            "size": blobs[link.sha256].size if link.sha256 in blobs else None,
+            "content_type": blobs[link.sha256].content_type if link.sha256 in blobs else None,
+            "width": blobs[link.sha256].width if link.sha256 in blobs else None,
+            "height": blobs[link.sha256].height if link.sha256 in blobs else None,
+            "url": f"/api/evidence/{link.sha256}",
+            "thumbnail_url": f"/api/evidence/{link.sha256}/thumbnail",
+        }
+        for link in links
+    ]
+
+
+@router.get("/{sha256}")
+def get_evidence(sha256: str, request: Request, db: Session = Depends(get_db)):
+    """The original upload, byte for byte (supports Range requests)."""
+    blob = _blob(db, sha256)
+    audit.record("evidence.accessed", client=request_client(request), sha256=sha256,
+                 range=request.headers.get("range"))
+    return FileResponse(blob_store.path(sha256), media_type=blob.content_type,
+                        headers={"ETag": f'"{sha256}"', "Cache-Control": _IMMUTABLE})
+
+
+@router.get("/{sha256}/thumbnail")
+def get_evidence_thumbnail(sha256: str, db: Session = Depends(get_db)):
+    blob = _blob(db, sha256)
+    if not blob.has_thumbnail:
+        raise HTTPException(status_code=404, detail="No thumbnail for this blob.")
+    return FileResponse(blob_store.thumbnail_path(sha256), media_type="image/webp",
+                        headers={"ETag": f'"{sha256}-thumb"', "Cache-Control": _IMMUTABLE})
@@ -0,0 +1,43 @@
+"""
+Webhook subscription router for Cerberus DeepCrystal
+Clients identified by X-Client-Id register endpoints for scan.completed and
+batch.completed events (delivery: services/webhooks.py).
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+from typing import List
+
+from database import get_db, WebhookSubscription
+from models.schemas import WebhookSubscriptionRequest, WebhookSubscriptionResponse
+from services.quotas import request_client
+from services.webhooks import dispatcher, UnsafeDestination, WEBHOOK_EVENTS
+
+router = APIRouter()
+
+
+@router.post("/", response_model=WebhookSubscriptionResponse)
+def create_subscription(req: WebhookSubscriptionRequest, request: Request, db: Session = Depends(get_db)):
+    """Registers a URL (public addresses only); the response carries the signing secret, shown only once."""
+    unknown = set(req.events or []) - set(WEBHOOK_EVENTS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown events {sorted(unknown)}. Choose from: {list(WEBHOOK_EVENTS)}")
+    try:
+        subscription = dispatcher.subscribe(db, request_client(request), req.url, req.events)
+    except UnsafeDestination as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return WebhookSubscriptionResponse.model_validate(subscription)
+
+
+@router.get("/", response_model=List[WebhookSubscriptionResponse])
+def list_subscriptions(request: Request, db: Session = Depends(get_db)):
+    subscriptions = db.query(WebhookSubscription).filter_by(client_id=request_client(request), active=True).all()
+    return [WebhookSubscriptionResponse.model_validate(s).model_copy(update={"secret": None}) for s in subscriptions]
+
+
+@router.delete("/{subscription_id}")
+def delete_subscription(subscription_id: int, request: Request, db: Session = Depends(get_db)):
+    """Deactivates the subscription; its queued deliveries are cancelled."""
+    if not dispatcher.unsubscribe(db, request_client(request), subscription_id):
+        raise HTTPException(status_code=404, detail="Webhook subscription not found")
+    return {"deleted": subscription_id}
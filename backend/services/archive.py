@@ -0,0 +1,258 @@
+"""
+Report archive for Cerberus DeepCrystal
+Keeps analysis_reports bounded: reports older than ARCHIVE_AFTER_DAYS (default
+90) are moved to zstd-compressed Parquet files under ARCHIVE_DIR (default
+storage/archive), partitioned by month of creation:
+
+  created_month=2025-03/part-<first created_at>-<first id>.parquet
+
+Every column is kept (the JSON columns as JSON text, which the columnar
+encoding compresses well), in row groups of ARCHIVE_ROW_GROUP rows. Files are
+listed in archive_files, and each archived report leaves a slim row in
+archived_reports (session id, certificate id, mineral, time, file id, row
+group, row), so a lookup reads and decompresses one row group of one file.
+/api/analysis/report/{session_id} falls back to it when the report is no
+longer in the hot table.
+
+Reports are archived oldest first, in chunks of ARCHIVE_BATCH. Each chunk's
+files are written to a temporary name, fsynced and renamed into place, then
+the file and index rows are inserted and the hot rows deleted in one
+transaction. A run interrupted before that commit leaves the reports hot;
+the next run rewrites the same files. Run it from cron (from backend/):
+    python -m services.archive run [--older-than-days 90] [--vacuum]
+    python -m services.archive status
+Needs pyarrow.
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import JSON, DateTime, Float, Integer, func, select
+
+from database import AnalysisReport, ArchiveFile, ArchivedReport
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "storage/archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "20000"))
+ARCHIVE_ROW_GROUP = int(os.getenv("ARCHIVE_ROW_GROUP", "512"))  # rows decompressed per lookup
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+ARCHIVE_OPEN_FILES = 32  # Parquet footers kept parsed for lookups
+DELETE_BATCH = 500  # ids per DELETE ... WHERE id IN (...)
+
+REPORT_COLUMNS = [c.name for c in AnalysisReport.__table__.columns]
+JSON_COLUMNS = [c.name for c in AnalysisReport.__table__.columns if isinstance(c.type, JSON)]
+
+
+class ArchiveUnavailable(RuntimeError):
+    """pyarrow is not installed."""
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ArchiveUnavailable("The report archive needs pyarrow (pip install pyarrow).")
+    return pa, pq
+
+
+def _schema(pa):
+    def arrow_type(column):
+        if isinstance(column.type, Integer):
+            return pa.int64()
+        if isinstance(column.type, Float):
+            return pa.float64()
+        if isinstance(column.type, DateTime):
+            return pa.timestamp("us")
+        return pa.string()  # strings, text and JSON (as JSON text)
+    return pa.schema([(c.name, arrow_type(c)) for c in AnalysisReport.__table__.columns])
+
+
+def _fsync_dir(path: str):
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class ReportArchive:
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+        self.lookups = 0
+        self.lookup_ms = 0.0
+        self._files = OrderedDict()  # file id -> ParquetFile (LRU)
+        self._lock = threading.Lock()
+
+    # ── archiving ──
+    def _write_partition(self, pa, pq, month: str, rows: List[dict]) -> str:
+        """Writes one month's rows of a chunk; returns the path relative to the archive root."""
+        first = rows[0]
+        relative = os.path.join(f"created_month={month}",
+                                f"part-{first['created_at']:%Y%m%dT%H%M%S}-{first['id']:012d}.parquet")
+        final = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        encoded = [{**r, **{c: json.dumps(r[c], ensure_ascii=False) for c in JSON_COLUMNS if r[c] is not None}}
+                   for r in rows]
+        table = pa.Table.from_pylist(encoded, schema=_schema(pa))
+        with open(final + ".tmp", "wb") as f:
+            pq.write_table(table, f, row_group_size=ARCHIVE_ROW_GROUP, compression=ARCHIVE_COMPRESSION)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(final + ".tmp", final)
+        _fsync_dir(os.path.dirname(final))
+        return relative
+
+    def archive(self, engine, older_than_days: float = ARCHIVE_AFTER_DAYS, batch: int = ARCHIVE_BATCH,
+                limit: Optional[int] = None) -> dict:
+        """Moves reports created before now - older_than_days into the archive. Returns counts."""
+        pa, pq = _pyarrow()
+        t = AnalysisReport.__table__
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        archived, files, started = 0, set(), time.perf_counter()
+        while limit is None or archived < limit:
+            n = batch if limit is None else min(batch, limit - archived)
+            with engine.connect() as conn:
+                chunk = [dict(r._mapping) for r in conn.execute(
+                    select(t).where(t.c.created_at < cutoff).order_by(t.c.created_at, t.c.id).limit(n))]
+            if not chunk:
+                break
+            by_month = {}
+            for r in chunk:
+                by_month.setdefault(r["created_at"].strftime("%Y-%m"), []).append(r)
+            written = [(self._write_partition(pa, pq, month, rows), rows) for month, rows in sorted(by_month.items())]
+            with engine.begin() as conn:
+                for relative, rows in written:
+                    file_id = conn.execute(ArchiveFile.__table__.insert().values(
+                        path=relative, reports=len(rows), size=os.path.getsize(os.path.join(self.root, relative)),
+                        created_at=datetime.utcnow())).inserted_primary_key[0]
+                    conn.execute(ArchivedReport.__table__.insert(), [
+                        {"session_id": r["session_id"], "blockchain_id": r["blockchain_id"],
+                         "mineral_name": r["mineral_name"], "created_at": r["created_at"], "file_id": file_id,
+                         "row_group": i // ARCHIVE_ROW_GROUP, "row": i % ARCHIVE_ROW_GROUP}
+                        for i, r in enumerate(rows)])
+                    files.add(relative)
+                ids = [r["id"] for r in chunk]
+                for i in range(0, len(ids), DELETE_BATCH):
+                    conn.execute(t.delete().where(t.c.id.in_(ids[i:i + DELETE_BATCH])))
+            archived += len(chunk)
+            print(f"Archived {archived:,} reports (up to {chunk[-1]['created_at']:%Y-%m-%d}, "
+                  f"{len(by_month)} month(s))")
+        return {"archived": archived, "files": len(files), "cutoff": cutoff.isoformat(),
+                "seconds": round(time.perf_counter() - started, 2)}
+
+    # ── lookups ──
+    def _file(self, pq, db, file_id: int):
+        with self._lock:
+            handle = self._files.get(file_id)
+            if handle is not None:
+                self._files.move_to_end(file_id)
+                return handle
+        handle = pq.ParquetFile(os.path.join(self.root, db.get(ArchiveFile, file_id).path))
+        with self._lock:
+            self._files[file_id] = handle
+            while len(self._files) > ARCHIVE_OPEN_FILES:
+                self._files.popitem(last=False)
+        return handle
+
+    def get(self, db, session_id: str) -> Optional[dict]:
+        """An archived report as a dict of analysis_reports columns (plus "archived": True), or None."""
+        entry = db.get(ArchivedReport, session_id)
+        if entry is None:
+            return None
+        _, pq = _pyarrow()
+        start = time.perf_counter()
+        group = self._file(pq, db, entry.file_id).read_row_group(entry.row_group)
+        report = {name: group.column(name)[entry.row].as_py() for name in REPORT_COLUMNS}
+        for name in JSON_COLUMNS:
+            if report[name] is not None:
+                report[name] = json.loads(report[name])
+        self.lookups += 1
+        self.lookup_ms += (time.perf_counter() - start) * 1000
+        return {**report, "archived": True}
+
+    def iter_rows(self, engine, columns: List[str]) -> Iterator[List[dict]]:
+        """Chunks of archived rows (the given columns), file by file."""
+        _, pq = _pyarrow()
+        with engine.connect() as conn:
+            paths = [p for (p,) in conn.execute(select(ArchiveFile.path).order_by(ArchiveFile.id))]
+        for relative in paths:
+            table = pq.read_table(os.path.join(self.root, relative), columns=columns)
+            yield table.to_pylist()
+
+    def status(self, db) -> dict:
+        t = AnalysisReport.__table__
+        hot, oldest = db.execute(select(func.count(), func.min(t.c.created_at))).one()
+        files, archived, size = db.query(func.count(ArchiveFile.id), func.sum(ArchiveFile.reports),
+                                         func.sum(ArchiveFile.size)).one()
+        return {
+            "dir": self.root,
+            "after_days": ARCHIVE_AFTER_DAYS,
+            "hot_reports": hot,
+            "oldest_hot": oldest.isoformat() if oldest else None,
+            "archived_reports": archived or 0,
+            "archive_files": files,
+            "archive_mb": round((size or 0) / 1e6, 2),
+            "lookups": self.lookups,
+            "mean_lookup_ms": round(self.lookup_ms / self.lookups, 3) if self.lookups else None,
+        }
+
+
+report_archive = ReportArchive()
+
+
+def vacuum(engine):
+    """Returns the space of deleted rows to the OS (SQLite) or the table's free space map (PostgreSQL)."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("VACUUM ANALYZE analysis_reports")
+        elif engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("VACUUM")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m services.archive", description=__doc__.split("\n")[1])
+    sub = p.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run", help="Move reports older than the cutoff into the archive")
+    r.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    r.add_argument("--batch", type=int, default=ARCHIVE_BATCH, help="Reports per chunk (one transaction)")
+    r.add_argument("--limit", type=int, help="Archive at most this many reports")
+    r.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to reclaim the space")
+    sub.add_parser("status", help="Hot and archived report counts and archive size")
+    args = p.parse_args(argv)
+
+    from database import SessionLocal, engine, init_db
+    init_db()
+    if args.command == "run":
+        try:
+            result = report_archive.archive(engine, args.older_than_days, args.batch, args.limit)
+        except ArchiveUnavailable as e:
+            print(e)
+            return 1
+        print(f"Archived {result['archived']:,} reports created before {result['cutoff']} "
+              f"into {result['files']} file(s) in {result['seconds']}s")
+        if args.vacuum and result["archived"]:
+            vacuum(engine)
+            print("Vacuumed.")
+    else:
+        db = SessionLocal()
+        try:
+            print(json.dumps(report_archive.status(db), indent=2))
+        finally:
+            db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Offline batch analyzer for Cerberus DeepCrystal
+Runs a directory of photos through the ML pipeline without HTTP. Files are
+read and decoded in a pool of worker processes while the main process batches
+the decoded images through the vision encoder (torch uses every core for the
+forward pass), so throughput grows with the number of cores.
+
+Results go to NDJSON (one file) or Parquet (a directory of part files). Every
+--checkpoint-every images the pending results are written and fsynced (and,
+with --insert-db, inserted into analysis_reports plus the rollups in one
+transaction). Re-running the same command resumes: files already present in
+the output are skipped, and report session ids are derived from the file
+path and content, so re-inserted rows are recognised. With --client-id, a
+batch.completed webhook event is queued for that client when the run ends.
+
+Usage (from backend/):
+    python -m services.ml_pipeline analyze-dir ~/archive/2019 --out results.ndjson
+    python -m services.ml_pipeline analyze-dir ~/archive --format parquet --out results/ --insert-db --workers 15
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.imaging import load_image_file
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+BATCH_NAMESPACE = uuid.UUID("6f1c2a4e-93d5-4b8e-a1f0-5c7e2d9b3a18")
+JSON_FIELDS = ("inclusion_analysis", "crack_assessment", "origin_prediction")
+TEXT_FIELDS = ("path", "image_md5", "session_id", "mineral_name", "chemical_formula", "crystal_system",
+               "mohs_hardness", "treatment_type", "currency_local", "mode", "error") + JSON_FIELDS
+FLOAT_FIELDS = ("specific_gravity", "natural_probability", "synthetic_probability", "treatment_probability",
+                "price_min_local", "price_max_local", "price_min_usd", "price_max_usd", "confidence_score")
+
+
+def walk_images(root: str) -> list:
+    """Image files under root in a stable order (sorted directories and names)."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+
+def decoded_stream(paths: list, workers: int, decode_size, window: int):
+    """(path, md5, array, error) per path, in order; at most `window` files are in flight at once."""
+    if workers <= 0:
+        for path in paths:
+            yield load_image_file(path, decode_size)
+        return
+    methods = multiprocessing.get_all_start_methods()
+    # fork where available: workers start before the model is loaded and never touch torch
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = deque()
+        it = iter(paths)
+        for path in it:
+            pending.append(pool.submit(load_image_file, path, decode_size))
+            if len(pending) >= window:
+                break
+        while pending:
+            yield pending.popleft().result()
+            path = next(it, None)
+            if path is not None:
+                pending.append(pool.submit(load_image_file, path, decode_size))
+
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class NDJSONOutput:
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            complete = data[:data.rfind(b"\n") + 1]  # drop a line cut short by a crash
+            if len(complete) != len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(len(complete))
+            for line in complete.splitlines():
+                self.done.add(json.loads(line)["path"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, records: list):
+        for r in records:
+            self._file.write(json.dumps(r, ensure_ascii=False, default=_isoformat) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput:
+    """A directory of part-NNNNN.parquet files, one per checkpoint, each renamed into place when complete."""
+
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa, self.pq, self.path = pa, pq, path
+        os.makedirs(path, exist_ok=True)
+        fields = [(f, pa.string()) for f in TEXT_FIELDS] + [(f, pa.float64()) for f in FLOAT_FIELDS]
+        self.schema = pa.schema(fields + [("created_at", pa.timestamp("us"))])
+        parts = sorted(n for n in os.listdir(path) if n.startswith("part-") and n.endswith(".parquet"))
+        self.done = set()
+        for name in parts:
+            self.done.update(pq.read_table(os.path.join(path, name), columns=["path"]).column("path").to_pylist())
+        self._next = int(parts[-1][5:10]) + 1 if parts else 0
+
+    def write(self, records: list):
+        rows = [{**r, **{f: json.dumps(r[f], ensure_ascii=False) for f in JSON_FIELDS if r.get(f) is not None}}
+                for r in records]
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        final = os.path.join(self.path, f"part-{self._next:05d}.parquet")
+        self.pq.write_table(table, final + ".tmp")
+        os.replace(final + ".tmp", final)
+        self._next += 1
+
+    def close(self):
+        pass
+
+
+def insert_reports(engine, records: list) -> int:
+    """Bulk-inserts analysed records as AnalysisReport rows (+ rollups) in one transaction, skipping known sessions."""
+    from database import AnalysisReport
+    from services.rollups import record_reports
+    t = AnalysisReport.__table__
+    rows = [{k: v for k, v in r.items() if k not in ("path", "image_md5", "error")} for r in records if not r["error"]]
+    if not rows:
+        return 0
+    with engine.begin() as conn:
+        existing = {sid for (sid,) in conn.execute(
+            t.select().with_only_columns(t.c.session_id).where(t.c.session_id.in_([r["session_id"] for r in rows])))}
+        rows = [r for r in rows if r["session_id"] not in existing]
+        if rows:
+            conn.execute(t.insert(), rows)
+            record_reports(conn, rows)
+    return len(rows)
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m services.ml_pipeline analyze-dir", description=__doc__.split("\n")[1])
+    p.add_argument("directory", help="Directory of images (searched recursively)")
+    p.add_argument("--out", required=True, help="NDJSON file, or directory for --format parquet")
+    p.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    p.add_argument("--mode", default="api", help="Execution profile / report mode (free, pro, lab, api, gov)")
+    p.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                   help="Decode processes (0 = decode in the main process)")
+    p.add_argument("--batch-size", type=int, default=32, help="Images per forward pass")
+    p.add_argument("--decode-size", type=int, default=448,
+                   help="Decode JPEGs at reduced scale with short side >= this (0 = full resolution)")
+    p.add_argument("--checkpoint-every", type=int, default=512, help="Images between durable checkpoints")
+    p.add_argument("--insert-db", action="store_true", help="Also insert AnalysisReport rows into DATABASE_URL")
+    p.add_argument("--client-id", help="Queue a batch.completed webhook event for this client's subscriptions")
+    return p
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] != "analyze-dir":
+        print("Usage: python -m services.ml_pipeline analyze-dir <directory> --out <file|dir> [options]")
+        return 1
+    args = build_parser().parse_args(argv[1:])
+
+    output = ParquetOutput(args.out) if args.format == "parquet" else NDJSONOutput(args.out)
+    paths = [p for p in walk_images(args.directory) if p not in output.done]
+    print(f"{len(output.done):,} images already analysed, {len(paths):,} to go.")
+    if not paths:
+        output.close()
+        return 0
+
+    engine = None
+    if args.insert_db:
+        from database import engine, init_db
+        init_db()
+    stream = decoded_stream(paths, args.workers, args.decode_size or None, window=2 * args.batch_size + args.workers)
+    from services.ml_pipeline import analyze_decoded, report_row
+    from services.profiles import get_profile
+    profile = get_profile(args.mode)
+
+    pending, batch = [], []
+    done = inserted = failed = 0
+    start = time.perf_counter()
+
+    def run_batch():
+        results = analyze_decoded([([arr], md5, None) for _, md5, arr in batch], profile)
+        now = datetime.utcnow()
+        for (path, md5, _), result in zip(batch, results):
+            session_id = str(uuid.uuid5(BATCH_NAMESPACE, f"{path}:{md5}"))
+            pending.append({"path": path, "image_md5": md5, "error": None, "created_at": now,
+                            **report_row(result, session_id, None, profile["name"])})
+        batch.clear()
+
+    def checkpoint():
+        nonlocal inserted
+        if engine is not None:
+            inserted += insert_reports(engine, pending)
+        output.write(pending)
+        pending.clear()
+        rate = done / (time.perf_counter() - start)
+        print(f"  {done:,}/{len(paths):,} images  {rate:,.1f} img/s  ({failed} unreadable, {inserted:,} inserted)")
+
+    for path, md5, arr, error in stream:
+        done += 1
+        if error:
+            failed += 1
+            pending.append({"path": path, "image_md5": md5, "error": error})
+        else:
+            batch.append((path, md5, arr))
+            if len(batch) >= args.batch_size:
+                run_batch()
+        if done % args.checkpoint_every == 0:
+            if batch:
+                run_batch()
+            checkpoint()
+    if batch:
+        run_batch()
+    if pending:
+        checkpoint()
+    output.close()
+    elapsed = time.perf_counter() - start
+    print(f"Done in {elapsed:.1f} s.")
+    if args.client_id:
+        notify_batch(args, {"directory": os.path.abspath(args.directory), "output": os.path.abspath(args.out),
+                            "format": args.format, "mode": profile["name"], "images": done,
+                            "unreadable": failed, "inserted": inserted, "elapsed_s": round(elapsed, 1)})
+    return 0
+
+
+def notify_batch(args, summary: dict):
+    """Queues batch.completed in the webhook outbox; the API's dispatcher delivers it."""
+    from database import engine, init_db
+    from services.webhooks import dispatcher
+    init_db()
+    with engine.begin() as conn:
+        queued = dispatcher.enqueue(conn, args.client_id, "batch.completed", summary)
+    print(f"batch.completed queued for {queued} webhook subscription(s) of '{args.client_id}'.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""
+Hot-reloadable gem catalogue for Cerberus DeepCrystal
+The classifier's gem list, prompt templates and text-embedding bank live in an
+immutable snapshot. A reload builds the next snapshot beside the live one and
+swaps a single reference, so in-flight scans finish on the snapshot they
+started with and never wait on a reload.
+
+The catalogue is GEM_DATA (ml_pipeline) overlaid with CATALOGUE_FILE (JSON):
+
+    {
+      "prompt_templates": ["A close-up studio photograph of a polished {gem} gemstone", ...],
+      "gems": {
+        "Padparadscha": {"formula": "Al₂O₃", "crystal_system": "Trigonal", "mohs": [9, 9], ...},
+        "Blue Sapphire": {... replaces the built-in entry ...},
+        "Pyrite": null
+      }
+    }
+
+A null entry drops the gem from the classifier (its minerals row is kept for
+existing reports). Only prompts not already in the bank are encoded; added or
+changed gems are upserted into the minerals table before the swap. With
+CATALOGUE_WATCH_INTERVAL > 0 the file is polled for changes; the admin router
+(/api/admin/catalogue) can write and reload it on demand.
+Author: Sudeepa Wanigarathna
+"""
+
+import json
+import os
+import threading
+import time
+import torch
+from typing import Dict, List, Optional
+
+CATALOGUE_FILE = os.getenv("CATALOGUE_FILE", "data/gem_catalogue.json")
+WATCH_INTERVAL = float(os.getenv("CATALOGUE_WATCH_INTERVAL", "0"))  # seconds, 0 = no file watch
+
+DEFAULT_PROMPT_TEMPLATES = [
+    "A high-quality gemological macro photo of a {gem} gemstone showing its color and luster",
+    "A close-up studio photograph of a polished {gem} gemstone",
+    "A {gem} variety gemstone in a professional laboratory setting",
+]
+
+REQUIRED_FIELDS = ("formula", "crystal_system", "mohs", "sg", "ri", "luster", "transparency", "streak",
+                   "geological_class", "category", "origins", "treatments", "price_min", "price_max")
+ENCODE_BATCH = 256
+
+
+class CatalogueError(ValueError):
+    pass
+
+
+def _normalise_gem(name: str, data: dict) -> dict:
+    """Validates a catalogue entry and converts JSON lists to the tuples GEM_DATA uses."""
+    if not isinstance(data, dict):
+        raise CatalogueError(f"Gem '{name}' must be an object")
+    missing = [f for f in REQUIRED_FIELDS if f not in data]
+    if missing:
+        raise CatalogueError(f"Gem '{name}' is missing fields: {missing}")
+    gem = dict(data)
+    try:
+        for field in ("mohs", "sg", "ri"):
+            # Only the refractive index may be null (opaque stones such as Pyrite)
+            nullable = field == "ri"
+            if isinstance(gem[field], (str, dict)) or len(gem[field]) != 2 \
+                    or not all((nullable and v is None) or isinstance(v, (int, float)) for v in gem[field]):
+                raise CatalogueError(f"Gem '{name}': '{field}' must be a [min, max] pair of numbers")
+            gem[field] = tuple(gem[field])
+        gem["origins"] = [tuple(o) for o in gem["origins"]]
+        if not all(len(o) == 2 and isinstance(o[0], str) and isinstance(o[1], (int, float)) for o in gem["origins"]):
+            raise CatalogueError(f"Gem '{name}': 'origins' must be [country, probability] pairs")
+        if not all(isinstance(gem[f], (int, float)) for f in ("price_min", "price_max")):
+            raise CatalogueError(f"Gem '{name}': price_min and price_max must be numbers")
+        if gem["price_min"] > gem["price_max"]:
+            raise CatalogueError(f"Gem '{name}': price_min exceeds price_max")
+    except (TypeError, ValueError) as e:
+        if isinstance(e, CatalogueError):
+            raise
+        raise CatalogueError(f"Gem '{name}' has a malformed field: {e}")
+    return gem
+
+
+def parse_catalogue(document: dict) -> tuple:
+    """(prompt_templates, gem overrides) from a catalogue document; raises CatalogueError."""
+    templates = document.get("prompt_templates") or DEFAULT_PROMPT_TEMPLATES
+    if not all(isinstance(t, str) and "{gem}" in t for t in templates):
+        raise CatalogueError("Every prompt template must be a string containing '{gem}'")
+    gems = document.get("gems") or {}
+    overrides = {name: None if data is None else _normalise_gem(name, data) for name, data in gems.items()}
+    return list(templates), overrides
+
+
+def mineral_fields(name: str, data: dict) -> dict:
+    """Columns of a minerals row derived from a GEM_DATA entry."""
+    return {
+        "chemical_formula": data["formula"],
+        "crystal_system": data["crystal_system"],
+        "mohs_hardness_min": data["mohs"][0],
+        "mohs_hardness_max": data["mohs"][1],
+        "specific_gravity_min": data["sg"][0],
+        "specific_gravity_max": data["sg"][1],
+        "refractive_index_min": data["ri"][0],
+        "refractive_index_max": data["ri"][1],
+        "luster": data["luster"],
+        "transparency": data["transparency"],
+        "streak": data["streak"],
+        "geological_class": data["geological_class"],
+        "category": data["category"],
+        "color": data.get("color", "Variable"),
+        "known_origins": ", ".join([f"{c} ({p:.0%})" for c, p in data["origins"]]),
+        "common_treatments": ", ".join(data["treatments"]),
+        "price_min_usd": data["price_min"],
+        "price_max_usd": data["price_max"],
+        "uv_fluorescence": data.get("uv", ""),
+    }
+
+
+class CatalogueSnapshot:
+    """One consistent view of the classifier: gem order, prompt labels and their embeddings."""
+
+    def __init__(self, version: int, gem_data: dict, templates: List[str], text_bank: torch.Tensor):
+        self.version = version
+        self.gem_data = gem_data
+        self.gem_names = list(gem_data.keys())
+        self.templates = templates
+        self.n_prompts = len(templates)
+        self.labels = build_labels(self.gem_names, templates)
+        self.text_bank = text_bank  # [len(gem_names) * n_prompts, D], L2-normalised
+        self.loaded_at = time.time()
+
+
+def build_labels(gem_names: List[str], templates: List[str]) -> List[str]:
+    try:
+        return [t.format(gem=gem) for gem in gem_names for t in templates]
+    except (KeyError, IndexError, ValueError) as e:
+        raise CatalogueError(f"Prompt template can only use the {{gem}} placeholder: {e!r}")
+
+
+class CatalogueManager:
+    def __init__(self, path: str = CATALOGUE_FILE):
+        self.path = path
+        self._snapshot: Optional[CatalogueSnapshot] = None
+        self._prompt_cache: Dict[str, torch.Tensor] = {}  # label -> normalised embedding
+        self._reload_lock = threading.Lock()
+        self._file_mtime = None
+        self._watcher = None
+        self.last_reload: dict = {}
+
+    def get(self) -> CatalogueSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._reload_lock:
+                if self._snapshot is None:
+                    self._apply(self._read_file())
+            snapshot = self._snapshot
+        return snapshot
+
+    def _read_file(self) -> dict:
+        if not os.path.exists(self.path):
+            self._file_mtime = None
+            return {}
+        self._file_mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _encode(self, labels: List[str]) -> tuple:
+        from services.ml_pipeline import encode_texts
+        missing = [label for label in dict.fromkeys(labels) if label not in self._prompt_cache]
+        for start in range(0, len(missing), ENCODE_BATCH):
+            chunk = missing[start:start + ENCODE_BATCH]
+            for label, row in zip(chunk, encode_texts(chunk)):
+                self._prompt_cache[label] = row
+        return torch.stack([self._prompt_cache[label] for label in labels]), len(missing)
+
+    def _apply(self, document: dict) -> dict:
+        """Builds the next snapshot from `document`, syncs minerals rows, then swaps it in. Caller holds _reload_lock."""
+        from services.ml_pipeline import GEM_DATA
+        from services.profiles import result_cache
+        start = time.perf_counter()
+        templates, overrides = parse_catalogue(document)
+        gem_data = dict(GEM_DATA)
+        for name, data in overrides.items():
+            if data is None:
+                gem_data.pop(name, None)
+            else:
+                gem_data[name] = data
+        if not gem_data:
+            raise CatalogueError("Catalogue has no gems")
+
+        previous = self._snapshot
+        old = previous.gem_data if previous else {}
+        added = [n for n in gem_data if n not in old]
+        changed = [n for n in gem_data if n in old and gem_data[n] != old[n]]
+        removed = [n for n in old if n not in gem_data]
+
+        labels = build_labels(list(gem_data), templates)
+        text_bank, encoded = self._encode(labels)
+        # On first load only the file's own entries can differ from the seeded rows
+        to_sync = added + changed if previous else [n for n, d in overrides.items() if d is not None]
+        upserted = sync_minerals({n: gem_data[n] for n in to_sync})
+
+        self._snapshot = CatalogueSnapshot((previous.version + 1) if previous else 1, gem_data, templates, text_bank)
+        # Drop embeddings of prompts no longer in the catalogue
+        self._prompt_cache = {label: self._prompt_cache[label] for label in labels}
+        result_cache.clear()
+        self.last_reload = {
+            "version": self._snapshot.version,
+            "gems": len(gem_data),
+            "prompt_templates": len(templates),
+            "added": added if previous else [],
+            "changed": changed,
+            "removed": removed,
+            "prompts_encoded": encoded,
+            "prompts_reused": len(labels) - encoded,
+            "minerals_upserted": upserted,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        if previous:
+            print(f"Gem catalogue v{self._snapshot.version}: +{len(added)} ~{len(changed)} -{len(removed)} gems, "
+                  f"{encoded} prompts encoded")
+        return self.last_reload
+
+    def reload(self, document: Optional[dict] = None) -> dict:
+        """Reloads from CATALOGUE_FILE, or applies `document` without touching the file."""
+        with self._reload_lock:
+            return self._apply(self._read_file() if document is None else document)
+
+    def write(self, document: dict) -> dict:
+        """Applies `document`, then writes it to CATALOGUE_FILE atomically so watching nodes follow.
+
+        The snapshot is built first, so a document that fails to apply never reaches the file."""
+        with self._reload_lock:
+            result = self._apply(document)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(document, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._file_mtime = os.path.getmtime(self.path)  # our own write: the watcher needn't reload it
+            return result
+
+    def status(self) -> dict:
+        snapshot = self.get()
+        return {
+            "version": snapshot.version,
+            "gems": len(snapshot.gem_names),
+            "prompt_templates": snapshot.templates,
+            "file": self.path,
+            "file_present": os.path.exists(self.path),
+            "watching": self._watcher is not None,
+            "loaded_at": snapshot.loaded_at,
+            "last_reload": self.last_reload,
+        }
+
+    # ── file watch ──
+    def _watch(self, interval: float):
+        while True:
+            time.sleep(interval)
+            mtime = self._file_mtime
+            try:
+                mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+                if mtime != self._file_mtime:
+                    self.reload()
+            except Exception as e:
+                print(f"Gem catalogue reload failed: {e}")
+                self._file_mtime = mtime  # don't retry a broken file until it changes again
+
+    def start_watcher(self, interval: float = WATCH_INTERVAL):
+        if interval > 0 and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True, name="catalogue-watch")
+            self._watcher.start()
+
+
+def sync_minerals(gems: Dict[str, dict]) -> int:
+    """Inserts or updates the minerals rows for `gems` in one transaction."""
+    if not gems:
+        return 0
+    from database import SessionLocal, Mineral
+    db = SessionLocal()
+    try:
+        existing = {m.name: m for m in db.query(Mineral).filter(Mineral.name.in_(list(gems))).all()}
+        for name, data in gems.items():
+            fields = mineral_fields(name, data)
+            row = existing.get(name)
+            if row is None:
+                db.add(Mineral(name=name, price_unit="per carat", cleavage="See technical references",
+                               fracture="Conchoidal",
+                               description=f"{name} gemstone data from Cerberus DeepCrystal knowledge base.",
+                               **fields))
+            else:
+                for column, value in fields.items():
+                    setattr(row, column, value)
+        db.commit()
+        return len(gems)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+catalogue = CatalogueManager()
+
+
+def get_catalogue() -> CatalogueSnapshot:
+    """The live catalogue snapshot; scans read it once and keep it for the whole scan."""
+    return catalogue.get()
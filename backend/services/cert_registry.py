@@ -0,0 +1,309 @@
+"""
+Certificate registry for Cerberus DeepCrystal
+Answers most /api/blockchain/verify requests without touching the database:
+
+  - a Bloom filter of every issued cert id. An id that is not in the filter
+    was never issued, so the request is rejected (404) at once. That covers
+    QR scanners, typos and scrapers trying random ids. A false positive
+    (CERT_FILTER_FP_RATE, default 0.1%) just falls through to the database.
+  - a dict of revoked certificates with the data /verify returns for them, so
+    revoked certificates are flagged from memory as well.
+
+VerifyFastPathMiddleware answers those two cases before routing (FastAPI's
+routing and dependency resolution cost more than the lookup itself); only
+ids that may be valid reach the route and the database. The filter is built from
+blockchain_certs when the app starts (in the background, so startup does not
+wait for it; until it is ready every request takes the database path). This
+worker's new certificates and revocations are added immediately; a thread
+picks up those of other workers every CERT_SYNC_INTERVAL seconds, so a
+certificate issued on another worker can be reported as unknown for at most
+that long. Sync reads ids above its watermark minus CERT_SYNC_OVERLAP: ids are
+allocated when a row is inserted but become visible when its transaction
+commits, so on PostgreSQL a certificate can commit after a higher id already
+has. Ids the filter already holds are skipped. The filter is sized for twice the issued
+certificates (at least CERT_FILTER_MIN_CAPACITY) and rebuilt larger once it
+fills up; 1 million ids take 1.8 MB at 0.1%.
+Author: Sudeepa Wanigarathna
+"""
+
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+
+from database import engine, BlockchainCert, CertRevocation
+
+CERT_FILTER = os.getenv("CERT_FILTER", "1") == "1"
+CERT_FILTER_FP_RATE = float(os.getenv("CERT_FILTER_FP_RATE", "0.001"))
+CERT_FILTER_MIN_CAPACITY = int(os.getenv("CERT_FILTER_MIN_CAPACITY", "1000000"))
+CERT_SYNC_INTERVAL = float(os.getenv("CERT_SYNC_INTERVAL", "2"))
+CERT_SYNC_OVERLAP = int(os.getenv("CERT_SYNC_OVERLAP", "1000"))  # ids re-read below the watermark
+LOAD_CHUNK = 50_000
+_MASK64 = (1 << 64) - 1
+
+
+def _digest(cert_id: str) -> bytes:
+    return hashlib.blake2b(cert_id.encode(), digest_size=16).digest()
+
+
+class BloomFilter:
+    """k bit positions per key from one 128-bit hash (double hashing: h1 + i*h2 mod 2^64, mod m)."""
+
+    def __init__(self, capacity: int, fp_rate: float = CERT_FILTER_FP_RATE):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.m = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2 / 8) * 8)
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray(self.m // 8)
+        self.count = 0
+        self._lock = threading.Lock()  # writers only; lookups read the bytes directly
+
+    def _positions(self, cert_id: str) -> list:
+        d = _digest(cert_id)
+        h1, h2 = int.from_bytes(d[:8], "little"), int.from_bytes(d[8:], "little") | 1
+        return [((h1 + i * h2) & _MASK64) % self.m for i in range(self.k)]
+
+    def add(self, cert_id: str):
+        positions = self._positions(cert_id)
+        with self._lock:
+            for p in positions:
+                self.bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+    def add_many(self, cert_ids: list):
+        """Vectorized add (same positions as add())."""
+        if not cert_ids:
+            return
+        hashes = np.frombuffer(b"".join(_digest(c) for c in cert_ids), dtype="<u8").reshape(-1, 2)
+        h1, h2 = hashes[:, :1], hashes[:, 1:] | np.uint64(1)
+        positions = ((h1 + np.arange(self.k, dtype=np.uint64) * h2) % np.uint64(self.m)).ravel()
+        with self._lock:
+            np.bitwise_or.at(np.frombuffer(self.bits, dtype=np.uint8), (positions >> np.uint64(3)).astype(np.int64),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+            self.count += len(cert_ids)
+
+    def __contains__(self, cert_id: str) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(cert_id))
+
+    @property
+    def full(self) -> bool:
+        return self.count > self.capacity
+
+
+def verify_payload(cert, revocation=None) -> dict:
+    """/verify response for a BlockchainCert row (and its CertRevocation, if any)."""
+    return {
+        "cert_id": cert.cert_id,
+        "mineral_name": cert.mineral_name,
+        "confidence_score": cert.confidence_score,
+        "hash_value": cert.hash_value,
+        "issued_at": cert.issued_at.isoformat(),
+        "is_valid": cert.is_valid and revocation is None,
+        "qr_code_url": cert.qr_path,
+        "revoked": revocation is not None,
+        "revoked_at": revocation.revoked_at.isoformat() if revocation is not None else None,
+        "revocation_reason": revocation.reason if revocation is not None else None,
+    }
+
+
+class CertRegistry:
+    def __init__(self, enabled: bool = CERT_FILTER, sync_interval: float = CERT_SYNC_INTERVAL):
+        self.enabled = enabled
+        self.sync_interval = sync_interval
+        self.filter: Optional[BloomFilter] = None
+        self.revoked = {}  # cert_id -> verify payload
+        self.rejected = 0
+        self.revoked_hits = 0
+        self.passed = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = None
+        self._cert_watermark = 0
+        self._revocation_watermark = 0
+        self._lock = threading.Lock()  # rebuild/sync
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ── lookups ──
+    def check(self, cert_id: str) -> tuple:
+        """("unknown", None), ("revoked", payload) or ("maybe", None) when the database must answer."""
+        revoked = self.revoked.get(cert_id)
+        if revoked is not None:
+            self.revoked_hits += 1
+            return "revoked", revoked
+        bloom = self.filter
+        if bloom is not None and cert_id not in bloom:
+            self.rejected += 1
+            return "unknown", None
+        self.passed += 1
+        return "maybe", None
+
+    def missed(self):
+        """The database did not know an id the filter let through."""
+        if self.filter is not None:
+            self.false_positives += 1
+
+    # ── updates ──
+    def issued(self, cert_id: str):
+        bloom = self.filter
+        if bloom is not None:
+            bloom.add(cert_id)
+
+    def revoke(self, db, cert_id: str, reason: Optional[str], revoked_by: Optional[str]) -> Optional[dict]:
+        """Revokes an issued certificate. Returns its verify payload, or None if it does not exist."""
+        cert = db.query(BlockchainCert).filter(BlockchainCert.cert_id == cert_id).first()
+        if cert is None:
+            return None
+        revocation = db.query(CertRevocation).filter(CertRevocation.cert_id == cert_id).first()
+        if revocation is None:
+            revocation = CertRevocation(cert_id=cert_id, reason=reason, revoked_by=revoked_by,
+                                        revoked_at=datetime.utcnow())
+            db.add(revocation)
+            cert.is_valid = False
+            db.commit()
+        payload = verify_payload(cert, revocation)
+        self.revoked[cert_id] = payload
+        return payload
+
+    @staticmethod
+    def _load_revocations(conn, after: int, into: dict) -> int:
+        c, r = BlockchainCert.__table__, CertRevocation.__table__
+        rows = conn.execute(select(c, r.c.id.label("revocation_id"), r.c.reason, r.c.revoked_at)
+                            .join(r, r.c.cert_id == c.c.cert_id).where(r.c.id > after).order_by(r.c.id)).all()
+        for row in rows:
+            into[row.cert_id] = verify_payload(row, row)
+            after = row.revocation_id
+        return after
+
+    def _cert_ids(self, conn, after: int) -> Iterable[list]:
+        c = BlockchainCert.__table__
+        result = conn.execution_options(stream_results=True, yield_per=LOAD_CHUNK).execute(
+            select(c.c.id, c.c.cert_id).where(c.c.id > after).order_by(c.c.id))
+        for chunk in result.partitions(LOAD_CHUNK):
+            self._cert_watermark = max(self._cert_watermark, chunk[-1][0])
+            yield [cert_id for _, cert_id in chunk if cert_id]
+
+    def rebuild(self) -> dict:
+        """Builds a new filter (and revocation set) from the database and swaps it in."""
+        started = time.perf_counter()
+        with self._lock:
+            with engine.connect() as conn:
+                count = conn.execute(select(func.count()).select_from(BlockchainCert)).scalar() or 0
+                bloom = BloomFilter(max(CERT_FILTER_MIN_CAPACITY, 2 * count))
+                self._cert_watermark = 0
+                for cert_ids in self._cert_ids(conn, 0):
+                    bloom.add_many(cert_ids)
+                revoked = {}
+                self._revocation_watermark = self._load_revocations(conn, 0, revoked)
+            self.filter, self.revoked = bloom, revoked
+        self.rebuilds += 1
+        self.last_rebuild_ms = round((time.perf_counter() - started) * 1000, 1)
+        print(f"Certificate filter: {bloom.count:,} ids, {len(self.revoked):,} revoked, "
+              f"{len(bloom.bits) / 1024 / 1024:.1f} MB, built in {self.last_rebuild_ms} ms")
+        return self.status()
+
+    def sync(self):
+        """Adds certificates and revocations written by other workers since the last sync."""
+        with self._lock:
+            bloom = self.filter
+            if bloom is None:
+                return
+            with engine.connect() as conn:
+                for cert_ids in self._cert_ids(conn, max(0, self._cert_watermark - CERT_SYNC_OVERLAP)):
+                    bloom.add_many([cert_id for cert_id in cert_ids if cert_id not in bloom])
+                self._revocation_watermark = max(self._revocation_watermark, self._load_revocations(
+                    conn, max(0, self._revocation_watermark - CERT_SYNC_OVERLAP), self.revoked))
+        if bloom.full:
+            self.rebuild()
+
+    def start(self):
+        """Builds the filter in the background, then keeps it in sync (once per process)."""
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"Certificate filter build failed, verifying against the database: {e}")
+                return
+            while not self._stop.wait(self.sync_interval):
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Certificate filter sync failed: {e}")
+
+        self._thread = threading.Thread(target=loop, daemon=True, name="cert-registry")
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def status(self) -> dict:
+        bloom = self.filter
+        return {
+            "enabled": self.enabled,
+            "ready": bloom is not None,
+            "ids_added": bloom.count if bloom else None,
+            "capacity": bloom.capacity if bloom else None,
+            "filter_bytes": len(bloom.bits) if bloom else None,
+            "hash_functions": bloom.k if bloom else None,
+            "target_fp_rate": bloom.fp_rate if bloom else None,
+            "revoked": len(self.revoked),
+            "rejected": self.rejected,
+            "revoked_hits": self.revoked_hits,
+            "passed_to_db": self.passed,
+            "false_positives": self.false_positives,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": self.last_rebuild_ms,
+            "sync_interval_s": self.sync_interval,
+        }
+
+
+registry = CertRegistry()
+
+VERIFY_PREFIX = "/api/blockchain/verify/"
+
+
+class VerifyFastPathMiddleware:
+    """Answers /verify for never-issued (404) and revoked (200) ids from the registry, before routing."""
+
+    def __init__(self, app, cert_registry: CertRegistry = registry):
+        self.app = app
+        self.registry = cert_registry
+
+    async def __call__(self, scope, receive, send):
+        path = scope["path"] if scope["type"] == "http" and scope["method"] == "GET" else ""
+        cert_id = path[len(VERIFY_PREFIX):]
+        if not path.startswith(VERIFY_PREFIX) or not cert_id or "/" in cert_id:
+            return await self.app(scope, receive, send)
+        state, payload = self.registry.check(cert_id)
+        if state == "maybe":
+            scope.setdefault("state", {})["cert_checked"] = True
+            return await self.app(scope, receive, send)
+        from starlette.requests import Request
+        from services.audit_log import audit
+        from services.quotas import request_client
+        audit.record("certificate.verified", client=request_client(Request(scope)), cert_id=cert_id, found=payload is not None,
+                     valid=payload["is_valid"] if payload else None)
+        if payload is None:
+            status, body = 404, {"detail": f"Certificate {cert_id} not found in the Cerberus DeepCrystal ledger."}
+        else:
+            status, body = 200, payload
+        data = json.dumps(body).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]})
+        await send({"type": "http.response.body", "body": data})
@@ -0,0 +1,275 @@
+"""
+Scan embedding store for Cerberus DeepCrystal
+Persists each scan's CLIP image embedding and answers nearest-neighbour
+queries, so a stone photographed again (possibly re-certified under a
+different claim) is recognised.
+
+Storage (under EMBEDDING_STORE_DIR, default storage/embeddings):
+  vectors.f16   float16 [N, D], append-only, memory-mapped for reads
+  keys.bin      session ids, fixed-width [N]
+  hashes.i64    64-bit hash of each session id [N] (written last: its size is the row count)
+  assign.i32    IVF list assignment of each row [N]
+  ivf.npz       IVF centroids [C, D] float32 and the row count they were trained on
+  .lock         appends and index swaps take an exclusive flock on it
+
+Every Gunicorn worker opens the same files: a worker appends under the file
+lock at the row count read from disk, and picks up rows and centroids written
+by the other workers before each lookup.
+
+Search is an IVF (inverted file) index: spherical k-means centroids partition
+the vectors, and a query scans only the `nprobe` closest lists plus the rows
+added since the lists were last built. Centroids are retrained in a background
+thread whenever the store has grown 4x, so inserts never wait on k-means.
+Author: Sudeepa Wanigarathna
+"""
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process (no Gunicorn)
+    fcntl = None
+
+STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "storage/embeddings")
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_SIMILARITY_THRESHOLD", "0.96"))
+
+KEY_WIDTH = 36  # uuid4 string
+MIN_TRAIN = 4096  # below this, brute force over the memmap is already sub-millisecond
+KMEANS_ITERS = 8
+TRAIN_SAMPLE = 65536
+TAIL_REBUILD = 1024  # rebuild inverted lists once this many rows are unindexed
+
+
+def _key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little", signed=True)
+
+
+def _normalise(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+class EmbeddingStore:
+    def __init__(self, root: str = STORE_DIR, dim: Optional[int] = None, nprobe: int = 8):
+        self.root = root
+        self.dim = dim
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._paths = {name: os.path.join(root, name) for name in ("vectors.f16", "keys.bin", "hashes.i64", "assign.i32", "ivf.npz", ".lock")}
+        self._centroids = None
+        self._trained_n = 0
+        self._ivf_mtime = None
+        self._rows = {}  # session id -> row
+        self.count = 0
+        self._lists_order = None  # row ids sorted by list
+        self._lists_offsets = None  # [C + 1] offsets into _lists_order
+        self._indexed_n = 0  # rows covered by the inverted lists
+        self._training = None  # background training thread
+        self._load()
+
+    # ── persistence ──
+    @contextmanager
+    def _file_lock(self):
+        """This process's lock plus an exclusive flock shared with the other workers."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._paths[".lock"], "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _disk_count(self) -> int:
+        path = self._paths["hashes.i64"]
+        return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+    def _trim(self):
+        """Under the file lock: hashes.i64 is written last on add, so drop any partial row left by a crash."""
+        for name, row_bytes in (("vectors.f16", 2 * (self.dim or 0)), ("keys.bin", KEY_WIDTH), ("assign.i32", 4)):
+            path = self._paths[name]
+            if os.path.exists(path) and os.path.getsize(path) > self.count * row_bytes:
+                os.truncate(path, self.count * row_bytes)
+
+    def _load(self):
+        with self._file_lock():
+            self.count = self._disk_count()
+            if self.count and self.dim is None:
+                self.dim = os.path.getsize(self._paths["vectors.f16"]) // (2 * self.count)
+            self._trim()
+            self._refresh_views()
+            self._index_keys(0)
+            self._load_ivf()
+
+    def _sync(self):
+        """Under self._lock: picks up rows and centroids other workers wrote since the last call."""
+        count = self._disk_count()
+        if count > self.count:
+            start, self.count = self.count, count
+            if self.dim is None:
+                self.dim = os.path.getsize(self._paths["vectors.f16"]) // (2 * count)
+            self._refresh_views()
+            self._index_keys(start)
+        self._load_ivf()
+
+    def _load_ivf(self):
+        path = self._paths["ivf.npz"]
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime is not None and mtime != self._ivf_mtime:
+            ivf = np.load(path)
+            self._centroids, self._trained_n = ivf["centroids"], int(ivf["trained_n"])
+            self._ivf_mtime = mtime
+            self._build_lists()
+
+    def _index_keys(self, start: int):
+        for row in range(start, self.count):
+            self._rows[self._keys[row].decode()] = row
+
+    def _refresh_views(self):
+        if self.count == 0:
+            self._vectors = np.zeros((0, self.dim or 0), dtype=np.float16)
+            self._keys = np.zeros(0, dtype=f"S{KEY_WIDTH}")
+            return
+        self._vectors = np.memmap(self._paths["vectors.f16"], dtype=np.float16, mode="r", shape=(self.count, self.dim))
+        self._keys = np.memmap(self._paths["keys.bin"], dtype=f"S{KEY_WIDTH}", mode="r", shape=(self.count,))
+
+    def _assignments(self) -> np.ndarray:
+        return np.memmap(self._paths["assign.i32"], dtype=np.int32, mode="r", shape=(self.count,))
+
+    # ── IVF index ──
+    @staticmethod
+    def _assign_to(centroids: Optional[np.ndarray], vectors: np.ndarray) -> np.ndarray:
+        if centroids is None:
+            return np.full(len(vectors), -1, dtype=np.int32)
+        return np.argmax(np.asarray(vectors, dtype=np.float32) @ centroids.T, axis=1).astype(np.int32)
+
+    def _needs_training(self) -> bool:
+        if self._centroids is None:
+            return self.count >= MIN_TRAIN
+        return self.count >= 4 * self._trained_n
+
+    def rebuild_index(self):
+        """Spherical k-means on a sample, then reassign every row in chunks and swap the index in."""
+        with self._lock:
+            n, vectors = self.count, self._vectors
+        n_lists = int(min(65536, max(16, 4 * np.sqrt(n))))
+        rng = np.random.default_rng(n)
+        sample_idx = np.sort(rng.choice(n, size=min(n, TRAIN_SAMPLE), replace=False))
+        sample = np.asarray(vectors[sample_idx], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=min(n_lists, len(sample)), replace=False)]
+        for _ in range(KMEANS_ITERS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=len(centroids)) == 0
+            sums[empty] = centroids[empty]
+            centroids = _normalise(sums).astype(np.float32)
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, 65536):
+            assign[start:start + 65536] = self._assign_to(centroids, vectors[start:start + 65536])
+
+        with self._file_lock():
+            # Rows appended while training (by any worker) were assigned against the old centroids
+            self._sync()
+            extra = self._assign_to(centroids, self._vectors[n:self.count])
+            tmp = self._paths["assign.i32"] + ".tmp"
+            np.concatenate([assign, extra]).tofile(tmp)
+            os.replace(tmp, self._paths["assign.i32"])
+            np.savez(self._paths["ivf.npz"] + ".tmp.npz", centroids=centroids, trained_n=n)
+            os.replace(self._paths["ivf.npz"] + ".tmp.npz", self._paths["ivf.npz"])
+            self._centroids, self._trained_n = centroids, n
+            self._ivf_mtime = os.path.getmtime(self._paths["ivf.npz"])
+            self._build_lists()
+            self._training = None
+
+    def _build_lists(self):
+        assign = np.asarray(self._assignments())
+        self._lists_order = np.argsort(assign, kind="stable").astype(np.int64)
+        self._lists_offsets = np.searchsorted(assign[self._lists_order], np.arange(len(self._centroids) + 1))
+        self._indexed_n = self.count
+
+    # ── public API ──
+    def add(self, key: str, embedding: np.ndarray):
+        vec = _normalise(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+        with self._file_lock():
+            # Append at the row count on disk (other workers may have added rows), with their latest centroids
+            self._sync()
+            if self.dim is None:
+                self.dim = vec.shape[1]
+            self._trim()
+            with open(self._paths["vectors.f16"], "ab") as f:
+                f.write(vec.astype(np.float16).tobytes())
+            with open(self._paths["keys.bin"], "ab") as f:
+                f.write(np.array([key.encode()[:KEY_WIDTH]], dtype=f"S{KEY_WIDTH}").tobytes())
+            with open(self._paths["assign.i32"], "ab") as f:
+                f.write(self._assign_to(self._centroids, vec).tobytes())
+            with open(self._paths["hashes.i64"], "ab") as f:
+                f.write(np.array([_key_hash(key)], dtype=np.int64).tobytes())
+            self.count += 1
+            self._refresh_views()
+            self._rows[key] = self.count - 1
+            if self._training is None and self._needs_training():
+                self._training = threading.Thread(target=self.rebuild_index, daemon=True)
+                self._training.start()
+            elif self._centroids is not None and self.count - self._indexed_n >= TAIL_REBUILD:
+                self._build_lists()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            self._sync()
+            row, vectors = self._rows.get(key), self._vectors
+        return None if row is None else np.asarray(vectors[row], dtype=np.float32)
+
+    def search(self, embedding: np.ndarray, k: int = 10, threshold: float = 0.0,
+               exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Top-k (session_id, cosine similarity) pairs with similarity >= threshold."""
+        q = _normalise(np.asarray(embedding, dtype=np.float32).reshape(-1))
+        with self._lock:
+            self._sync()
+            vectors, keys, count = self._vectors, self._keys, self.count
+            centroids, order, offsets, indexed = self._centroids, self._lists_order, self._lists_offsets, self._indexed_n
+        if count == 0:
+            return []
+        if centroids is None:
+            candidates = np.arange(count)
+        else:
+            probe = np.argpartition(-(centroids @ q), min(self.nprobe, len(centroids)) - 1)[:self.nprobe]
+            parts = [order[offsets[c]:offsets[c + 1]] for c in probe]
+            parts.append(np.arange(indexed, count))
+            candidates = np.sort(np.concatenate(parts))
+        if len(candidates) == 0:
+            return []
+        sims = np.asarray(vectors[candidates], dtype=np.float32) @ q
+        top = np.argsort(-sims)[:k + (1 if exclude else 0)]
+        results = []
+        for i in top:
+            if sims[i] < threshold:
+                break
+            key = keys[candidates[i]].decode()
+            if key != exclude:
+                results.append((key, round(float(sims[i]), 4)))
+        return results[:k]
+
+    def find_duplicates(self, embedding: np.ndarray, k: int = 5) -> List[Tuple[str, float]]:
+        return self.search(embedding, k=k, threshold=DUPLICATE_THRESHOLD)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """Process-wide singleton, opened lazily on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EmbeddingStore()
+    return _store
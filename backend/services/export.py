@@ -0,0 +1,232 @@
+"""
+Bulk report export for Cerberus DeepCrystal
+Streams AnalysisReport rows as NDJSON, CSV or Parquet in constant memory: rows
+come off a server-side cursor in chunks of EXPORT_CHUNK_ROWS, a prefetch
+thread fetches the next chunk while the current one is encoded, and each
+encoded chunk is handed to the response as soon as it is ready.
+
+The JSON columns are flattened by the database itself (JSON path extraction,
+json_extract on SQLite, ->> on PostgreSQL), so rows arrive as flat tuples:
+
+  inclusion_analysis  -> inclusion_<key>      (gas_bubbles, rutile_silk, ..., summary)
+  crack_assessment    -> crack_<key>          (surface_cracks, ..., overall_clarity_grade)
+  origin_prediction   -> origin_<n>_country / origin_<n>_probability for the top ORIGIN_SLOTS
+Author: Sudeepa Wanigarathna
+"""
+
+import csv
+import io
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import DateTime, String, func, literal, select
+
+from database import AnalysisReport
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+SCALAR_COLUMNS = [
+    "session_id", "blockchain_id", "mineral_name", "chemical_formula", "crystal_system", "mohs_hardness",
+    "specific_gravity", "natural_probability", "synthetic_probability", "treatment_probability", "treatment_type",
+    "price_min_local", "price_max_local", "price_min_usd", "price_max_usd", "currency_local",
+    "confidence_score", "mode", "created_at",
+]
+INCLUSION_KEYS = ["curved_growth_lines", "gas_bubbles", "rutile_silk", "fracture_filling", "flame_fusion_indicators",
+                  "heat_treatment_markers", "fingerprint_inclusions", "needles", "crystals", "feathers", "summary"]
+CRACK_KEYS = ["surface_cracks", "internal_fractures", "chips", "abrasions", "overall_clarity_grade", "damage_description"]
+ORIGIN_SLOTS = 5
+
+_TEXT_KEYS = {"summary", "overall_clarity_grade", "damage_description", "country"}
+
+
+def _json_column(column, path, label: str):
+    key = path[-1] if isinstance(path, tuple) else path
+    element = column[path]
+    return (element.as_string() if key in _TEXT_KEYS else element.as_float()).label(label)
+
+
+def _flat_columns():
+    t = AnalysisReport.__table__
+    columns = [t.c[name] for name in SCALAR_COLUMNS]
+    columns += [_json_column(t.c.inclusion_analysis, k, f"inclusion_{k}") for k in INCLUSION_KEYS]
+    columns += [_json_column(t.c.crack_assessment, k, f"crack_{k}") for k in CRACK_KEYS]
+    for i in range(ORIGIN_SLOTS):
+        for field in ("country", "probability"):
+            columns.append(_json_column(t.c.origin_prediction, (i, field), f"origin_{i + 1}_{field}"))
+    return columns
+
+
+EXPORT_COLUMNS = [c.name for c in _flat_columns()]
+
+
+def build_query(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                mineral: Optional[str] = None, mode: Optional[str] = None):
+    t = AnalysisReport.__table__
+    query = select(*_flat_columns())
+    if start:
+        query = query.where(t.c.created_at >= start)
+    if end:
+        query = query.where(t.c.created_at < end)
+    if mineral:
+        query = query.where(t.c.mineral_name == mineral)
+    if mode:
+        query = query.where(t.c.mode == mode)
+    return query.order_by(t.c.id)
+
+
+# Dialects that can render a row as a JSON object server-side (both cap a call at 100 arguments)
+_JSON_OBJECT = {"sqlite": func.json_object, "postgresql": func.json_build_object}
+
+
+def build_json_query(dialect: str, **filters):
+    """NDJSON lines rendered by the database, or None when the dialect can't."""
+    if dialect not in _JSON_OBJECT:
+        return None
+    flat = build_query(**filters).subquery()
+    created = flat.c.created_at
+    if dialect == "sqlite":
+        created = func.replace(created, " ", "T")  # stored as "YYYY-MM-DD HH:MM:SS.ffffff"; match isoformat()
+    pairs = [arg for c in flat.c for arg in (literal(c.name), created if c.name == "created_at" else c)]
+    return select(_JSON_OBJECT[dialect](*pairs))
+
+
+def _chunks(engine, query) -> Iterator[list]:
+    """Row chunks from a server-side cursor (named cursor on PostgreSQL), one chunk fetched ahead."""
+    ready = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def fetch():
+        try:
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS).execute(query)
+                for partition in result.partitions():
+                    if stop.is_set():
+                        break
+                    put(partition)
+            put(None)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=fetch, daemon=True, name="export-fetch").start()
+    try:
+        while True:
+            item = ready.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()  # client went away or export finished: let the fetch thread release its connection
+
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# json.dumps with keyword arguments builds a new encoder per call; reuse one
+_encode_json = json.JSONEncoder(ensure_ascii=False, default=_isoformat).encode
+
+
+def _ndjson(chunks) -> Iterator[bytes]:
+    for rows in chunks:
+        yield "".join([_encode_json(dict(zip(EXPORT_COLUMNS, r))) + "\n" for r in rows]).encode()
+
+
+def _csv(chunks) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink whose bytes are handed out (and released) after every row group."""
+
+    def __init__(self):
+        self._parts, self._pos = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    def arrow_type(column):
+        if isinstance(column.type, DateTime):
+            return pa.timestamp("us")
+        return pa.string() if isinstance(column.type, String) else pa.float64()
+    return pa.schema([(c.name, arrow_type(c)) for c in _flat_columns()])
+
+
+def _parquet(chunks) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = parquet_schema()
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for rows in chunks:
+            columns = list(zip(*rows)) if rows else [()] * len(EXPORT_COLUMNS)
+            writer.write_table(pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(columns, schema)],
+                                                    schema=schema))  # one row group per chunk
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def stream_reports(engine, fmt: str, **filters) -> Iterator[bytes]:
+    """Encoded export of the reports matching `filters` (start, end, mineral, mode)."""
+    if fmt == "ndjson":
+        json_query = build_json_query(engine.dialect.name, **filters)
+        if json_query is not None:
+            return ("".join([row[0] + "\n" for row in rows]).encode() for rows in _chunks(engine, json_query))
+    chunks = _chunks(engine, build_query(**filters))
+    return {"ndjson": _ndjson, "csv": _csv, "parquet": _parquet}[fmt](chunks)
@@ -0,0 +1,38 @@
+"""
+Image decoding helpers for Cerberus DeepCrystal
+Kept free of torch/transformers imports so decode worker processes (see
+services/batch_analyzer.py) start quickly and stay small.
+Author: Sudeepa Wanigarathna
+"""
+
+import hashlib
+import io
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+
+def decode_image(image_bytes: bytes, decode_size: Optional[int] = None) -> Image.Image:
+    """
+    Decodes an upload to RGB. With decode_size, JPEGs are decoded at a reduced
+    DCT scale whose short side is still >= decode_size (much cheaper for large
+    photos; the processor resizes to 224 px anyway).
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    if decode_size:
+        image.draft("RGB", (decode_size, decode_size))
+    return image.convert("RGB")
+
+
+def load_image_file(path: str, decode_size: Optional[int] = None) -> tuple:
+    """
+    Reads and decodes one image file for batch analysis.
+    Returns (path, md5 of the file bytes, RGB uint8 array or None, error or None).
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        return path, hashlib.md5(data).hexdigest(), np.asarray(decode_image(data, decode_size)), None
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
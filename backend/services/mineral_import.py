@@ -0,0 +1,368 @@
+"""
+Bulk mineral reference importer for Cerberus DeepCrystal
+Loads external mineral references (thousands of species, any of the minerals
+columns) into the minerals table:
+
+    python -m services.mineral_import minerals.csv [more.jsonl ...] [--on-conflict skip] [--dry-run]
+
+Sources are read as a stream, one record at a time: CSV or TSV (a header
+row of column names), NDJSON/JSONL (one object per line) or JSON (an array of
+objects, or {"minerals": [...]}, decoded incrementally). Records are
+collected in batches of IMPORT_BATCH and validated per batch against the
+MineralDB schema; invalid records are skipped and reported with their
+position. Each batch is written with one set-based statement (INSERT ...
+ON CONFLICT (name) DO UPDATE, or DO NOTHING with --on-conflict skip; a
+select plus executemany insert/update on other databases), and the whole
+import is committed every IMPORT_COMMIT_ROWS rows. Planner statistics are
+refreshed once at the end (ANALYZE), not per row. data/seed_database.py
+seeds the built-in gems through the same path.
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import Iterable, Iterator, List, Optional
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import bindparam, select, text, Float
+
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "5000"))
+IMPORT_COMMIT_ROWS = int(os.getenv("IMPORT_COMMIT_ROWS", "100000"))
+MAX_REPORTED_ERRORS = 50
+JSON_READ_CHUNK = 1 << 16
+
+
+class MineralImportError(ValueError):
+    pass
+
+
+class MalformedRecord:
+    """A record the reader could not decode (e.g. a bad NDJSON line); reported as invalid, not fatal."""
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+def _columns():
+    """Importable minerals columns (everything but the surrogate key and timestamps) and the float ones."""
+    from database import Mineral
+    columns = [c for c in Mineral.__table__.columns if c.name not in ("id", "created_at")]
+    return [c.name for c in columns], {c.name for c in columns if isinstance(c.type, Float)}
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".csv", ".tsv"):
+        return ext[1:]
+    if ext in (".jsonl", ".ndjson"):
+        return "ndjson"
+    if ext == ".json":
+        return "json"
+    raise MineralImportError(f"Cannot tell the format of {path}; use --format csv|tsv|ndjson|json")
+
+
+def _iter_json_array(f) -> Iterator[dict]:
+    """Objects of a JSON array (or of the "minerals" array of an object), decoded one at a time."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(JSON_READ_CHUNK)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    fill()
+    skip_ws()
+    if buf[pos:pos + 1] == "{":
+        # {"minerals": [...]}: find the array after the key
+        while True:
+            key = buf.find('"minerals"', pos)
+            start = buf.find("[", key) if key >= 0 else -1
+            chunk = f.read(JSON_READ_CHUNK) if start < 0 else ""
+            if not chunk:
+                break
+            buf += chunk
+        if start < 0:
+            raise MineralImportError('JSON object sources must hold a "minerals" array')
+        pos = start
+    if buf[pos:pos + 1] != "[":
+        raise MineralImportError("JSON sources must be an array of mineral objects")
+    pos += 1
+    while True:
+        skip_ws()
+        if buf[pos:pos + 1] == "]":
+            return
+        if buf[pos:pos + 1] == ",":
+            pos += 1
+            skip_ws()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+                break
+            except json.JSONDecodeError:
+                if eof:
+                    raise MineralImportError("Truncated or malformed JSON")
+                fill()
+        pos = end
+        yield obj
+        if pos > JSON_READ_CHUNK:
+            buf, pos = buf[pos:], 0
+
+
+def iter_records(source, fmt: str) -> Iterator[dict]:
+    """Records of a text stream in the given format (csv, tsv, ndjson or json)."""
+    if fmt in ("csv", "tsv"):
+        yield from csv.DictReader(source, delimiter="," if fmt == "csv" else "\t")
+    elif fmt == "ndjson":
+        for line in source:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield MalformedRecord(f"malformed JSON: {e}")
+    elif fmt == "json":
+        yield from _iter_json_array(source)
+    else:
+        raise MineralImportError(f"Unknown format '{fmt}'")
+
+
+class MineralImporter:
+    """Validates and upserts mineral records in batches; one instance per import."""
+
+    def __init__(self, engine, on_conflict: str = "update", batch_size: int = IMPORT_BATCH,
+                 commit_rows: int = IMPORT_COMMIT_ROWS, dry_run: bool = False):
+        from database import Mineral
+        from models.schemas import MineralDB
+        if on_conflict not in ("update", "skip"):
+            raise MineralImportError("on_conflict must be 'update' or 'skip'")
+        self.engine = engine
+        self.table = Mineral.__table__
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size
+        self.commit_rows = commit_rows
+        self.dry_run = dry_run
+        self.columns, self.float_columns = _columns()
+        self.adapter = TypeAdapter(List[MineralDB])
+        self.stats = {"read": 0, "valid": 0, "invalid": 0, "duplicates": 0, "inserted": 0, "updated": 0,
+                      "skipped": 0, "ignored_columns": set(), "errors": []}
+
+    # ── validation ──
+    def _coerce(self, record: dict) -> dict:
+        """Empty strings become nulls and numeric text becomes floats (CSV); unknown keys are dropped."""
+        row = {}
+        for key, value in record.items():
+            if key is None:
+                continue
+            key = key.strip()
+            if key not in self.columns:
+                self.stats["ignored_columns"].add(key)
+                continue
+            if isinstance(value, str):
+                value = value.strip()
+                if value == "":
+                    value = None
+                elif key in self.float_columns:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass  # left for the validator to reject with a field-level message
+            row[key] = value
+        return row
+
+    def _error(self, position: int, message: str):
+        """Counts an invalid record (`position` is 1-based within the source)."""
+        self.stats["invalid"] += 1
+        if len(self.stats["errors"]) < MAX_REPORTED_ERRORS:
+            self.stats["errors"].append({"record": position, "error": message})
+
+    def validate(self, records: List[dict], first_position: int) -> List[dict]:
+        """Rows of the valid records of one batch (validated in a single call)."""
+        bad = {index: r.error for index, r in enumerate(records) if isinstance(r, MalformedRecord)}
+        positions = [index for index in range(len(records)) if index not in bad]
+        rows = [self._coerce(records[i]) if isinstance(records[i], dict) else records[i] for i in positions]
+        try:
+            models = self.adapter.validate_python(rows)
+        except ValidationError as e:
+            invalid = set()
+            for err in e.errors():
+                index = err["loc"][0] if err["loc"] else 0
+                field = ".".join(str(part) for part in err["loc"][1:]) or "record"
+                bad.setdefault(positions[index], f"{field}: {err['msg']}")
+                invalid.add(index)
+            rows = [row for i, row in enumerate(rows) if i not in invalid]
+            positions = [position for i, position in enumerate(positions) if i not in invalid]
+            models = self.adapter.validate_python(rows) if rows else []
+        for index in sorted(bad):
+            self._error(first_position + index + 1, bad[index])
+        out = []
+        for index, model in zip(positions, models):
+            row = model.model_dump(exclude_unset=True)
+            row["name"] = row["name"].strip()
+            if not row["name"]:
+                self._error(first_position + index + 1, "name: must not be empty")
+                continue
+            out.append(row)
+        return out
+
+    # ── writing ──
+    def _existing(self, conn, names: List[str]) -> set:
+        name = self.table.c.name
+        return {n for (n,) in conn.execute(select(name).where(name.in_(names)))}
+
+    def write(self, conn, rows: List[dict]):
+        """Upserts one batch of validated rows (unique names) with set-based statements."""
+        existing = self._existing(conn, [r["name"] for r in rows])
+        fresh = len(rows) - len(existing)
+        if self.on_conflict == "skip":
+            self.stats["inserted"] += fresh
+            self.stats["skipped"] += len(existing)
+        else:
+            self.stats["inserted"] += fresh
+            self.stats["updated"] += len(existing)
+        if self.dry_run:
+            return
+        # executemany needs the same keys in every row; a column a record leaves out keeps its current value
+        by_keys = {}
+        for row in rows:
+            by_keys.setdefault(tuple(sorted(row)), []).append(row)
+        t = self.table
+        dialect = conn.dialect.name
+        for keys, group in by_keys.items():
+            if dialect in ("sqlite", "postgresql"):
+                if dialect == "sqlite":
+                    from sqlalchemy.dialects.sqlite import insert
+                else:
+                    from sqlalchemy.dialects.postgresql import insert
+                stmt = insert(t)
+                if self.on_conflict == "skip":
+                    stmt = stmt.on_conflict_do_nothing(index_elements=["name"])
+                else:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["name"], set_={k: stmt.excluded[k] for k in keys if k != "name"})
+                conn.execute(stmt, group)
+                continue
+            # Other databases: one insert and one update executemany per batch
+            new = [r for r in group if r["name"] not in existing]
+            if new:
+                conn.execute(t.insert(), new)
+            # bind names must differ from the column names (SQLAlchemy reserves those for SET/VALUES)
+            old = [{"_name": r["name"], **{f"b_{k}": v for k, v in r.items() if k != "name"}}
+                   for r in group if r["name"] in existing]
+            if old and self.on_conflict == "update":
+                conn.execute(t.update().where(t.c.name == bindparam("_name"))
+                             .values({k: bindparam(f"b_{k}") for k in keys if k != "name"}), old)
+
+    def run(self, records: Iterable[dict]) -> dict:
+        """Imports a stream of records; returns counts, timing and the first errors."""
+        started = time.perf_counter()
+        conn = self.engine.connect()
+        txn = conn.begin()
+        uncommitted = 0
+        position = 0
+        try:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) == self.batch_size:
+                    uncommitted += self._flush(conn, batch, position)
+                    position += len(batch)
+                    batch = []
+                    if uncommitted >= self.commit_rows:
+                        txn.commit()
+                        txn = conn.begin()
+                        uncommitted = 0
+            if batch:
+                self._flush(conn, batch, position)
+                position += len(batch)
+            txn.commit()
+        except BaseException:
+            txn.rollback()
+            raise
+        finally:
+            conn.close()
+        if not self.dry_run and self.stats["inserted"] + self.stats["updated"]:
+            analyze_minerals(self.engine)
+        seconds = time.perf_counter() - started
+        stats = dict(self.stats, read=position, ignored_columns=sorted(self.stats["ignored_columns"]))
+        stats.update(seconds=round(seconds, 3), records_per_s=round(position / seconds) if seconds else None,
+                     dry_run=self.dry_run)
+        return stats
+
+    def _flush(self, conn, batch: List[dict], position: int) -> int:
+        rows = self.validate(batch, position)
+        self.stats["valid"] += len(rows)
+        unique = {}
+        for row in rows:  # the same species twice in a batch: the later record wins
+            unique[row["name"]] = row
+        self.stats["duplicates"] += len(rows) - len(unique)
+        if unique:
+            self.write(conn, list(unique.values()))
+        return len(unique)
+
+
+def analyze_minerals(engine):
+    """Refreshes the query planner's statistics for the minerals table and its name index."""
+    if engine.dialect.name in ("sqlite", "postgresql"):
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE minerals"))
+
+
+def import_file(engine, path: str, fmt: Optional[str] = None, **options) -> dict:
+    """Imports one CSV/NDJSON/JSON file (streamed). `options` go to MineralImporter."""
+    fmt = fmt or detect_format(path)
+    with open(path, encoding="utf-8-sig", newline="" if fmt in ("csv", "tsv") else None) as f:
+        stats = MineralImporter(engine, **options).run(iter_records(f, fmt))
+    stats["source"] = path
+    return stats
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m services.mineral_import", description=__doc__.split("\n")[1])
+    p.add_argument("paths", nargs="+", help="CSV/TSV, NDJSON/JSONL or JSON files")
+    p.add_argument("--format", choices=["csv", "tsv", "ndjson", "json"], help="Default: from the file extension")
+    p.add_argument("--on-conflict", choices=["update", "skip"], default="update",
+                   help="Existing species (by name): overwrite the given columns, or keep the row as it is")
+    p.add_argument("--batch-size", type=int, default=IMPORT_BATCH)
+    p.add_argument("--dry-run", action="store_true", help="Validate and count only")
+    args = p.parse_args(argv)
+
+    from database import engine, init_db
+    init_db()
+    failed = False
+    for path in args.paths:
+        try:
+            stats = import_file(engine, path, args.format, on_conflict=args.on_conflict,
+                                batch_size=args.batch_size, dry_run=args.dry_run)
+        except (OSError, MineralImportError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"{path}: import failed: {e}")
+            failed = True
+            continue
+        print(f"{path}: {stats['read']:,} records in {stats['seconds']} s ({stats['records_per_s'] or 0:,}/s): "
+              f"{stats['inserted']:,} new, {stats['updated']:,} updated, {stats['skipped']:,} kept, "
+              f"{stats['invalid']:,} invalid, {stats['duplicates']:,} duplicates" + (" [dry run]" if args.dry_run else ""))
+        if stats["ignored_columns"]:
+            print(f"  ignored columns: {', '.join(stats['ignored_columns'])}")
+        for err in stats["errors"][:10]:
+            print(f"  record {err['record']}: {err['error']}")
+        failed = failed or stats["invalid"] > 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
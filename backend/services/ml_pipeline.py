@@ -4,13 +4,22 @@ Simulates CNN (ResNet/EfficientNet), Vision Transformer, YOLO, GAN, and ensemble
 Author: Sudeepa Wanigarathna
 """
 
+import os
 import random
 import hashlib
 import uuid
 from PIL import Image
 import numpy as np
 import io
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from services.catalogue import get_catalogue
+from services.imaging import decode_image
+from services.pipeline import Job, Pipeline, Stage, StageCache
+from services.profiles import get_profile, result_cache
+from services.spectral_library import spectral_library
+from services.valuation import quote
 
 
 # ─────────────── Gem Knowledge Base ───────────────
@@ -770,34 +779,144 @@ TREATMENT_INDICATORS = {
 import torch
 from transformers import CLIPProcessor, CLIPModel
 
+# Model backend: "clip" (HuggingFace weights) or "stub" (offline, deterministic)
+MODEL_BACKEND = os.getenv("DEEPCRYSTAL_MODEL", "clip").lower()
+
 # Global model cache to avoid reloading on every request
 _clip_model = None
 _clip_processor = None
-_clip_labels = []
+
+
+def load_model():
+    """Singleton-style loader for the vision/text model. Returns (model, processor)."""
+    global _clip_model, _clip_processor
+    if _clip_model is None:
+        if MODEL_BACKEND == "stub":
+            from services.stub_model import StubCLIPModel, StubCLIPProcessor
+            print("Loading offline stub vision model (DEEPCRYSTAL_MODEL=stub)...")
+            _clip_model = StubCLIPModel()
+            _clip_processor = StubCLIPProcessor()
+        else:
+            print("Loading HuggingFace CLIP Vision Transformer (openai/clip-vit-base-patch32)...")
+            _clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+            _clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    return _clip_model, _clip_processor
+
 
 def get_clip_model():
     """
     Singleton-style loader for CLIP to avoid re-loading on every request.
-    Returns (model, processor, labels_flattened, num_prompts_per_gem).
+    Returns (model, processor, labels_flattened, num_prompts_per_gem) for the
+    live gem catalogue (services.catalogue builds the multi-prompt ensemble).
     """
-    global _clip_model, _clip_processor, _clip_labels
-    
-    num_prompts = 3 # Ensemble size
-    if _clip_model is None:
-        print("Loading HuggingFace CLIP Vision Transformer (openai/clip-vit-base-patch32)...")
-        _clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        _clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        
-        # Build advanced multi-prompt ensemble to improve robustness
-        _clip_labels = []
-        for gem in GEM_DATA.keys():
-            _clip_labels.extend([
-                f"A high-quality gemological macro photo of a {gem} gemstone showing its color and luster",
-                f"A close-up studio photograph of a polished {gem} gemstone",
-                f"A {gem} variety gemstone in a professional laboratory setting"
-            ])
-            
-    return _clip_model, _clip_processor, _clip_labels, num_prompts
+    model, processor = load_model()
+    catalogue = get_catalogue()
+    return model, processor, catalogue.labels, catalogue.n_prompts
+
+
+def _features(output) -> torch.Tensor:
+    # transformers < 5 returns the projected features directly, >= 5 wraps them in pooler_output
+    return output if isinstance(output, torch.Tensor) else output.pooler_output
+
+
+def encode_texts(texts: List[str]) -> torch.Tensor:
+    """Runs prompt labels through the text encoder. Returns L2-normalised [N, D] embeddings."""
+    model, processor = load_model()
+    inputs = processor(text=texts, return_tensors="pt", padding=True)
+    with torch.no_grad():
+        feats = _features(model.get_text_features(**inputs))
+    return feats / feats.norm(dim=-1, keepdim=True)
+
+
+def get_text_bank() -> torch.Tensor:
+    """
+    Normalised embeddings of every prompt label in the live catalogue, encoded
+    once and updated incrementally on catalogue reloads, so a scan only runs
+    the vision tower. Returns a [num_gems * num_prompts, D] tensor.
+    """
+    return get_catalogue().text_bank
+
+
+def encode_images(images: List[Image.Image]) -> torch.Tensor:
+    """Runs a batch of decoded images through the vision encoder. Returns L2-normalised [N, D] embeddings."""
+    model, processor = load_model()
+    inputs = processor(images=images, return_tensors="pt")
+    with torch.no_grad():
+        feats = _features(model.get_image_features(**inputs))
+    return feats / feats.norm(dim=-1, keepdim=True)
+
+
+MAX_VIEWS = 8  # photos of one stone per scan (table-up, pavilion, lighting variants...)
+
+# PIL releases the GIL while decoding, so views decode concurrently
+_decode_pool = ThreadPoolExecutor(max_workers=min(MAX_VIEWS, os.cpu_count() or 1), thread_name_prefix="decode")
+
+
+def decode_views(views: List[bytes], decode_size: Optional[int] = None) -> List[Image.Image]:
+    if len(views) == 1:
+        return [decode_image(views[0], decode_size)]
+    return list(_decode_pool.map(lambda v: decode_image(v, decode_size), views))
+
+
+# ─────────────── Test-time augmentation ───────────────
+TTA_STRATEGIES = ("mean_logits", "mean_probs", "max_probs", "vote")
+
+
+def tta_augmentations(image: Image.Image) -> List[np.ndarray]:
+    """
+    Crops, flips and scales of one decoded image. All views are slices of a
+    single array copy of the decoded buffer (no re-decode); only the
+    letterboxed full view allocates.
+      0 original (processor centre crop)     1 horizontal flip
+      2-5 corner crops at 80% of short side  6 centre zoom at 60%
+      7 full frame padded to square, so the stone's edges are not cropped away
+    """
+    arr = np.asarray(image)
+    h, w = arr.shape[:2]
+    side = min(h, w)
+    c = max(1, int(side * 0.8))
+    z = max(1, int(side * 0.6))
+    zy, zx = (h - z) // 2, (w - z) // 2
+    augs = [
+        arr,
+        arr[:, ::-1],
+        arr[:c, :c], arr[:c, w - c:], arr[h - c:, :c], arr[h - c:, w - c:],
+        arr[zy:zy + z, zx:zx + z],
+    ]
+    if h != w:
+        full = max(h, w)
+        pad_y, pad_x = (full - h) // 2, (full - w) // 2
+        fill = np.median(np.concatenate([arr[0], arr[-1], arr[:, 0], arr[:, -1]]), axis=0).astype(arr.dtype)
+        square = np.empty((full, full, 3), dtype=arr.dtype)
+        square[:] = fill
+        square[pad_y:pad_y + h, pad_x:pad_x + w] = arr
+        augs.append(square)
+    return [np.ascontiguousarray(a) for a in augs]
+
+
+def aggregate_tta(logits: torch.Tensor, strategy: str = "mean_logits"):
+    """
+    Aggregates [A, num_gems] augmentation logits into one logit vector.
+    Probability-space strategies return log-probabilities so views can still be
+    fused by averaging. Also returns the fraction of augmentations whose top-1
+    matches the aggregate (agreement).
+    """
+    if strategy == "mean_logits":
+        fused = logits.mean(dim=0)
+    else:
+        probs = logits.softmax(dim=1)
+        if strategy == "mean_probs":
+            fused_probs = probs.mean(dim=0)
+        elif strategy == "max_probs":
+            fused_probs = probs.max(dim=0).values
+        elif strategy == "vote":
+            votes = torch.bincount(probs.argmax(dim=1), minlength=probs.shape[1]).to(probs.dtype)
+            fused_probs = votes + probs.mean(dim=0)  # mean probability breaks ties
+        else:
+            raise ValueError(f"Unknown TTA strategy '{strategy}'. Choose from: {list(TTA_STRATEGIES)}")
+        fused = torch.log(fused_probs / fused_probs.sum() + 1e-12)
+    agreement = float((logits.argmax(dim=1) == fused.argmax()).float().mean())
+    return fused, agreement
 
 
 def analyze_image_mock(image_bytes: bytes, manual_inputs: dict = None) -> dict:
@@ -805,42 +924,216 @@ def analyze_image_mock(image_bytes: bytes, manual_inputs: dict = None) -> dict:
     Uses OpenAI CLIP Vision Transformer for Real Zero-Shot Image Classification
     with a multi-prompt ensemble for improved accuracy.
     """
-    # Load Real Vision AI with ensemble configuration
-    model, processor, labels, n_prompts = get_clip_model()
-    
-    # Process image
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    inputs = processor(text=labels, images=image, return_tensors="pt", padding=True)
-    
-    # Run Inference
+    return analyze_views([image_bytes], manual_inputs)
+
+
+def analyze_views(views: List[bytes], manual_inputs: dict = None, profile: dict = None,
+                  spectra: Optional[dict] = None, on_identified: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Analyses several photos of the same stone as one report. All views go
+    through the vision encoder as a single batch; per-gem logits are averaged
+    across views (a product of the per-view distributions) before the softmax.
+    `profile` (services.profiles) sets the compute spent; default is the pro path.
+    `spectra` ({kind: (vector, peaks)}, see services.spectral_library) are
+    matched against the reference library and weigh into the gem ranking.
+    `on_identified` is called (in this thread) with the identification part
+    of the report as soon as the stone is classified (see analyze_requests).
+    """
+    profile = profile or get_profile(None)
+    if not profile["cache_results"]:
+        return _analyze(views, manual_inputs, profile, spectra, on_identified)
+    key = result_cache.key(views, manual_inputs, profile, spectra)
+    cached = result_cache.get(key)
+    if cached is not None:
+        if on_identified is not None:
+            on_identified(cached)
+        return {**cached, "cached": True}
+    result = _analyze(views, manual_inputs, profile, spectra, on_identified)
+    result_cache.put(key, result)
+    return result
+
+
+def views_digest(views: List[bytes]) -> str:
+    """md5 over all views of a scan; seeds the per-scan simulation models."""
+    digest = hashlib.md5()
+    for view in views:
+        digest.update(view)
+    return digest.hexdigest()
+
+
+def _analyze(views: List[bytes], manual_inputs: dict, profile: dict, spectra: Optional[dict] = None,
+             on_identified: Optional[Callable[[dict], None]] = None) -> dict:
+    callback = None if on_identified is None else (lambda index, identification: on_identified(identification))
+    return analyze_requests([(views, manual_inputs, spectra)], profile, on_identified=callback)[0]
+
+
+def analyze_requests(requests: List[tuple], profile: dict, batch_size: Optional[int] = None,
+                     on_identified: Optional[Callable[[int, dict], None]] = None) -> List[dict]:
+    """
+    Analyses scans given as (views, manual_inputs) or (views, manual_inputs,
+    spectra), running SCAN_PIPELINE stage by stage over batches of batch_size
+    scans (default: all of them at once). Each report carries its stage
+    timings as "stage_ms" (recorded by scan captures, services/replay.py).
+    on_identified(request index, identification) is called for each scan
+    right after IDENTIFICATION_STAGE, before the treatment, valuation and
+    report stages run; identification holds the report keys known by then.
+    """
+    jobs = [Job({"views": r[0], "manual_inputs": r[1], "spectra": r[2] if len(r) > 2 else None}) for r in requests]
+    on_stage = None
+    if on_identified is not None:
+        index = {id(job): i for i, job in enumerate(jobs)}
+
+        def on_stage(stage: str, batch: List[Job]):
+            if stage == IDENTIFICATION_STAGE:
+                for job in batch:
+                    on_identified(index[id(job)], _identification(job.data))
+    SCAN_PIPELINE.run(jobs, {"profile": profile, "catalogue": get_catalogue()}, batch_size, on_stage)
+    return [{**job.data["report"], "stage_ms": dict(job.timings_ms)} for job in jobs]
+
+
+def analyze_decoded(scans: List[tuple], profile: dict) -> List[dict]:
+    """
+    Analyses already-decoded scans, each (images, views_digest, manual_inputs).
+    Every image (and augmentation) of every scan goes through the vision
+    encoder as one batch; used by the offline batch analyzer.
+    """
+    # The catalogue snapshot is held for the whole batch
+    jobs = [Job({"images": images, "digest": digest, "manual_inputs": manual_inputs, "spectra": None})
+            for images, digest, manual_inputs in scans]
+    SCAN_PIPELINE.run(jobs, {"profile": profile, "catalogue": get_catalogue()})
+    return [job.data["report"] for job in jobs]
+
+
+# ─────────────── Scan pipeline stages ───────────────
+# Stage order is part of the output: the simulation models draw from one
+# per-scan random stream (seeded by the views digest), stage after stage.
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "128"))
+
+
+def _digest(views: List[bytes]) -> dict:
+    return {"digest": views_digest(views)}
+
+
+def _decode(views: List[bytes], profile: dict) -> dict:
+    return {"images": decode_views(views, profile["decode_size"])}
+
+
+def _embed(images: List[list], profile: dict) -> List[dict]:
+    """Every image (and augmentation) of every scan of the batch goes through the vision encoder at once."""
+    batch, bounds, scan_spans = [], [], []
+    for scan_images in images:
+        first = len(batch)
+        spans = []
+        for img in scan_images:
+            # With TTA every augmentation of every view goes into the same batch
+            augs = tta_augmentations(img) if profile["tta"] else [img]
+            spans.append((len(batch) - first, len(batch) - first + len(augs)))
+            batch.extend(augs)
+        bounds.append((first, len(batch)))
+        scan_spans.append(spans)
+    batch_embeds = encode_images(batch) # Shape: [B, D]
+    return [{"embeds": batch_embeds[a:b].clone(), "spans": spans} for (a, b), spans in zip(bounds, scan_spans)]
+
+
+def _embed_cache_key(data: dict, shared: dict) -> Optional[tuple]:
+    # Only uploads decoded by the pipeline itself: the batch analyzer decodes with its own settings
+    if "views" not in data or "digest" not in data:
+        return None
+    return data["digest"], shared["profile"]["decode_size"], shared["profile"]["tta"]
+
+
+def _logits(embeds: List[torch.Tensor], catalogue, profile: dict) -> List[dict]:
+    """Per-gem logits of every embedding of the batch against the cached prompt embeddings."""
+    model, _ = load_model()
+    n_prompts = catalogue.n_prompts
+    batch_embeds = torch.cat(embeds)
+
+    # Prompt ensemble size for this profile
+    text_bank = catalogue.text_bank
+    if profile["prompts_per_gem"] < n_prompts:
+        text_bank = text_bank.view(-1, n_prompts, text_bank.shape[-1])[:, :profile["prompts_per_gem"]].reshape(-1, text_bank.shape[-1])
+        n_prompts = profile["prompts_per_gem"]
+
+    # Run Inference against the cached prompt embeddings
     with torch.no_grad():
-        outputs = model(**inputs)
-        logits_per_image = outputs.logits_per_image # Shape: [1, num_gems * n_prompts]
-        
+        logits_per_image = model.logit_scale.exp() * batch_embeds @ text_bank.t() # Shape: [B, num_gems * n_prompts]
+
         # Ensemble Averaging: Reshape and average logits for the same gem across different prompts
-        logits = logits_per_image.view(1, -1, n_prompts) # [1, num_gems, n_prompts]
-        avg_logits = logits.mean(dim=2) # [1, num_gems]
+        logits = logits_per_image.view(len(batch_embeds), -1, n_prompts) # [B, num_gems, n_prompts]
+        batch_logits = logits.mean(dim=2) # [B, num_gems]
+    out, first = [], 0
+    for scan_embeds in embeds:
+        out.append({"logits": batch_logits[first:first + len(scan_embeds)]})
+        first += len(scan_embeds)
+    return out
+
+
+def _spectra(spectra: Optional[dict], catalogue) -> dict:
+    """Matches the scan's spectra against the reference library (vectorized over every reference)."""
+    return {"spectral": spectral_library.match(spectra, catalogue) if spectra else None}
+
+
+def _fuse(embeds: torch.Tensor, logits: torch.Tensor, spans: List[tuple], spectral: Optional[dict], catalogue,
+          profile: dict) -> dict:
+    """
+    Test-time augmentation and multi-view fusion into one distribution over
+    the catalogue's gems; spectral library matches add their per-gem logits.
+    """
+    image_embeds = embeds[[start for start, _ in spans]] # un-augmented view embeddings, [k, D]
+    with torch.no_grad():
+        tta_report = None
+        if profile["tta"]:
+            aggregated = [aggregate_tta(logits[a:b], profile["tta_strategy"]) for a, b in spans]
+            view_logits = torch.stack([fused for fused, _ in aggregated]) # [k, num_gems]
+            tta_report = {
+                "augmentations": spans[0][1] - spans[0][0],
+                "strategy": profile["tta_strategy"],
+                "agreement": round(sum(agreement for _, agreement in aggregated) / len(aggregated), 4),
+            }
+        else:
+            view_logits = logits[spans[0][0]:spans[-1][1]] # [k, num_gems]
+        view_probs = view_logits.softmax(dim=1).numpy()
+        # Multi-view fusion
+        avg_logits = view_logits.mean(dim=0, keepdim=True) # [1, num_gems]
+        if spectral and spectral["logits"] is not None:
+            avg_logits = avg_logits + torch.from_numpy(spectral["logits"])[None]
         probs = avg_logits.softmax(dim=1).numpy()[0]
-    
+
     # Get top prediction from the ensemble
+    gem_names = catalogue.gem_names
     top_idx = np.argmax(probs)
-    primary_gem = list(GEM_DATA.keys())[top_idx]
-    gem = GEM_DATA[primary_gem]
-    
+    primary_gem = gem_names[top_idx]
+
+    view_confidences = [
+        {
+            "view": i,
+            "top_gem": gem_names[int(np.argmax(p))],
+            "top_probability": round(float(p.max()), 4),
+            "fused_gem_probability": round(float(p[top_idx]), 4),
+        }
+        for i, p in enumerate(view_probs)
+    ]
+    fused_embedding = image_embeds.mean(dim=0)
+    fused_embedding = fused_embedding / fused_embedding.norm()
+    return {
+        "gem_key": primary_gem,
+        "gem": catalogue.gem_data[primary_gem],
+        "raw_confidence": float(probs[top_idx]),
+        "view_confidences": view_confidences,
+        "embedding": fused_embedding.numpy(),
+        "tta": tta_report,
+    }
+
+
+def _confidence(gem: dict, raw_confidence: float, manual_inputs: Optional[dict]) -> dict:
     # Refined confidence scaling for large class space (>100 classes)
-    raw_confidence = float(probs[top_idx])
     # Calibrate so that a clear winner in a large field feels authoritative
     base_confidence = min(0.99, max(0.70, 0.40 + (raw_confidence ** 0.4) * 0.6))
 
-    img_hash = hashlib.md5(image_bytes).hexdigest()
-    seed_val = int(img_hash[:8], 16)
-    rng = random.Random(seed_val)
-
-
     # Apply manual input boosts
     if manual_inputs:
         ri = manual_inputs.get("refractive_index")
-        if ri:
+        if ri and gem["ri"][0] is not None:
             gem_ri_min, gem_ri_max = gem["ri"]
             if gem_ri_min <= ri <= gem_ri_max:
                 base_confidence = min(0.99, base_confidence + 0.08)
@@ -854,8 +1147,12 @@ def analyze_image_mock(image_bytes: bytes, manual_inputs: dict = None) -> dict:
             hw_min, hw_max = gem["mohs"]
             if hw_min * 0.9 <= hw <= hw_max * 1.1:
                 base_confidence = min(0.99, base_confidence + 0.04)
+    return {"base_confidence": base_confidence}
+
 
-    # Treatment probabilities (YOLO + GAN anomaly detection simulation)
+def _treatment(digest: str) -> dict:
+    """Treatment probabilities (YOLO + GAN anomaly detection simulation); starts the per-scan random stream."""
+    rng = random.Random(int(digest[:8], 16))
     natural_prob = rng.uniform(0.55, 0.90)
     heat_treated = rng.uniform(0.05, 0.30)
     glass_filled = rng.uniform(0.01, 0.10)
@@ -882,17 +1179,33 @@ def analyze_image_mock(image_bytes: bytes, manual_inputs: dict = None) -> dict:
         "Coated": coated,
         "Synthetic": synthetic_prob
     }
-    dominant_treatment = max(treatment_map, key=treatment_map.get)
+    return {
+        "rng": rng,
+        "treatment": {
+            "natural": natural_prob,
+            "heat_treated": heat_treated,
+            "diffusion_treated": diffusion,
+            "glass_filled": glass_filled,
+            "resin_filled": resin_filled,
+            "laser_drilled": laser_drilled,
+            "coated": coated,
+            "synthetic": synthetic_prob,
+        },
+        "dominant_treatment": max(treatment_map, key=treatment_map.get),
+    }
+
 
-    # Inclusion analysis (YOLO object detection simulation)
+def _inclusions(rng: random.Random, gem_key: str, treatment: dict) -> dict:
+    """Inclusion analysis (YOLO object detection simulation)."""
+    synthetic_prob, glass_filled = treatment["synthetic"], treatment["glass_filled"]
     inclusion_data = {
         "curved_growth_lines": round(rng.uniform(0.0, 0.7) if synthetic_prob > 0.3 else rng.uniform(0.0, 0.1), 3),
         "gas_bubbles": round(rng.uniform(0.4, 0.9) if glass_filled > 0.15 else rng.uniform(0.0, 0.1), 3),
-        "rutile_silk": round(rng.uniform(0.3, 0.85) if primary_gem in ["Ruby", "Sapphire"] else rng.uniform(0.0, 0.15), 3),
-        "fracture_filling": round(rng.uniform(0.4, 0.8) if glass_filled > 0.1 or resin_filled > 0.1 else rng.uniform(0.0, 0.1), 3),
+        "rutile_silk": round(rng.uniform(0.3, 0.85) if gem_key in ["Ruby", "Sapphire"] else rng.uniform(0.0, 0.15), 3),
+        "fracture_filling": round(rng.uniform(0.4, 0.8) if glass_filled > 0.1 or treatment["resin_filled"] > 0.1 else rng.uniform(0.0, 0.1), 3),
         "flame_fusion_indicators": round(rng.uniform(0.5, 0.9) if synthetic_prob > 0.5 else rng.uniform(0.0, 0.05), 3),
-        "heat_treatment_markers": round(rng.uniform(0.4, 0.8) if heat_treated > 0.2 else rng.uniform(0.0, 0.15), 3),
-        "fingerprint_inclusions": round(rng.uniform(0.2, 0.6) if natural_prob > 0.6 else rng.uniform(0.0, 0.2), 3),
+        "heat_treatment_markers": round(rng.uniform(0.4, 0.8) if treatment["heat_treated"] > 0.2 else rng.uniform(0.0, 0.15), 3),
+        "fingerprint_inclusions": round(rng.uniform(0.2, 0.6) if treatment["natural"] > 0.6 else rng.uniform(0.0, 0.2), 3),
         "needles": round(rng.uniform(0.1, 0.5), 3),
         "crystals": round(rng.uniform(0.0, 0.3), 3),
         "feathers": round(rng.uniform(0.0, 0.25), 3),
@@ -901,8 +1214,11 @@ def analyze_image_mock(image_bytes: bytes, manual_inputs: dict = None) -> dict:
     # Inclusion summary
     key_inclusions = [k.replace("_", " ").title() for k, v in inclusion_data.items() if v > 0.3]
     inclusion_summary = f"Notable inclusions detected: {', '.join(key_inclusions) if key_inclusions else 'None above threshold'}."
+    return {"inclusion_data": {**inclusion_data, "summary": inclusion_summary}}
 
-    # Crack and Damage Assessment
+
+def _damage(rng: random.Random) -> dict:
+    """Crack and damage assessment."""
     crack_data = {
         "surface_cracks": round(rng.uniform(0.0, 0.3), 3),
         "internal_fractures": round(rng.uniform(0.0, 0.2), 3),
@@ -921,97 +1237,148 @@ def analyze_image_mock(image_bytes: bytes, manual_inputs: dict = None) -> dict:
 
     damage_desc_parts = [k.replace("_", " ").title() for k, v in crack_data.items() if v > 0.1]
     damage_desc = f"Damage observed: {', '.join(damage_desc_parts)}." if damage_desc_parts else "No significant surface damage detected."
+    return {"crack_data": {**crack_data, "overall_clarity_grade": clarity_grade, "damage_description": damage_desc}}
+
 
-    # Price Estimation (Regression model simulation)
+def _price(rng: random.Random, gem: dict, treatment: dict, dominant_treatment: str, manual_inputs: Optional[dict]) -> dict:
+    """Price estimation (shared with parcel valuation)."""
     carat = manual_inputs.get("carat_weight", 1.0) if manual_inputs else 1.0
     if carat is None:
         carat = 1.0
-    base_min = gem["price_min"]
-    base_max = gem["price_max"]
-
-    # Treatment adjustment
-    treatment_factor = 1.0
-    if dominant_treatment == "Heat Treated":
-        treatment_factor = 0.80
-    elif dominant_treatment in ["Glass Filled", "Fracture Filling", "Resin Filled", "Laser Drilled"]:
-        treatment_factor = 0.40
-    elif dominant_treatment == "Beryllium Diffusion":
-        treatment_factor = 0.70
-    elif dominant_treatment == "Synthetic":
-        treatment_factor = 0.05
-    elif dominant_treatment == "Coated":
-        treatment_factor = 0.60
-
-    # Carat weight multiplier (larger = disproportionately more expensive)
-    carat_factor = carat ** 1.5
-    price_min = round(base_min * treatment_factor * carat_factor * natural_prob, 2)
-    price_max = round(base_max * treatment_factor * carat_factor * natural_prob * rng.uniform(0.7, 1.3), 2)
-
-    # LKR conversion (approx)
-    lkr_rate = 308
-    price_min_lkr = round(price_min * lkr_rate, 2)
-    price_max_lkr = round(price_max * lkr_rate, 2)
-
-    price_factors = [
-        f"Carat weight: {carat:.2f} ct",
-        f"Treatment factor: {treatment_factor:.0%}",
-        f"Natural probability: {natural_prob:.0%}",
-        f"Dominant treatment: {dominant_treatment}"
-    ]
+    return {"price": quote(gem, carat, dominant_treatment, treatment["natural"], spread=rng.uniform(0.7, 1.3))}
 
-    # Origin Prediction (geographic origin model simulation)
-    origins_raw = gem["origins"]
+
+def _origins(rng: random.Random, gem: dict) -> dict:
+    """Origin prediction (geographic origin model simulation)."""
     origin_predictions = []
-    for country, base_prob in origins_raw:
+    for country, base_prob in gem["origins"]:
         adjusted = base_prob * rng.uniform(0.7, 1.3)
         origin_predictions.append({"country": country, "probability": adjusted})
     total_origin = sum(o["probability"] for o in origin_predictions)
     for o in origin_predictions:
         o["probability"] = round(o["probability"] / total_origin, 3)
     origin_predictions.sort(key=lambda x: x["probability"], reverse=True)
+    return {"origins": origin_predictions}
+
 
-    # Recommendations
+def _recommendations(treatment: dict, dominant_treatment: str) -> dict:
     recs = ["AI Screening Result. For high-value transactions, professional laboratory testing is recommended."]
     if dominant_treatment != "Natural (Untreated)":
         recs.append(f"Possible {dominant_treatment} detected — confirm with spectroscopic analysis (FTIR/Raman).")
-    if synthetic_prob > 0.3:
+    if treatment["synthetic"] > 0.3:
         recs.append("High synthetic probability — request grower certificate or Chelsea filter examination.")
-    if natural_prob > 0.85:
+    if treatment["natural"] > 0.85:
         recs.append("High natural probability — may qualify for premium pricing. GIA/Gübelin certification advised.")
+    return {"recommendations": recs}
 
+
+def _identification(data: dict) -> dict:
+    """The report keys known once the stone is classified (same values as in the final report)."""
+    gem = data["gem"]
     return {
-        "gem_key": primary_gem,
+        "gem_key": data["gem_key"],
+        "gem": gem,
+        "base_confidence": round(data["base_confidence"], 4),
+        "ri": gem["ri"],
+        "sg": gem["sg"],
+        "mohs": gem["mohs"],
+        "view_confidences": data["view_confidences"],
+        "tta": data["tta"],
+        "spectral_matches": data["spectral"]["matches"] if data["spectral"] else None,
+    }
+
+
+def _report(gem_key: str, gem: dict, base_confidence: float, treatment: dict, dominant_treatment: str,
+            inclusion_data: dict, crack_data: dict, price: dict, origins: list, recommendations: list,
+            embedding: np.ndarray, view_confidences: list, tta: Optional[dict], spectral: Optional[dict],
+            profile: dict) -> dict:
+    return {"report": {
+        "gem_key": gem_key,
         "gem": gem,
         "base_confidence": round(base_confidence, 4),
-        "natural_prob": round(natural_prob, 4),
-        "synthetic_prob": round(synthetic_prob, 4),
+        "natural_prob": round(treatment["natural"], 4),
+        "synthetic_prob": round(treatment["synthetic"], 4),
         "treatment_probs": {
-            "natural": round(natural_prob, 4),
-            "heat_treated": round(heat_treated, 4),
-            "diffusion_treated": round(diffusion, 4),
-            "glass_filled": round(glass_filled, 4),
-            "resin_filled": round(resin_filled, 4),
-            "laser_drilled": round(laser_drilled, 4),
-            "coated": round(coated, 4),
-            "synthetic": round(synthetic_prob, 4),
+            **{name: round(p, 4) for name, p in treatment.items()},
             "dominant_treatment": dominant_treatment,
         },
-        "inclusion_data": {**inclusion_data, "summary": inclusion_summary},
-        "crack_data": {**crack_data, "overall_clarity_grade": clarity_grade, "damage_description": damage_desc},
-        "price": {
-            "min_usd": price_min, "max_usd": price_max,
-            "min_local": price_min_lkr, "max_local": price_max_lkr,
-            "currency_local": "LKR", "per_carat": True,
-            "factors": price_factors
-        },
-        "origins": origin_predictions,
-        "recommendations": recs,
+        "inclusion_data": inclusion_data,
+        "crack_data": crack_data,
+        "price": price,
+        "origins": origins,
+        "recommendations": recommendations,
         "ri": gem["ri"],
         "sg": gem["sg"],
         "mohs": gem["mohs"],
         "uv": gem.get("uv", "Unknown"),
-    }
+        "embedding": embedding,
+        "view_confidences": view_confidences,
+        "tta": tta,
+        "spectral_matches": spectral["matches"] if spectral else None,
+        "profile": profile["name"],
+        "cached": False,
+    }}
+
+
+IDENTIFICATION_STAGE = "confidence"  # the last stage the identification depends on
+SCAN_PIPELINE = Pipeline("scan", [
+    Stage("digest", _digest, ("views",), {"digest": str}),
+    Stage("decode", _decode, ("views", "profile"), {"images": list}),
+    Stage("embed", _embed, ("images", "profile"), {"embeds": torch.Tensor, "spans": list}, batchable=True,
+          cache=StageCache(_embed_cache_key, EMBED_CACHE_SIZE)),
+    Stage("logits", _logits, ("embeds", "catalogue", "profile"), {"logits": torch.Tensor}, batchable=True),
+    Stage("spectra", _spectra, ("spectra", "catalogue"), {"spectral": dict}),
+    Stage("fuse", _fuse, ("embeds", "logits", "spans", "spectral", "catalogue", "profile"),
+          {"gem_key": str, "gem": dict, "raw_confidence": float, "view_confidences": list,
+           "embedding": np.ndarray, "tta": dict}),
+    Stage("confidence", _confidence, ("gem", "raw_confidence", "manual_inputs"), {"base_confidence": float}),
+    Stage("treatment", _treatment, ("digest",), {"rng": random.Random, "treatment": dict, "dominant_treatment": str}),
+    Stage("inclusions", _inclusions, ("rng", "gem_key", "treatment"), {"inclusion_data": dict}),
+    Stage("damage", _damage, ("rng",), {"crack_data": dict}),
+    Stage("price", _price, ("rng", "gem", "treatment", "dominant_treatment", "manual_inputs"), {"price": dict}),
+    Stage("origins", _origins, ("rng", "gem"), {"origins": list}),
+    Stage("recommendations", _recommendations, ("treatment", "dominant_treatment"), {"recommendations": list}),
+    Stage("report", _report, ("gem_key", "gem", "base_confidence", "treatment", "dominant_treatment",
+                              "inclusion_data", "crack_data", "price", "origins", "recommendations",
+                              "embedding", "view_confidences", "tta", "spectral", "profile"), {"report": dict}),
+], inputs=("views", "manual_inputs", "spectra"), shared=("profile", "catalogue"))
 
 
 def get_gem_data():
-    return GEM_DATA
+    return get_catalogue().gem_data
+
+
+def report_row(result: dict, session_id: str, blockchain_id: Optional[str], mode: str,
+               manual_inputs: Optional[dict] = None) -> dict:
+    """AnalysisReport column values for a pipeline result (HTTP scans and the batch analyzer)."""
+    gem = result["gem"]
+    return {
+        "session_id": session_id,
+        "blockchain_id": blockchain_id,
+        "mineral_name": result["gem_key"],
+        "chemical_formula": gem["formula"],
+        "crystal_system": gem["crystal_system"],
+        "mohs_hardness": f"{gem['mohs'][0]}–{gem['mohs'][1]}",
+        "specific_gravity": (manual_inputs or {}).get("specific_gravity"),
+        "natural_probability": result["natural_prob"],
+        "synthetic_probability": result["synthetic_prob"],
+        "treatment_probability": result["treatment_probs"].get("heat_treated", 0),
+        "treatment_type": result["treatment_probs"]["dominant_treatment"],
+        "inclusion_analysis": result["inclusion_data"],
+        "crack_assessment": result["crack_data"],
+        "price_min_local": result["price"]["min_local"],
+        "price_max_local": result["price"]["max_local"],
+        "price_min_usd": result["price"]["min_usd"],
+        "price_max_usd": result["price"]["max_usd"],
+        "currency_local": "LKR",
+        "origin_prediction": result["origins"],
+        "confidence_score": result["base_confidence"],
+        "mode": mode,
+    }
+
+
+if __name__ == "__main__":
+    # python -m services.ml_pipeline analyze-dir ...  (offline batch analysis, see services/batch_analyzer.py)
+    import sys
+    from services.batch_analyzer import main
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,207 @@
+"""
+Staged pipeline framework for Cerberus DeepCrystal
+A Pipeline is an ordered list of Stages. Each stage declares the values it
+reads and the values (with their types) it writes, so the pipeline is
+checked once when it is built: every input must be a pipeline input, a
+shared value or the output of an earlier stage.
+
+  batchable  the stage is called once with every job of a batch (e.g. one
+             pass of the vision encoder); otherwise once per job
+  cache      a StageCache: an LRU of the stage's outputs keyed by a function
+             of the job (None from the key function means "don't cache this
+             job"); hits skip the stage for that job
+  timing     every stage is timed; totals per stage are in Pipeline.stats()
+             and each job's share is in Job.timings_ms
+
+Pipeline.run() takes a list of jobs and runs them stage by stage in batches
+of `batch_size`, calling on_stage(stage name, batch) after each stage (e.g. to
+publish a partial result before the remaining stages run). Values shared by the whole batch (profile, catalogue
+snapshot) are passed as `shared` and are readable by every stage. A stage
+is skipped for a job that already has its outputs (e.g. images decoded by
+the caller) or whose later readers are all satisfied (e.g. decoding, when
+the encoder stage hits its cache). Stages run in declaration order for every
+job, so a stateful value handed from stage to stage (the per-scan random
+stream of the simulation models) sees the same sequence of calls as a single
+function.
+Author: Sudeepa Wanigarathna
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from services.profiles import ResultCache
+
+
+class PipelineError(TypeError):
+    pass
+
+
+class StageCache:
+    """Per-stage cache policy: an LRU of stage outputs keyed by key(job data, shared)."""
+
+    def __init__(self, key: Callable[[dict, dict], Optional[tuple]], capacity: int):
+        self.key = key
+        self.lru = ResultCache(capacity)
+
+    @property
+    def enabled(self) -> bool:
+        return self.lru.capacity > 0
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable, inputs: tuple, outputs: Dict[str, type],
+                 batchable: bool = False, cache: Optional[StageCache] = None):
+        """
+        fn(**inputs) -> dict of outputs, or for batchable stages
+        fn(**{name: [value per job]}) -> list of output dicts (one per job).
+        Shared values are passed as single values, not lists, to batchable stages.
+        """
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = dict(outputs)
+        self.batchable = batchable
+        self.cache = cache
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, items: int, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.items += items
+            self.seconds += seconds
+
+    def check(self, outputs: dict):
+        for name, kind in self.outputs.items():
+            if name not in outputs:
+                raise PipelineError(f"Stage '{self.name}' did not produce '{name}'")
+            value = outputs[name]
+            if value is not None and not isinstance(value, kind):
+                raise PipelineError(f"Stage '{self.name}' output '{name}' is {type(value).__name__}, "
+                                    f"expected {kind.__name__}")
+
+    def stats(self) -> dict:
+        out = {"batchable": self.batchable, "calls": self.calls, "items": self.items,
+               "total_ms": round(self.seconds * 1000, 2),
+               "mean_ms_per_item": round(self.seconds * 1000 / self.items, 3) if self.items else None}
+        if self.cache is not None:
+            out["cache"] = {"capacity": self.cache.lru.capacity, "hits": self.cache.lru.hits,
+                            "misses": self.cache.lru.misses}
+        return out
+
+
+class Job:
+    """One request flowing through a pipeline: its values so far and the time each stage spent on it."""
+
+    def __init__(self, data: dict):
+        self.data = dict(data)
+        self.timings_ms = {}
+        self._cache_keys = {}  # stage -> key of a cache miss, stored after the stage runs
+        self._missed = set()
+
+
+class Pipeline:
+    def __init__(self, name: str, stages: List[Stage], inputs: tuple, shared: tuple = ()):
+        self.name = name
+        self.stages = stages
+        self.inputs = tuple(inputs)
+        self.shared = tuple(shared)
+        available = set(self.inputs) | set(self.shared)
+        seen = set()
+        for stage in stages:
+            if stage.name in seen:
+                raise PipelineError(f"Duplicate stage '{stage.name}' in pipeline '{name}'")
+            seen.add(stage.name)
+            missing = [i for i in stage.inputs if i not in available]
+            if missing:
+                raise PipelineError(f"Stage '{stage.name}' of '{name}' reads {missing}, which no earlier stage produces")
+            available.update(stage.outputs)
+        # later stages that read each stage's outputs
+        self._readers = {s.name: [r for r in stages[i + 1:] if set(r.inputs) & set(s.outputs)]
+                         for i, s in enumerate(stages)}
+
+    def run(self, jobs: List[Job], shared: Optional[dict] = None, batch_size: Optional[int] = None,
+            on_stage: Optional[Callable[[str, List[Job]], None]] = None) -> List[Job]:
+        """Runs every job through every stage; jobs are processed in batches of batch_size (default: all at once)."""
+        shared = shared or {}
+        size = batch_size or len(jobs) or 1
+        for i in range(0, len(jobs), size):
+            batch = jobs[i:i + size]
+            for stage in self.stages:
+                self._run_stage(stage, batch, shared)
+                if on_stage is not None:
+                    on_stage(stage.name, batch)
+        return jobs
+
+    def _run_stage(self, stage: Stage, jobs: List[Job], shared: dict):
+        todo = []
+        for job in jobs:
+            if self._satisfied(stage, job, shared):
+                continue
+            readers = self._readers[stage.name]
+            if readers and all(self._satisfied(reader, job, shared) for reader in readers):
+                continue  # nothing downstream needs this stage's outputs for this job
+            todo.append(job)
+        if not todo:
+            return
+
+        def args(job):
+            return {name: shared[name] if name in self.shared else job.data[name] for name in stage.inputs}
+
+        start = time.perf_counter()
+        if stage.batchable:
+            columns = {name: shared[name] if name in self.shared else [job.data[name] for job in todo]
+                       for name in stage.inputs}
+            results = stage.fn(**columns)
+            if len(results) != len(todo):
+                raise PipelineError(f"Batchable stage '{stage.name}' returned {len(results)} results for {len(todo)} jobs")
+            elapsed = time.perf_counter() - start
+            per_job = [elapsed / len(todo)] * len(todo)
+        else:
+            results, per_job = [], []
+            for job in todo:
+                t0 = time.perf_counter()
+                results.append(stage.fn(**args(job)))
+                per_job.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - start
+        stage._record(len(todo), elapsed)
+        for job, outputs, seconds in zip(todo, results, per_job):
+            stage.check(outputs)
+            job.data.update(outputs)
+            job.timings_ms[stage.name] = round(seconds * 1000, 3)
+            key = job._cache_keys.pop(stage.name, None)
+            if key is not None:
+                stage.cache.lru.put(key, {name: outputs[name] for name in stage.outputs})
+
+    @staticmethod
+    def _satisfied(stage: Stage, job: Job, shared: dict) -> bool:
+        """True when the job has the stage's outputs, from the caller or from the stage's cache."""
+        if all(name in job.data for name in stage.outputs):
+            return True
+        cache = stage.cache
+        if cache is None or not cache.enabled or stage.name in job._missed:
+            return False
+        key = cache.key(job.data, shared)
+        if key is None:
+            return False
+        cached = cache.lru.get(key)
+        if cached is None:
+            job._missed.add(stage.name)
+            job._cache_keys[stage.name] = key
+            return False
+        job.data.update(cached)
+        job.timings_ms[stage.name] = 0.0
+        return True
+
+    def stats(self) -> dict:
+        return {"pipeline": self.name, "stages": {stage.name: stage.stats() for stage in self.stages}}
+
+    def reset_stats(self):
+        for stage in self.stages:
+            stage.calls = stage.items = 0
+            stage.seconds = 0.0
+            if stage.cache is not None:
+                stage.cache.lru.clear()
@@ -0,0 +1,139 @@
+"""
+Multi-worker model sharing for Cerberus DeepCrystal
+With several Gunicorn workers, each process used to load its own copy of the
+CLIP weights. gunicorn.conf.py instead loads the model and the catalogue's
+text-embedding bank once in the master (prepare_for_fork), and the forked
+workers share those pages copy-on-write:
+
+  - weights are frozen (eval mode, requires_grad off) and inference never
+    writes them, so their pages are never copied
+  - gc.freeze() moves every object created so far out of the collector's
+    reach, so garbage collection in a worker does not dirty the shared pages
+    of imported modules and model objects
+  - the master runs torch single-threaded: an OpenMP thread pool started
+    before fork deadlocks the children. after_fork() gives each worker its
+    share of the cores instead
+
+A catalogue reload in one worker re-encodes only the changed prompts into a
+new, private bank for that worker; the shared one stays as it was.
+
+memory_report() reads /proc/<pid>/smaps_rollup for the master and every
+worker. USS (private pages) is what each extra worker really costs; PSS
+splits shared pages between the processes that map them.
+Author: Sudeepa Wanigarathna
+"""
+
+import gc
+import os
+import time
+from typing import Optional
+
+import torch
+
+# Intra-op threads per worker; default splits the cores between the workers
+WORKER_TORCH_THREADS = int(os.getenv("WORKER_TORCH_THREADS", "0"))
+
+_SMAPS_FIELDS = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared_clean", "Shared_Dirty": "shared_dirty",
+                 "Private_Clean": "private_clean", "Private_Dirty": "private_dirty", "Swap": "swap"}
+
+_preloaded_by = None  # pid of the process that ran prepare_for_fork (inherited by workers)
+
+
+def prepare_for_fork() -> dict:
+    """Loads the model and text bank in the master process so workers inherit them. Returns load timings."""
+    from database import engine
+    from services.catalogue import get_catalogue
+    from services.ml_pipeline import load_model
+
+    global _preloaded_by
+    torch.set_num_threads(1)
+    start = time.perf_counter()
+    model, _ = load_model()
+    model.eval()
+    model.requires_grad_(False)
+    loaded = time.perf_counter()
+    catalogue = get_catalogue()  # encodes the prompt bank (and syncs minerals on first load)
+    encoded = time.perf_counter()
+    engine.dispose()  # no pooled connections may cross the fork
+    _preloaded_by = os.getpid()
+    gc.collect()
+    gc.freeze()
+    print(f"Pre-fork: model loaded in {loaded - start:.1f} s, {catalogue.text_bank.shape[0]} prompt "
+          f"embeddings in {encoded - loaded:.1f} s; workers will share them.")
+    return {"model_s": round(loaded - start, 2), "text_bank_s": round(encoded - loaded, 2)}
+
+
+def after_fork(workers: int):
+    """Per-worker setup right after fork."""
+    from database import engine
+    engine.dispose(close=False)  # drop any inherited pool without closing the master's sockets
+    torch.set_num_threads(WORKER_TORCH_THREADS or max(1, (os.cpu_count() or 1) // max(1, workers)))
+
+
+def process_memory(pid: int) -> Optional[dict]:
+    """RSS/PSS/USS/shared of a process in MiB (Linux), or None when unavailable."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    kb = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name in _SMAPS_FIELDS:
+            kb[_SMAPS_FIELDS[name]] = int(value.split()[0])
+    mib = lambda value: round(value / 1024, 1)
+    return {
+        "pid": pid,
+        "rss_mib": mib(kb.get("rss", 0)),
+        "pss_mib": mib(kb.get("pss", 0)),
+        "uss_mib": mib(kb.get("private_clean", 0) + kb.get("private_dirty", 0)),
+        "shared_mib": mib(kb.get("shared_clean", 0) + kb.get("shared_dirty", 0)),
+        "swap_mib": mib(kb.get("swap", 0)),
+    }
+
+
+def _children(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    children = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            if int(stat[stat.rfind(")") + 2:].split()[1]) == pid:
+                children.append(int(entry))
+    return sorted(children)
+
+
+def _is_gunicorn(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"gunicorn" in f.read()
+    except OSError:
+        return False
+
+
+def memory_report() -> dict:
+    """Memory of this worker, and of the master and all sibling workers when running under Gunicorn."""
+    me = os.getpid()
+    master = os.getppid()
+    report = {"serving_pid": me, "shared_model": _preloaded_by is not None and _preloaded_by != me}
+    if not _is_gunicorn(master):
+        current = process_memory(me)
+        workers = [current] if current else []
+        return {**report, "master": None, "workers": workers, "totals": _totals(workers)}
+    workers = [m for m in (process_memory(pid) for pid in _children(master)) if m]
+    master_memory = process_memory(master)
+    return {**report, "master": master_memory, "workers": workers,
+            "totals": _totals(workers + ([master_memory] if master_memory else []))}
+
+
+def _totals(processes: list) -> dict:
+    return {key: round(sum(p[key] for p in processes), 1) for key in ("rss_mib", "pss_mib", "uss_mib")}
@@ -0,0 +1,89 @@
+"""
+Execution profiles for Cerberus DeepCrystal
+Maps the scan `mode` (subscription tier) to how much compute the ML pipeline
+spends on a scan. Keys mirror TIERS in routers/auth.py.
+
+  decode_size      decode JPEGs at reduced scale so the short side is >= this
+                   many pixels (None = full resolution)
+  prompts_per_gem  prompt-ensemble size used from the text bank (1..3)
+  cache_results    serve repeated identical uploads from an in-process LRU
+  max_views        views of one stone fused per scan (multi-view fusion)
+  tta              test-time augmentation: crops, flips and scales of each view
+                   encoded in the same batch
+  tta_strategy     how augmentation logits are combined (see ml_pipeline.TTA_STRATEGIES)
+  spectra          Raman/FTIR/UV-Vis input matched against the spectral library
+Author: Sudeepa Wanigarathna
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+TTA_STRATEGY = os.getenv("TTA_STRATEGY", "mean_logits")
+
+EXECUTION_PROFILES = {
+    "free": {"decode_size": 224, "prompts_per_gem": 1, "cache_results": True, "max_views": 1, "tta": False, "tta_strategy": "mean_logits", "spectra": False},
+    "pro": {"decode_size": None, "prompts_per_gem": 3, "cache_results": False, "max_views": 1, "tta": False, "tta_strategy": "mean_logits", "spectra": False},
+    "lab": {"decode_size": None, "prompts_per_gem": 3, "cache_results": False, "max_views": 8, "tta": True, "tta_strategy": TTA_STRATEGY, "spectra": True},
+    "api": {"decode_size": None, "prompts_per_gem": 3, "cache_results": True, "max_views": 1, "tta": False, "tta_strategy": "mean_logits", "spectra": False},
+    "gov": {"decode_size": None, "prompts_per_gem": 3, "cache_results": False, "max_views": 8, "tta": True, "tta_strategy": TTA_STRATEGY, "spectra": True},
+}
+DEFAULT_PROFILE = "pro"
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+
+
+def get_profile(mode: Optional[str]) -> dict:
+    """Profile for a scan mode; unknown modes get the standard (pro) path."""
+    name = mode if mode in EXECUTION_PROFILES else DEFAULT_PROFILE
+    return {"name": name, **EXECUTION_PROFILES[name]}
+
+
+class ResultCache:
+    """Thread-safe LRU of pipeline results keyed by image content, manual inputs and profile."""
+
+    def __init__(self, capacity: int = RESULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(views: list, manual_inputs: Optional[dict], profile: dict, spectra: Optional[dict] = None) -> str:
+        digest = hashlib.sha256()
+        for view in views:
+            digest.update(hashlib.sha256(view).digest())
+        digest.update(json.dumps(manual_inputs or {}, sort_keys=True, default=str).encode())
+        for kind, (vector, _) in sorted((spectra or {}).items()):
+            digest.update(kind.encode() + vector.tobytes())
+        digest.update(profile["name"].encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            result = self._data.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: str, result: dict):
+        with self._lock:
+            self._data[key] = result
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+result_cache = ResultCache()
@@ -0,0 +1,243 @@
+"""
+Image quality gate for Cerberus DeepCrystal
+Checks every uploaded view before it reaches the model, on a small decode
+(JPEGs are decoded at reduced DCT scale, long side GATE_SIZE px), in a few
+milliseconds per photo:
+
+  resolution  short side of the original photo
+  stone_area  share of the frame that differs from the background (the
+              median colour of the border)
+  sharpness   variance of the Laplacian in 16 px tiles over the stone
+              (90th percentile), so a plain background does not read as blur
+  exposure    share of the stone's pixels clipped to white or crushed to
+              black, and frames that are almost entirely black or white
+  colour      greyscale photos, and washed-out colour (HSV saturation)
+  graphic     flat fills without photographic texture (drawings,
+              screenshots, blank images)
+
+Each check passes, flags (the scan runs and the report carries the warning)
+or rejects (the scan is refused with 422 before inference, and the quota is
+not charged). Every reason comes with a message saying what to change.
+QUALITY_GATE=0 turns the gate off; GET /api/admin/quality reports its cost
+and rejection rate.
+Author: Sudeepa Wanigarathna
+"""
+
+import io
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+QUALITY_GATE = os.getenv("QUALITY_GATE", "1") != "0"
+GATE_SIZE = 256  # long side of the decode the checks run on
+TILE = 16
+
+# (reject, flag) thresholds per metric
+MIN_SIDE = (112, 224)  # px; the model sees 224 px
+MIN_STONE_AREA = (0.005, 0.03)  # share of the frame
+NO_STONE_AREA = 0.0005  # below this nothing stands out from the background at all
+MIN_SHARPNESS = (15.0, 40.0)  # Laplacian variance at GATE_SIZE
+MAX_CLIPPED = (0.6, 0.25)  # share of stone pixels with two channels >= 250 (highlights) or luminance <= 8 (shadows)
+MIN_FRAME_BRIGHTNESS, MAX_FRAME_BRIGHTNESS = 20.0, 250.0  # mean luminance of the whole frame
+MIN_SATURATION = 0.06  # mean HSV saturation of the stone; flag only (colourless stones exist)
+MAX_GREY_SPREAD = 6.0  # max channel difference of a greyscale photo (JPEG noise included)
+MIN_TEXTURE = 1.5  # luminance noise inside the stone below which it is a flat fill
+
+REJECT, FLAG, PASS = "reject", "flag", "pass"
+_RANK = {PASS: 0, FLAG: 1, REJECT: 2}
+
+
+def _decode_small(data: bytes):
+    image = Image.open(io.BytesIO(data))
+    size = image.size
+    scale = GATE_SIZE / max(size)
+    image.draft("RGB", (max(1, int(size[0] * scale)), max(1, int(size[1] * scale))))
+    image = image.convert("RGB")
+    image.thumbnail((GATE_SIZE, GATE_SIZE))
+    return np.asarray(image, dtype=np.float32), size
+
+
+def _laplacian(gray: np.ndarray) -> np.ndarray:
+    return (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]) - 4.0 * gray[1:-1, 1:-1]
+
+
+def _tiles(a: np.ndarray, reduce) -> np.ndarray:
+    h, w = (a.shape[0] // TILE) * TILE, (a.shape[1] // TILE) * TILE
+    t = a[:h, :w].reshape(h // TILE, TILE, w // TILE, TILE)
+    return reduce(t, axis=(1, 3))
+
+
+def measure(rgb: np.ndarray) -> dict:
+    """Quality metrics of a small RGB float32 image."""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]  # per-channel arithmetic is much faster than axis=2 reductions
+    gray = 0.299 * r + 0.587 * g + 0.114 * b
+
+    # Foreground: pixels clearly different from the background colour (median of a 4 px border)
+    border = np.concatenate([rgb[:4].reshape(-1, 3), rgb[-4:].reshape(-1, 3),
+                             rgb[:, :4].reshape(-1, 3), rgb[:, -4:].reshape(-1, 3)])
+    background = np.median(border, axis=0)
+    border_dist = np.sqrt(((border - background) ** 2).sum(axis=1))
+    dist2 = (r - background[0]) ** 2 + (g - background[1]) ** 2 + (b - background[2]) ** 2
+    stone = dist2 > max(30.0, float(np.percentile(border_dist, 95)) + 10.0) ** 2
+    area = float(stone.mean())
+    region = stone if stone.sum() >= 64 else np.ones_like(stone)
+
+    lap = _laplacian(gray)
+    tile_var = _tiles(lap, np.var)
+    tile_stone = _tiles(region[1:-1, 1:-1].astype(np.float32), np.mean)
+    focus = tile_var[tile_stone > 0.25]
+    sharpness = float(np.percentile(focus if focus.size else tile_var, 90))
+    # Photographic texture: Laplacian noise inside the stone, away from its outline
+    inner = region[1:-1, 1:-1] & (np.abs(lap) < 40)
+    texture = float(np.abs(lap[inner]).mean()) if inner.any() else 0.0
+
+    peak, low = np.maximum(np.maximum(r, g), b), np.minimum(np.minimum(r, g), b)
+    mid = r + g + b - peak - low
+    y = gray[region]
+    highlights = float((mid[region] >= 250).mean())  # two channels clipped: detail and colour are lost
+    shadows = float((y <= 8).mean())
+    saturation = float(((peak - low) / np.maximum(peak, 1.0))[region].mean())
+    grey_spread = float(np.percentile(peak - low, 99))
+    return {
+        "stone_area": round(area, 4), "sharpness": round(sharpness, 1), "texture": round(texture, 2),
+        "highlights": round(highlights, 4), "shadows": round(shadows, 4),
+        "brightness": round(float(y.mean()), 1), "frame_brightness": round(float(gray.mean()), 1),
+        "saturation": round(saturation, 3),
+        "grey_spread": round(grey_spread, 1),
+    }
+
+
+def _reason(check: str, severity: str, message: str, value, threshold) -> dict:
+    return {"check": check, "severity": severity, "message": message, "value": value, "threshold": threshold}
+
+
+def assess(metrics: dict, size: tuple) -> List[dict]:
+    """Reasons (reject or flag) for one photo's metrics and original (width, height)."""
+    reasons = []
+    side = min(size)
+    if side < MIN_SIDE[1]:
+        severity = REJECT if side < MIN_SIDE[0] else FLAG
+        reasons.append(_reason("resolution", severity,
+                               f"The photo is only {size[0]}×{size[1]} px. Upload the original photo (at least "
+                               f"{MIN_SIDE[1]} px on the short side), not a thumbnail or screenshot.",
+                               side, MIN_SIDE[1]))
+    frame = metrics["frame_brightness"]
+    if frame < MIN_FRAME_BRIGHTNESS or frame > MAX_FRAME_BRIGHTNESS:
+        # Nothing can be told apart in a frame this dark or bright; the other checks would only repeat it
+        dark = frame < MIN_FRAME_BRIGHTNESS
+        reasons.append(_reason("exposure", REJECT,
+                               "The photo is almost black; add diffuse light or increase the exposure." if dark else
+                               "The photo is almost white; reduce the light or exposure and avoid direct flash.",
+                               frame, MIN_FRAME_BRIGHTNESS if dark else MAX_FRAME_BRIGHTNESS))
+        return reasons
+    area = metrics["stone_area"]
+    if area < MIN_STONE_AREA[1]:
+        severity = REJECT if area < MIN_STONE_AREA[0] else FLAG
+        message = (f"The stone fills only {area:.1%} of the frame. Move closer or crop so it fills at least "
+                   f"{MIN_STONE_AREA[1]:.0%}." if area >= NO_STONE_AREA else
+                   "No stone found. Photograph it on a plain background that contrasts with the stone.")
+        reasons.append(_reason("stone_area", severity, message, area, MIN_STONE_AREA[1]))
+    if metrics["grey_spread"] < MAX_GREY_SPREAD:
+        reasons.append(_reason("colour", REJECT,
+                               "The photo has no colour (greyscale). Colour is needed to identify the stone; "
+                               "upload a colour photo.", metrics["grey_spread"], MAX_GREY_SPREAD))
+    elif metrics["saturation"] < MIN_SATURATION:
+        reasons.append(_reason("colour", FLAG,
+                               "Colours look washed out. Check white balance and lighting (expected for "
+                               "colourless stones such as diamond or quartz).", metrics["saturation"], MIN_SATURATION))
+    if area < MIN_STONE_AREA[0]:
+        return reasons  # focus and texture are only measured on the stone
+    if metrics["texture"] < MIN_TEXTURE and metrics["sharpness"] >= MIN_SHARPNESS[0]:
+        # flat fills with crisp edges; a heavily blurred photo is flat too, but reads as out of focus below
+        reasons.append(_reason("graphic", REJECT,
+                               "This looks like a drawing, screenshot or blank image rather than a photograph "
+                               "of a stone.", metrics["texture"], MIN_TEXTURE))
+    elif metrics["sharpness"] < MIN_SHARPNESS[1]:
+        severity = REJECT if metrics["sharpness"] < MIN_SHARPNESS[0] else FLAG
+        reasons.append(_reason("sharpness", severity,
+                               "The photo is out of focus. Hold the camera steady, tap to focus on the stone, "
+                               "or use a macro lens or tripod.", metrics["sharpness"], MIN_SHARPNESS[1]))
+    for key, label, advice in (("highlights", "blown out to white", "reduce the light or exposure and avoid direct flash"),
+                               ("shadows", "too dark to read", "add diffuse light or increase the exposure")):
+        share = metrics[key]
+        if share > MAX_CLIPPED[1]:
+            severity = REJECT if share > MAX_CLIPPED[0] else FLAG
+            reasons.append(_reason("exposure", severity, f"{share:.0%} of the stone is {label}; {advice}.",
+                                   share, MAX_CLIPPED[1]))
+    return reasons
+
+
+class QualityGate:
+    def __init__(self, enabled: bool = QUALITY_GATE):
+        self.enabled = enabled
+        self.checked = 0
+        self.verdicts = Counter()
+        self.reasons = Counter()  # (check, severity) -> photos
+        self.total_ms = 0.0
+        self._recent_ms = deque(maxlen=1024)
+        self._lock = threading.Lock()
+
+    def inspect(self, data: bytes) -> dict:
+        """Verdict, reasons and metrics for one photo."""
+        start = time.perf_counter()
+        try:
+            rgb, size = _decode_small(data)
+        except Exception:
+            reasons = [_reason("unreadable", REJECT, "The file could not be read as an image. Upload a JPEG, PNG "
+                               "or WebP photo.", None, None)]
+            metrics = {}
+        else:
+            metrics = {"width": size[0], "height": size[1]}
+            if min(rgb.shape[:2]) < TILE + 2:
+                # Tiny or a thin strip (e.g. 2000×20): too few pixels for one focus tile, nothing to measure
+                reasons = [_reason("resolution", REJECT, f"The photo is only {size[0]}×{size[1]} px, too small or "
+                                   f"too narrow to analyse. Upload the original photo of the stone (at least "
+                                   f"{MIN_SIDE[1]} px on the short side).", min(size), MIN_SIDE[1])]
+            else:
+                metrics.update(measure(rgb))
+                reasons = assess(metrics, size)
+        verdict = max((r["severity"] for r in reasons), key=_RANK.get, default=PASS)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.checked += 1
+            self.verdicts[verdict] += 1
+            for r in reasons:
+                self.reasons[(r["check"], r["severity"])] += 1
+            self.total_ms += elapsed
+            self._recent_ms.append(elapsed)
+        return {"verdict": verdict, "reasons": reasons, "metrics": metrics, "ms": round(elapsed, 2)}
+
+    def check_views(self, views: List[bytes], filenames: List[str]) -> dict:
+        """Inspects every view of a scan; the scan's verdict is its worst view's."""
+        start = time.perf_counter()
+        reports = [self.inspect(view) for view in views]
+        reasons = [{**r, "view": i, "filename": filenames[i]} for i, report in enumerate(reports) for r in report["reasons"]]
+        return {
+            "verdict": max((r["verdict"] for r in reports), key=_RANK.get, default=PASS),
+            "reasons": reasons,
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    def status(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent_ms)
+            checked = self.checked
+            return {
+                "enabled": self.enabled,
+                "photos_checked": checked,
+                "passed": self.verdicts[PASS], "flagged": self.verdicts[FLAG], "rejected": self.verdicts[REJECT],
+                "rejection_rate": round(self.verdicts[REJECT] / checked, 4) if checked else None,
+                "flag_rate": round(self.verdicts[FLAG] / checked, 4) if checked else None,
+                "reasons": {f"{check}.{severity}": n for (check, severity), n in sorted(self.reasons.items())},
+                "mean_ms": round(self.total_ms / checked, 2) if checked else None,
+                "p50_ms": round(recent[len(recent) // 2], 2) if recent else None,
+                "p99_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 2) if recent else None,
+            }
+
+
+quality_gate = QualityGate()
@@ -0,0 +1,304 @@
+"""
+Scan quota admission control for Cerberus DeepCrystal
+Enforces each tier's scans_per_day (TIERS in routers/auth.py) in front of the
+scan endpoint. Every (tier, client) pair has a token bucket holding up to
+scans_per_day tokens that refills continuously at scans_per_day per 24 hours;
+a scan takes one token. Unlimited tiers (-1) skip the bucket.
+
+AdmissionMiddleware is a plain ASGI middleware, so the decision is made from
+the request line and headers alone, before the multipart upload is received:
+a rejected client gets 429 with Retry-After without sending the image body.
+
+  X-Client-Id   who is scanning (API key, account id...). Falls back to the client IP.
+  X-Tier        the scan mode / tier (or ?mode=). Falls back to QUOTA_DEFAULT_TIER.
+
+Modes without a tier of their own (and unknown names) count against
+QUOTA_DEFAULT_TIER, so no tier name gets around the quota. A client that only
+sends the mode in the form is admitted against QUOTA_DEFAULT_TIER; once the
+form is parsed the scan is moved to its mode's bucket (and refused with 429
+there if that one is used up, after the upload).
+
+Only scans that store a report are charged: the middleware returns the token
+of any scan answered with an error status (or an exception), and a streamed
+scan that fails after its stream started returns it itself.
+
+The check is a dict lookup and a few float operations under one uncontended
+lock. A background thread flushes the tokens spent since the last flush to
+the scan_quotas table every QUOTA_FLUSH_INTERVAL seconds and reads back the
+state written by other workers/nodes, so limits survive restarts and are
+shared between processes (a client can overshoot by what it spends on other
+workers within one flush interval). Buckets that have refilled completely are
+dropped from memory and the table.
+Author: Sudeepa Wanigarathna
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from database import engine, ScanQuota
+
+QUOTA_ENFORCEMENT = os.getenv("SCAN_QUOTAS", "1") == "1"
+QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "5"))
+QUOTA_DEFAULT_TIER = os.getenv("QUOTA_DEFAULT_TIER", "pro")  # the scan endpoint's default mode
+QUOTA_PATHS = {"/api/analysis/scan", "/api/analysis/scan/stream"}
+QUOTA_WINDOW = 86400.0
+
+
+class _Bucket:
+    __slots__ = ("tokens", "stamp", "spent")
+
+    def __init__(self, tokens: float, stamp: float):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.spent = 0  # tokens taken since the last flush
+
+
+class QuotaManager:
+    def __init__(self, limits: Optional[dict] = None, flush_interval: float = QUOTA_FLUSH_INTERVAL):
+        self.limits = {}
+        self.flush_interval = flush_interval
+        self.admitted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.last_flush_ms = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+        self.configure(limits or {})
+
+    def configure(self, limits: dict):
+        """limits: {tier: scans per day}; negative means unlimited."""
+        self.limits = dict(limits)
+
+    def tier(self, name: Optional[str]) -> str:
+        """The tier a scan mode is counted against."""
+        return name if name in self.limits else QUOTA_DEFAULT_TIER
+
+    def admit(self, client: str, tier: str, now: Optional[float] = None) -> tuple:
+        """Takes one scan from the client's bucket. Returns (admitted, limit, remaining, retry_after_s)."""
+        tier = self.tier(tier)
+        limit = self.limits.get(tier, -1)
+        if limit < 0:
+            self.admitted += 1
+            return True, limit, None, 0.0
+        now = time.time() if now is None else now
+        rate = limit / QUOTA_WINDOW
+        key = (tier, client)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(float(limit), now)
+            else:
+                bucket.tokens = min(float(limit), bucket.tokens + (now - bucket.stamp) * rate)
+                bucket.stamp = now
+            if bucket.tokens >= 1.0:
+                bucket.tokens -= 1.0
+                bucket.spent += 1
+                self.admitted += 1
+                return True, limit, int(bucket.tokens), 0.0
+            self.rejected += 1
+            return False, limit, 0, (1.0 - bucket.tokens) / rate if rate else QUOTA_WINDOW
+
+    def refund(self, client: str, tier: str):
+        """Returns the token of an admitted scan that was then refused for another reason."""
+        tier = self.tier(tier)
+        limit = self.limits.get(tier, -1)
+        if limit < 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get((tier, client))
+            if bucket is not None:
+                bucket.tokens = min(float(limit), bucket.tokens + 1.0)
+                bucket.spent -= 1
+
+    def refund_admission(self, admission: dict):
+        """Refunds an admitted scan once, unless its report was stored (admission["persisted"])."""
+        if admission.get("refunded") or admission.get("persisted"):
+            return
+        admission["refunded"] = True
+        self.refund(admission["client"], admission["tier"])
+
+    # ── persistence ──
+    def flush(self, now: Optional[float] = None) -> int:
+        """Writes spent tokens to scan_quotas and adopts the merged state of every worker. Returns rows written."""
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        with self._lock:
+            spent = {key: b.spent for key, b in self._buckets.items() if b.spent}
+            for key in spent:
+                self._buckets[key].spent = 0
+        t = ScanQuota.__table__
+        stamp = datetime.utcfromtimestamp(now)
+        try:
+            with engine.begin() as conn:
+                for (tier, client), n in spent.items():
+                    limit = self.limits.get(tier, -1)
+                    if limit < 0:
+                        continue
+                    key = [t.c.tier == tier, t.c.client_id == client]
+                    select = t.select().where(*key)
+                    if conn.dialect.name == "postgresql":
+                        select = select.with_for_update()
+                    row = conn.execute(select).first()
+                    tokens = float(limit) if row is None else self._refill(row.tokens, row.updated_at, limit, now)
+                    values = {"tokens": tokens - n, "updated_at": stamp}
+                    if row is None:
+                        conn.execute(t.insert().values(tier=tier, client_id=client, **values))
+                    else:
+                        conn.execute(t.update().where(*key).values(**values))
+                merged = {(r.tier, r.client_id): self._refill(r.tokens, r.updated_at, self.limits.get(r.tier, -1), now)
+                          for r in conn.execute(t.select())}
+                full = [key for key, tokens in merged.items() if tokens >= self.limits.get(key[0], -1)]
+                for tier, client in full:
+                    conn.execute(t.delete().where(t.c.tier == tier, t.c.client_id == client))
+        except Exception as e:
+            with self._lock:  # keep the spends for the next attempt
+                for key, n in spent.items():
+                    if key in self._buckets:
+                        self._buckets[key].spent += n
+            print(f"Quota flush failed: {e}")
+            return 0
+        with self._lock:
+            for key, tokens in merged.items():
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    self._buckets[key] = _Bucket(tokens, now)
+                else:  # spends admitted while this flush ran are still owed
+                    bucket.tokens, bucket.stamp = tokens - bucket.spent, now
+            for key in [k for k, b in self._buckets.items() if not b.spent and b.tokens >= self.limits.get(k[0], -1)]:
+                del self._buckets[key]  # refilled: a new bucket starts full anyway
+        self.flushes += 1
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+        return len(spent)
+
+    @staticmethod
+    def _refill(tokens: float, updated_at: datetime, limit: int, now: float) -> float:
+        if limit < 0:
+            return float("inf")
+        elapsed = max(0.0, now - (updated_at - datetime(1970, 1, 1)).total_seconds())
+        return min(float(limit), tokens + elapsed * limit / QUOTA_WINDOW)
+
+    def start(self):
+        """Loads persisted buckets and starts the periodic flush thread (once per process)."""
+        if self._flusher is not None:
+            return
+        self.flush()
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(self.flush_interval):
+                self.flush()
+
+        self._flusher = threading.Thread(target=loop, daemon=True, name="quota-flush")
+        self._flusher.start()
+
+    def stop(self):
+        if self._flusher is None:
+            return
+        self._stop.set()
+        self._flusher.join(timeout=5)
+        self._flusher = None
+        self.flush()
+
+    def status(self) -> dict:
+        return {
+            "enforced": QUOTA_ENFORCEMENT,
+            "limits_per_day": self.limits,
+            "tracked_clients": len(self._buckets),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "flush_interval_s": self.flush_interval,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+quotas = QuotaManager()
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1").strip() or None
+    return None
+
+
+def _query_mode(scope) -> Optional[str]:
+    for part in scope.get("query_string", b"").decode("latin-1").split("&"):
+        key, _, value = part.partition("=")
+        if key == "mode" and value:
+            return value
+    return None
+
+
+def exhausted_detail(tier: str, limit: int, retry_after: float) -> tuple:
+    """(Retry-After seconds, message) for a client whose quota is used up."""
+    wait = int(retry_after) + 1
+    wait_text = f"{wait // 3600} h {wait % 3600 // 60} min" if wait >= 3600 else f"{wait // 60 + 1} min"
+    return wait, (f"Daily scan quota of the '{tier}' tier ({limit} per day) is used up. "
+                  f"Next scan available in {wait_text}, or upgrade your tier.")
+
+
+def quota_headers(admission: dict) -> list:
+    if admission["limit"] < 0:
+        return []
+    return [(b"x-quota-limit", str(admission["limit"]).encode()),
+            (b"x-quota-remaining", str(admission["remaining"]).encode())]
+
+
+def request_client(request) -> str:
+    """Client id of a FastAPI request: the admitted one, else X-Client-Id, else the client IP."""
+    admission = getattr(request.state, "admission", None)
+    if admission:
+        return admission["client"]
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+
+class AdmissionMiddleware:
+    """Rejects over-quota scans with 429 before the request body is read."""
+
+    def __init__(self, app, manager: QuotaManager = quotas):
+        self.app = app
+        self.manager = manager
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in QUOTA_PATHS or scope["method"] != "POST" \
+                or not QUOTA_ENFORCEMENT:
+            return await self.app(scope, receive, send)
+        declared = _header(scope, b"x-tier") or _query_mode(scope)
+        tier = self.manager.tier(declared)
+        client = _header(scope, b"x-client-id") or (scope["client"][0] if scope.get("client") else "unknown")
+        admitted, limit, remaining, retry_after = self.manager.admit(client, tier)
+        # the scan endpoint updates this if the form's mode moves the scan to another tier
+        admission = {"tier": tier, "client": client, "declared": declared is not None,
+                     "limit": limit, "remaining": remaining}
+        scope.setdefault("state", {})["admission"] = admission
+        if not admitted:
+            wait, detail = exhausted_detail(tier, limit, retry_after)
+            body = json.dumps({"detail": detail}).encode()
+            await send({"type": "http.response.start", "status": 429, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(wait).encode()), (b"connection", b"close"), *quota_headers(admission)]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        status = []
+
+        async def send_with_quota(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+                message = {**message, "headers": [*message.get("headers", []), *quota_headers(admission)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_quota)
+        except Exception:
+            self.manager.refund_admission(admission)
+            raise
+        if not status or status[0] >= 400:  # refused or failed: no report, no charge
+            self.manager.refund_admission(admission)
@@ -0,0 +1,339 @@
+"""
+Scan capture and replay for Cerberus DeepCrystal
+Measures what a model backend, prompt or pipeline change does to real
+traffic before it ships.
+
+Capture: with CAPTURE_RATE > 0 (share of scans, e.g. 0.05), the scan
+endpoints record a sample of scans. The photos go to the content-addressed
+blob store (services/blob_store.py, shared with evidence retention, so a
+photo is stored once). One anonymised NDJSON line per scan goes to
+<CAPTURE_DIR>/captures-<host>-<pid>.ndjson (default storage/captures):
+
+  {"id", "captured_at" (hour only), "mode", "views": [sha256...],
+   "manual_inputs", "spectra" (prepared vectors, base64) or null,
+   "config": {"model", "catalogue_file", "catalogue_version"}, "output": {"gem_key",
+   "base_confidence", ...}, "stage_ms": {stage: ms}}
+
+No client id, IP address, session or certificate id is recorded; cached
+results are not captured.
+
+Replay: runs a capture set through a candidate configuration (environment
+overrides such as DEEPCRYSTAL_MODEL, CATALOGUE_FILE, TTA_STRATEGY or
+SPECTRAL_WEIGHT) in parallel worker processes, fully offline: photos are
+read from the blob store, Hugging Face downloads are disabled and the
+workers use a throwaway database. Reports top-1 agreement, confidence
+deltas and per-stage latency side by side with the baseline: the recorded
+outputs, or (--baseline rerun) the current configuration re-run on this
+machine, so latencies are compared on the same hardware.
+
+Usage (from backend/):
+    python -m services.replay run storage/captures --env CATALOGUE_FILE=data/new_prompts.json
+    python -m services.replay run storage/captures --baseline rerun --env DEEPCRYSTAL_MODEL=stub --workers 4
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import base64
+import glob
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+# services.* that touch the database are imported lazily: replay workers import this module before
+# their initializer points DATABASE_URL at a throwaway database
+
+CAPTURE_RATE = float(os.getenv("CAPTURE_RATE", "0"))
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "storage/captures")
+CAPTURE_VERSION = 1
+OUTPUT_FIELDS = ("gem_key", "base_confidence", "natural_prob", "synthetic_prob")
+
+
+def _encode_spectra(spectra: Optional[dict]) -> Optional[dict]:
+    if not spectra:
+        return None
+    return {kind: {"vector": base64.b64encode(vector.tobytes()).decode(),
+                   "peaks": base64.b64encode(peaks.tobytes()).decode()}
+            for kind, (vector, peaks) in spectra.items()}
+
+
+def _decode_spectra(encoded: Optional[dict]) -> Optional[dict]:
+    if not encoded:
+        return None
+    return {kind: (np.frombuffer(base64.b64decode(s["vector"]), dtype=np.float32),
+                   np.frombuffer(base64.b64decode(s["peaks"]), dtype=np.float32))
+            for kind, s in encoded.items()}
+
+
+def capture_output(result: dict) -> dict:
+    """The parts of a pipeline result that replays are compared on."""
+    return {**{name: result[name] for name in OUTPUT_FIELDS},
+            "dominant_treatment": result["treatment_probs"]["dominant_treatment"],
+            "price_usd": [result["price"]["min_usd"], result["price"]["max_usd"]]}
+
+
+class CaptureRecorder:
+    def __init__(self, root: str = CAPTURE_DIR, rate: float = CAPTURE_RATE):
+        self.root = root
+        self.rate = rate
+        self.recorded = 0
+        self.errors = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def wants(self, result: dict) -> bool:
+        """Samples CAPTURE_RATE of the scans; repeats served from the result cache are skipped."""
+        return self.rate > 0 and not result.get("cached") and random.random() < self.rate
+
+    def record(self, views: List[bytes], manual_inputs: Optional[dict], spectra: Optional[dict], profile: dict,
+               result: dict):
+        """Stores the photos in the blob store and appends the capture line (call off the event loop)."""
+        from services.blob_store import queue_views
+        from services.catalogue import CATALOGUE_FILE, get_catalogue
+        from services.ml_pipeline import MODEL_BACKEND
+        try:
+            capture = {
+                "v": CAPTURE_VERSION,
+                "id": uuid.uuid4().hex,
+                "captured_at": datetime.utcnow().strftime("%Y-%m-%dT%H:00Z"),
+                "mode": profile["name"],
+                "views": queue_views(views),
+                "manual_inputs": manual_inputs or {},
+                "spectra": _encode_spectra(spectra),
+                "config": {"model": MODEL_BACKEND, "catalogue_file": CATALOGUE_FILE,
+                           "catalogue_version": get_catalogue().version},
+                "output": capture_output(result),
+                "stage_ms": result.get("stage_ms", {}),
+            }
+            line = json.dumps(capture, separators=(",", ":"), ensure_ascii=False, default=str) + "\n"
+            with self._lock:
+                if self._file is None:
+                    os.makedirs(self.root, exist_ok=True)
+                    name = f"captures-{socket.gethostname()}-{os.getpid()}.ndjson"
+                    self._file = open(os.path.join(self.root, name), "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+                self.recorded += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Scan capture failed: {e}")
+
+    def status(self) -> dict:
+        return {"rate": self.rate, "dir": self.root, "recorded": self.recorded, "errors": self.errors}
+
+
+recorder = CaptureRecorder()
+
+
+# ─────────────── Replay ───────────────
+
+def load_captures(paths: List[str], limit: Optional[int] = None) -> list:
+    """Captures from NDJSON files or directories of them, oldest file first."""
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, "*.ndjson"))) if os.path.isdir(path) else [path]
+    captures = []
+    for name in files:
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    captures.append(json.loads(line))
+                    if limit and len(captures) >= limit:
+                        return captures
+    return captures
+
+
+def _init_worker(env: dict, threads: int, warmup: list, blob_root: str):
+    os.environ.update(env)
+    import torch
+    torch.set_num_threads(threads)
+    from database import init_db
+    init_db()  # the throwaway database (a candidate catalogue upserts its minerals there); replay() created it
+    # Every worker loads the model and text bank before its first timed capture
+    _replay_chunk(warmup, blob_root)
+
+
+def _replay_chunk(captures: list, blob_root: str) -> list:
+    """Runs captures through the pipeline of this worker's configuration."""
+    from services.ml_pipeline import analyze_views
+    from services.profiles import get_profile
+    results = []
+    for capture in captures:
+        try:
+            views = []
+            for sha256 in capture["views"]:
+                with open(os.path.join(blob_root, sha256[:2], sha256[2:4], sha256), "rb") as f:
+                    views.append(f.read())
+            profile = {**get_profile(capture["mode"]), "cache_results": False}
+            start = time.perf_counter()
+            result = analyze_views(views, capture["manual_inputs"], profile, _decode_spectra(capture["spectra"]))
+            results.append({"id": capture["id"], "output": capture_output(result), "stage_ms": result["stage_ms"],
+                            "ms": round((time.perf_counter() - start) * 1000, 3)})
+        except Exception as e:
+            results.append({"id": capture["id"], "error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+def replay(captures: list, env: Dict[str, str], workers: int, blob_root: str) -> Dict[str, dict]:
+    """Replays captures under `env` in `workers` processes; returns results by capture id."""
+    workdir = tempfile.mkdtemp(prefix="deepcrystal-replay-")
+    worker_env = {"HF_HUB_OFFLINE": "1", "TRANSFORMERS_OFFLINE": "1", "CAPTURE_RATE": "0",
+                  "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'replay.db')}", **env}
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    size = max(1, min(16, len(captures) // (workers * 4) or 1))
+    results = {}
+    try:
+        # The schema is created here, once: workers starting together would race on CREATE TABLE
+        from sqlalchemy import create_engine
+        from database import Base
+        schema = create_engine(worker_env["DATABASE_URL"])
+        Base.metadata.create_all(bind=schema)
+        schema.dispose()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+                                 initargs=(worker_env, threads, captures[:1], blob_root)) as pool:
+            futures = [pool.submit(_replay_chunk, captures[i:i + size], blob_root)
+                       for i in range(0, len(captures), size)]
+            for future in as_completed(futures):
+                for r in future.result():
+                    results[r["id"]] = r
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _pct(values: list, q: float) -> Optional[float]:
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def compare(captures: list, baseline: Dict[str, dict], candidate: Dict[str, dict]) -> dict:
+    """Top-1 agreement, confidence deltas and per-stage latency of candidate vs baseline."""
+    pairs = [(c, baseline.get(c["id"]), candidate.get(c["id"])) for c in captures]
+    failed = [{"id": c["id"], "baseline": (b or {}).get("error"), "candidate": (k or {}).get("error")}
+              for c, b, k in pairs if not b or not k or "error" in b or "error" in k]
+    ok = [(c, b, k) for c, b, k in pairs if b and k and "error" not in b and "error" not in k]
+    agree = [b["output"]["gem_key"] == k["output"]["gem_key"] for _, b, k in ok]
+    deltas = [k["output"]["base_confidence"] - b["output"]["base_confidence"] for _, b, k in ok]
+    abs_deltas = [abs(d) for d in deltas]
+    # Pipeline order, from the scans that ran the most stages (cache hits skip some)
+    names = {}
+    for timings in sorted((t for _, b, k in ok for t in (b["stage_ms"], k["stage_ms"])), key=len, reverse=True):
+        names.update(dict.fromkeys(timings))
+    stages = {name: ([b["stage_ms"].get(name, 0.0) for _, b, _ in ok], [k["stage_ms"].get(name, 0.0) for _, _, k in ok])
+              for name in names}
+    totals = ([sum(b["stage_ms"].values()) for _, b, _ in ok], [sum(k["stage_ms"].values()) for _, _, k in ok])
+    by_mode = {}
+    for (c, _, _), same in zip(ok, agree):
+        by_mode.setdefault(c["mode"], []).append(same)
+    return {
+        "captures": len(captures),
+        "compared": len(ok),
+        "failed": failed,
+        "top1_agreement": round(sum(agree) / len(agree), 4) if agree else None,
+        "top1_agreement_by_mode": {mode: round(sum(v) / len(v), 4) for mode, v in sorted(by_mode.items())},
+        "confidence_delta": {"mean": round(float(np.mean(deltas)), 4) if deltas else None,
+                             "p50_abs": _pct(abs_deltas, 50), "p95_abs": _pct(abs_deltas, 95),
+                             "max_abs": round(max(abs_deltas), 4) if deltas else None},
+        "stages_ms": {name: {"baseline_p50": _pct(b, 50), "candidate_p50": _pct(k, 50),
+                             "delta_p50": round(_pct(k, 50) - _pct(b, 50), 3),
+                             "baseline_p95": _pct(b, 95), "candidate_p95": _pct(k, 95)}
+                      for name, (b, k) in stages.items()},
+        "total_ms": {"baseline_p50": _pct(totals[0], 50), "candidate_p50": _pct(totals[1], 50),
+                     "baseline_p95": _pct(totals[0], 95), "candidate_p95": _pct(totals[1], 95)},
+        "disagreements": [{"id": c["id"], "mode": c["mode"], "baseline": b["output"]["gem_key"],
+                           "candidate": k["output"]["gem_key"],
+                           "baseline_confidence": b["output"]["base_confidence"],
+                           "candidate_confidence": k["output"]["base_confidence"]}
+                          for (c, b, k), same in zip(ok, agree) if not same],
+    }
+
+
+def print_summary(summary: dict, baseline_label: str):
+    print(f"  {summary['compared']} of {summary['captures']} captures compared, {len(summary['failed'])} failed")
+    for row in summary["failed"][:5]:
+        print(f"  ! {row['id'][:12]} baseline: {row['baseline'] or 'ok'}; candidate: {row['candidate'] or 'ok'}")
+    if summary["top1_agreement"] is None:
+        return
+    modes = ", ".join(f"{m} {v:.1%}" for m, v in summary["top1_agreement_by_mode"].items())
+    print(f"  top-1 agreement {summary['top1_agreement']:.1%} ({modes})")
+    d = summary["confidence_delta"]
+    print(f"  confidence delta: mean {d['mean']:+.4f}, |p50| {d['p50_abs']:.4f}, |p95| {d['p95_abs']:.4f}, "
+          f"|max| {d['max_abs']:.4f}")
+    print(f"\n  {'stage (ms)':<18}{baseline_label + ' p50':>16}{'candidate p50':>15}{'delta':>10}"
+          f"{baseline_label + ' p95':>16}{'candidate p95':>15}")
+    rows = list(summary["stages_ms"].items()) + [("total", {**summary["total_ms"], "delta_p50": round(
+        summary["total_ms"]["candidate_p50"] - summary["total_ms"]["baseline_p50"], 3)})]
+    for name, s in rows:
+        print(f"  {name:<18}{s['baseline_p50']:>16.2f}{s['candidate_p50']:>15.2f}{s['delta_p50']:>+10.2f}"
+              f"{s['baseline_p95']:>16.2f}{s['candidate_p95']:>15.2f}")
+    for row in summary["disagreements"][:10]:
+        print(f"  ≠ {row['id'][:12]} {row['mode']:<5} {row['baseline']} ({row['baseline_confidence']:.2f}) -> "
+              f"{row['candidate']} ({row['candidate_confidence']:.2f})")
+    if len(summary["disagreements"]) > 10:
+        print(f"  ... {len(summary['disagreements']) - 10} more disagreements (see --json)")
+
+
+def _env_pair(text: str) -> tuple:
+    key, sep, value = text.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got '{text}'")
+    return key, value
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m services.replay", description=__doc__.split("\n")[1])
+    sub = p.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run", help="Replay captures through a candidate configuration")
+    r.add_argument("paths", nargs="+", help="Capture files or directories")
+    r.add_argument("--env", type=_env_pair, action="append", default=[], metavar="KEY=VALUE",
+                   help="Candidate configuration (repeatable), e.g. DEEPCRYSTAL_MODEL=clip")
+    r.add_argument("--baseline", choices=["recorded", "rerun"], default="recorded",
+                   help="Compare with the recorded outputs, or re-run the current configuration here")
+    r.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    r.add_argument("--limit", type=int, help="Replay at most this many captures")
+    r.add_argument("--blobs", default=os.getenv("BLOB_STORE_DIR", "storage/blobs"),
+                   help="Blob store holding the captured photos")
+    r.add_argument("--json", dest="json_out", help="Write the full comparison to this JSON file")
+    args = p.parse_args(argv)
+
+    captures = load_captures(args.paths, args.limit)
+    if not captures:
+        print("No captures found.")
+        return 1
+    print(f"Replaying {len(captures)} captures with {args.workers} worker(s); candidate "
+          f"{' '.join(f'{k}={v}' for k, v in args.env) or '(current configuration)'}")
+    if args.baseline == "rerun":
+        start = time.perf_counter()
+        baseline = replay(captures, {}, args.workers, args.blobs)
+        print(f"  baseline re-run in {time.perf_counter() - start:.1f}s")
+    else:
+        baseline = {c["id"]: {"id": c["id"], "output": c["output"], "stage_ms": c["stage_ms"]} for c in captures}
+    start = time.perf_counter()
+    candidate = replay(captures, dict(args.env), args.workers, args.blobs)
+    print(f"  candidate run in {time.perf_counter() - start:.1f}s\n")
+    summary = compare(captures, baseline, candidate)
+    print_summary(summary, "recorded" if args.baseline == "recorded" else "baseline")
+    if args.baseline == "recorded":
+        print("\n  (recorded latencies were measured on the serving host; --baseline rerun compares on this machine)")
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"candidate_env": dict(args.env), "baseline": args.baseline, **summary}, f, indent=2)
+        print(f"Comparison written to {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
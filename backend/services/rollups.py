@@ -0,0 +1,191 @@
+"""
+Analytics rollups for Cerberus DeepCrystal
+report_rollups holds running counts and sums of analysis_reports per
+(day, mineral, mode), with per-treatment and per-price-band scan counts as
+columns. Every code path that inserts
+reports calls record_reports() in the same transaction, so the dashboard
+statistics (GET /api/analysis/stats) read O(days x minerals x modes) rollup rows
+instead of scanning every report.
+
+Backfill an existing database once with:
+    python -m services.rollups rebuild
+Author: Sudeepa Wanigarathna
+"""
+
+import bisect
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select
+
+from database import AnalysisReport, ArchiveFile, ReportRollup
+
+PRICE_BAND_EDGES = [100, 1_000, 10_000, 100_000]  # on price_max_usd
+PRICE_BANDS = ["<$100", "$100–1k", "$1k–10k", "$10k–100k", "$100k+"]
+KEY_COLUMNS = ["day", "mineral_name", "mode"]
+SUM_COLUMNS = {
+    "confidence_sum": "confidence_score",
+    "natural_probability_sum": "natural_probability",
+    "synthetic_probability_sum": "synthetic_probability",
+    "price_min_usd_sum": "price_min_usd",
+    "price_max_usd_sum": "price_max_usd",
+}
+TREATMENT_COLUMNS = {
+    "Natural (Untreated)": "treatment_natural",
+    "Heat Treated": "treatment_heat",
+    "Glass Filled": "treatment_glass_filled",
+    "Beryllium Diffusion": "treatment_diffusion",
+    "Resin Filled": "treatment_resin_filled",
+    "Laser Drilled": "treatment_laser_drilled",
+    "Coated": "treatment_coated",
+    "Synthetic": "treatment_synthetic",
+}
+BAND_COLUMNS = [f"price_band_{i}" for i in range(len(PRICE_BANDS))]
+COUNTER_COLUMNS = ["scans", *SUM_COLUMNS, *TREATMENT_COLUMNS.values(), "treatment_other", *BAND_COLUMNS]
+_SLOT = {name: i for i, name in enumerate(COUNTER_COLUMNS)}
+
+
+def price_band(price_max_usd: Optional[float]) -> Optional[int]:
+    """Index into PRICE_BANDS, or None when the report has no price."""
+    if price_max_usd is None:
+        return None
+    return bisect.bisect_right(PRICE_BAND_EDGES, price_max_usd)
+
+
+def _field(report, name):
+    return report[name] if isinstance(report, dict) else getattr(report, name)
+
+
+def _aggregate(reports: Iterable) -> list:
+    groups = {}
+    for r in reports:
+        created = _field(r, "created_at") or datetime.utcnow()
+        key = (created.date(), _field(r, "mineral_name"), _field(r, "mode"))
+        counters = groups.get(key)
+        if counters is None:
+            counters = groups[key] = [0] * len(COUNTER_COLUMNS)
+        counters[0] += 1
+        for column, source in SUM_COLUMNS.items():
+            counters[_SLOT[column]] += _field(r, source) or 0.0
+        counters[_SLOT[TREATMENT_COLUMNS.get(_field(r, "treatment_type"), "treatment_other")]] += 1
+        band = price_band(_field(r, "price_max_usd"))
+        if band is not None:
+            counters[_SLOT[BAND_COLUMNS[band]]] += 1
+    return [{**dict(zip(KEY_COLUMNS, key)), **dict(zip(COUNTER_COLUMNS, counters))} for key, counters in groups.items()]
+
+
+def record_reports(conn, reports: Iterable) -> int:
+    """
+    Adds reports (AnalysisReport objects or column dicts) to the rollups using
+    `conn` (a Session or Connection), i.e. inside the caller's transaction.
+    Returns the number of rollup rows touched.
+    """
+    rows = _aggregate(reports)
+    if not rows:
+        return 0
+    t = ReportRollup.__table__
+    dialect = conn.get_bind().dialect.name if hasattr(conn, "get_bind") else conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(t)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=KEY_COLUMNS,
+            set_={c: t.c[c] + stmt.excluded[c] for c in COUNTER_COLUMNS},
+        )
+        conn.execute(stmt, rows)
+        return len(rows)
+    # Other databases: read-modify-write per rollup row
+    for row in rows:
+        key = [t.c[c] == row[c] for c in KEY_COLUMNS]
+        updated = conn.execute(t.update().where(*key).values(
+            {c: t.c[c] + row[c] for c in COUNTER_COLUMNS})).rowcount
+        if not updated:
+            conn.execute(t.insert().values(row))
+    return len(rows)
+
+
+def rebuild_rollups(engine, chunk: int = 20_000) -> int:
+    """
+    Recomputes every rollup from analysis_reports and the report archive
+    (one-off backfill). Returns reports counted.
+    """
+    from services.archive import report_archive
+    columns = ["created_at", "mineral_name", "mode", "treatment_type", *SUM_COLUMNS.values()]
+    t = AnalysisReport.__table__
+    counted = 0
+    with engine.begin() as conn:
+        conn.execute(ReportRollup.__table__.delete())
+        result = conn.execution_options(stream_results=True, yield_per=chunk).execute(select(*[t.c[c] for c in columns]))
+        for partition in result.partitions():
+            record_reports(conn, [dict(zip(columns, row)) for row in partition])
+            counted += len(partition)
+        if conn.execute(select(func.count()).select_from(ArchiveFile)).scalar():
+            for rows in report_archive.iter_rows(engine, columns):
+                record_reports(conn, rows)
+                counted += len(rows)
+    return counted
+
+
+def _summary(scans, conf, natural, price_min, price_max) -> dict:
+    scans = int(scans or 0)
+    avg = (lambda total: round(total / scans, 4) if scans and total is not None else None)
+    return {
+        "scans": scans,
+        "avg_confidence": avg(conf),
+        "avg_natural_probability": avg(natural),
+        "avg_price_min_usd": round(price_min / scans, 2) if scans and price_min is not None else None,
+        "avg_price_max_usd": round(price_max / scans, 2) if scans and price_max is not None else None,
+    }
+
+
+def query_stats(db, start: date, end: date, mode: Optional[str] = None, mineral: Optional[str] = None) -> dict:
+    """Dashboard statistics for days in [start, end], answered from the rollups only."""
+    R = ReportRollup
+    measures = [func.sum(R.scans), func.sum(R.confidence_sum), func.sum(R.natural_probability_sum),
+                func.sum(R.price_min_usd_sum), func.sum(R.price_max_usd_sum)]
+    filters = [R.day >= start, R.day <= end]
+    if mode:
+        filters.append(R.mode == mode)
+    if mineral:
+        filters.append(R.mineral_name == mineral)
+
+    def grouped(column):
+        return db.query(column, *measures).filter(*filters).group_by(column).all()
+
+    totals = db.query(*measures, func.count(func.distinct(R.mineral_name)),
+                      *[func.sum(getattr(R, c)) for c in [*TREATMENT_COLUMNS.values(), "treatment_other", *BAND_COLUMNS]]
+                      ).filter(*filters).one()
+    treatment_counts = totals[6:6 + len(TREATMENT_COLUMNS) + 1]
+    band_counts = totals[6 + len(TREATMENT_COLUMNS) + 1:]
+    by_mineral = sorted(grouped(R.mineral_name), key=lambda row: row[1] or 0, reverse=True)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "totals": {**_summary(*totals[:5]), "unique_minerals": totals[5]},
+        "by_day": [{"day": day.isoformat(), **_summary(*m)} for day, *m in sorted(grouped(R.day))],
+        "by_mineral": [{"mineral_name": name, **_summary(*m)} for name, *m in by_mineral],
+        "by_mode": {mode_name: _summary(*m) for mode_name, *m in grouped(R.mode)},
+        "treatments": {name: int(n or 0) for name, n in zip([*TREATMENT_COLUMNS, "Other"], treatment_counts) if n},
+        "price_bands": {band: int(n or 0) for band, n in zip(PRICE_BANDS, band_counts)},
+    }
+
+
+def default_range(days: int) -> tuple:
+    end = datetime.utcnow().date()
+    return end - timedelta(days=days - 1), end
+
+
+if __name__ == "__main__":
+    from database import engine, init_db
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python -m services.rollups rebuild")
+        sys.exit(1)
+    init_db()
+    print(f"Rollups rebuilt from {rebuild_rollups(engine):,} reports.")
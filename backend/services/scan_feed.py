@@ -0,0 +1,306 @@
+"""
+Live scan feed for Cerberus DeepCrystal
+Pushes a summary of every new analysis report to open dashboards over
+Server-Sent Events (GET /api/analysis/feed), instead of each dashboard
+polling /api/analysis/history.
+
+One ScanFeed per worker reads new reports from the database (by id, so scans
+of other workers and batch imports show up too) and publishes each summary
+once: it is encoded a single time and handed to every subscriber's queue.
+The feed is woken right after a local scan commits and otherwise polls every
+FEED_POLL_INTERVAL seconds, so the database sees one small query per worker
+however many dashboards are open.
+
+  - Each poll re-reads the last FEED_POLL_OVERLAP ids below the newest one
+    seen and skips those already in the ring: ids are allocated at insert but
+    visible at commit, so a report can commit after a higher id was
+    published. Such a late report is still published (to reconnecting
+    clients only if their Last-Event-ID is below it).
+  - Event ids are report ids. A reconnecting client sends the last id it saw
+    (Last-Event-ID, which EventSource does by itself) and gets the events it
+    missed from a ring buffer of the last FEED_RING_SIZE summaries; if the
+    gap is older than the ring it gets a "resync" event and reloads history.
+  - Each subscriber has a queue of FEED_BUFFER events. A subscriber that
+    falls that far behind is dropped (its stream ends) rather than letting
+    its backlog grow; it reconnects and resumes from the ring.
+  - Streams end after FEED_MAX_AGE seconds and the client reconnects (with
+    resume), so open dashboards never hold a worker past Gunicorn's graceful
+    shutdown timeout.
+Author: Sudeepa Wanigarathna
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import select
+
+from database import engine, AnalysisReport
+
+FEED_POLL_INTERVAL = float(os.getenv("FEED_POLL_INTERVAL", "1"))
+FEED_RING_SIZE = int(os.getenv("FEED_RING_SIZE", "256"))
+FEED_POLL_OVERLAP = min(int(os.getenv("FEED_POLL_OVERLAP", "64")), FEED_RING_SIZE)  # ids re-read below last_id
+FEED_BUFFER = int(os.getenv("FEED_BUFFER", "64"))
+FEED_HEARTBEAT = float(os.getenv("FEED_HEARTBEAT", "10"))
+FEED_MAX_AGE = float(os.getenv("FEED_MAX_AGE", "25"))
+FEED_RETRY_MS = 1000  # EventSource reconnect delay after a stream ends
+FEED_STOP_TIMEOUT = 5.0  # seconds stop() waits for the poll loop before cancelling it
+
+SUMMARY_COLUMNS = (
+    AnalysisReport.id, AnalysisReport.session_id, AnalysisReport.blockchain_id, AnalysisReport.mineral_name,
+    AnalysisReport.confidence_score, AnalysisReport.natural_probability, AnalysisReport.treatment_type,
+    AnalysisReport.price_min_usd, AnalysisReport.price_max_usd, AnalysisReport.mode, AnalysisReport.created_at,
+)
+
+
+def report_summary(r) -> dict:
+    """Dashboard/history summary of a report (an AnalysisReport or a row of SUMMARY_COLUMNS)."""
+    return {
+        "session_id": r.session_id,
+        "blockchain_id": r.blockchain_id,
+        "mineral_name": r.mineral_name,
+        "confidence_score": r.confidence_score,
+        "natural_probability": r.natural_probability,
+        "treatment_type": r.treatment_type,
+        "price_min_usd": r.price_min_usd,
+        "price_max_usd": r.price_max_usd,
+        "mode": r.mode,
+        "created_at": r.created_at.isoformat()
+    }
+
+
+def sse_frame(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """One Server-Sent Events message."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=FEED_BUFFER)  # (report id or None, frame); None ends the stream
+        self.replay = []  # frames missed before subscribing, sent first
+        self.after = 0  # events up to this id were already delivered (by another worker)
+        self.dropped = False
+
+
+class ScanFeed:
+    def __init__(self):
+        self.ring = deque(maxlen=FEED_RING_SIZE)  # (report id, encoded frame), ascending ids
+        self.floor = 0  # every report with id > floor is in the ring or newer than it
+        self.last_id = 0
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+        self.resumed = 0
+        self.resyncs = 0
+        self.polls = 0
+        self._wake = None
+        self._loop = None
+        self._task = None
+        self._stopping = False
+
+    # ── database side ──
+    @staticmethod
+    def _fetch(after: Optional[int], limit: int) -> list:
+        """Summary rows with id > after, ascending (or the newest `limit` when after is None)."""
+        query = select(*SUMMARY_COLUMNS)
+        if after is None:
+            query = query.order_by(AnalysisReport.id.desc()).limit(limit)
+        else:
+            query = query.where(AnalysisReport.id > after).order_by(AnalysisReport.id).limit(limit)
+        with engine.connect() as conn:
+            rows = conn.execute(query).all()
+        return rows[::-1] if after is None else rows
+
+    def _prime(self, rows: list):
+        """Fills the ring with the newest reports (rows ascending), e.g. at start or after a burst."""
+        self.ring.clear()
+        for row in rows:
+            self.ring.append((row.id, sse_frame("scan", report_summary(row), row.id)))
+        self.floor = rows[0].id - 1 if rows else self.last_id
+        if rows:
+            self.last_id = rows[-1].id
+
+    async def poll(self) -> int:
+        """Publishes reports newer than the last one seen; returns how many."""
+        self.polls += 1
+        after = max(self.floor, self.last_id - FEED_POLL_OVERLAP)
+        rows = await asyncio.to_thread(self._fetch, after, FEED_RING_SIZE + FEED_POLL_OVERLAP + 1)
+        if after < self.last_id:
+            seen = {event_id for event_id, _ in self.ring}
+            rows = [row for row in rows if row.id not in seen]
+        if len(rows) > FEED_RING_SIZE:
+            # A burst (e.g. a batch import) larger than the ring can't be replayed: start over from the newest
+            self._prime(await asyncio.to_thread(self._fetch, None, FEED_RING_SIZE))
+            self.broadcast(None, sse_frame("resync", {"reason": "burst"}, self.last_id))
+            return len(rows)
+        for row in rows:
+            self.publish(row.id, sse_frame("scan", report_summary(row), row.id))
+        return len(rows)
+
+    # ── fan-out ──
+    def publish(self, event_id: int, frame: str):
+        if len(self.ring) == self.ring.maxlen:
+            self.floor = self.ring.popleft()[0]
+        position = len(self.ring)
+        while position and self.ring[position - 1][0] > event_id:  # committed late: keep the ring in id order
+            position -= 1
+        self.ring.insert(position, (event_id, frame))
+        self.last_id = max(self.last_id, event_id)
+        self.published += 1
+        self.broadcast(event_id, frame)
+
+    def broadcast(self, event_id: Optional[int], frame: str):
+        for sub in list(self.subscribers):
+            try:
+                sub.queue.put_nowait((event_id, frame))
+            except asyncio.QueueFull:
+                self._close(sub)
+                sub.dropped = True
+                self.dropped += 1
+
+    def _close(self, sub: Subscriber):
+        """Ends a subscriber's stream (a dropped one resumes from the ring when it reconnects)."""
+        self.subscribers.discard(sub)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait((None, None))
+
+    def subscribe(self, last_event_id: Optional[int] = None, backlog: int = 0) -> Subscriber:
+        """
+        Registers a subscriber. With last_event_id its stream starts with the
+        events after it (or a resync event if they are no longer in the ring);
+        otherwise with the newest `backlog` events.
+        """
+        sub = Subscriber()
+        if last_event_id is not None:
+            if self.last_id < last_event_id <= self.last_id + FEED_RING_SIZE:
+                # Seen on a worker that polled sooner: skip what it already has and catch up now
+                sub.after = last_event_id
+                self.resumed += 1
+                self.notify()
+            elif self.floor <= last_event_id <= self.last_id:
+                sub.replay = [frame for event_id, frame in self.ring if event_id > last_event_id]
+                self.resumed += 1
+            else:
+                sub.replay = [sse_frame("resync", {"reason": "gap"}, self.last_id)]
+                self.resyncs += 1
+        elif backlog > 0:
+            sub.replay = [frame for _, frame in list(self.ring)[-backlog:]]
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self.subscribers.discard(sub)
+
+    async def stream(self, sub: Subscriber):
+        """SSE frames for one subscriber: queued events, heartbeats, until dropped or FEED_MAX_AGE."""
+        deadline = time.monotonic() + FEED_MAX_AGE
+        try:
+            yield f"retry: {FEED_RETRY_MS}\n\n"
+            for frame in sub.replay:
+                yield frame
+            sub.replay = None
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                if sub.queue.empty():
+                    try:
+                        item = await asyncio.wait_for(sub.queue.get(), timeout=min(FEED_HEARTBEAT, remaining))
+                    except asyncio.TimeoutError:
+                        if time.monotonic() < deadline:
+                            yield ": ping\n\n"  # keeps proxies from closing an idle stream
+                        continue
+                    items = [item]
+                else:
+                    items = []
+                while not sub.queue.empty():  # everything already queued goes out as one write
+                    items.append(sub.queue.get_nowait())
+                frames = []
+                for event_id, frame in items:
+                    if frame is None:
+                        if frames:
+                            yield "".join(frames)
+                        return
+                    if event_id is None or event_id > sub.after:
+                        frames.append(frame)
+                if frames:
+                    yield "".join(frames)
+        finally:
+            self.unsubscribe(sub)
+
+    # ── lifecycle ──
+    def notify(self):
+        """Wakes the feed after a transaction holding new reports has committed."""
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+        # Ends on the _stopping flag: wait_for() can swallow a cancel that arrives as the wake event is set
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=FEED_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Scan feed error: {e}")
+
+    async def start(self):
+        """Primes the ring with the newest reports and starts polling (once per process)."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._prime(await asyncio.to_thread(self._fetch, None, FEED_RING_SIZE))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        done, _ = await asyncio.wait({self._task}, timeout=FEED_STOP_TIMEOUT)
+        if not done:
+            self._task.cancel()
+            await asyncio.wait({self._task}, timeout=FEED_STOP_TIMEOUT)
+        for sub in list(self.subscribers):
+            self._close(sub)
+        self._task = self._loop = None
+
+    def status(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "resumed": self.resumed,
+            "resyncs": self.resyncs,
+            "polls": self.polls,
+            "last_id": self.last_id,
+            "ring": len(self.ring),
+            "ring_floor": self.floor,
+            "buffer": FEED_BUFFER,
+            "poll_interval_s": FEED_POLL_INTERVAL,
+        }
+
+
+scan_feed = ScanFeed()
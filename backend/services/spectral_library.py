@@ -0,0 +1,399 @@
+"""
+Spectral reference library for Cerberus DeepCrystal
+Lab-tier scans can carry Raman, FTIR and UV-Vis spectra (uploaded files or
+typed peak positions). Every spectrum, reference or query, is prepared the
+same way: resampled onto a fixed grid per kind (GRID points over the kind's
+range), baseline removed (rolling minimum for Raman and FTIR), L2-normalised,
+and its PEAKS strongest peak positions extracted.
+
+Storage (under SPECTRAL_LIBRARY_DIR, default storage/spectra), per kind:
+  <kind>-<build>.vectors.f32  float32 [N, GRID], rows grouped by mineral, memory-mapped
+  <kind>-<build>.peaks.f32    float32 [N, PEAKS] peak positions (NaN padded)
+  <kind>.json                 the current build's files, mineral per row group,
+                              source of each row, build info
+A build writes new data files and then replaces <kind>.json, the only file a
+reader starts from, so a load sees one whole build. The previous build's files
+are kept for workers that have not reloaded yet; older ones are removed.
+
+A query is scored against the whole library at once: cosine similarity is
+one matrix-vector product over the memmap, and peak-position scoring
+compares every query peak with every reference peak, one query peak at a
+time across all references (Gaussian tolerance per kind, averaged in both directions so missing and
+extra peaks both cost). The best reference per mineral is taken with one
+reduceat over the grouped rows. Minerals are mapped to catalogue gems by
+name (a "Corundum" reference supports every sapphire and ruby) and the
+scores go into the gem ranking as extra logits (see ml_pipeline._fuse).
+
+Build from RRUFF-style two-column files (x, intensity):
+    python -m services.spectral_library build refs/raman/*.txt --kind raman
+Author: Sudeepa Wanigarathna
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+LIBRARY_DIR = os.getenv("SPECTRAL_LIBRARY_DIR", "storage/spectra")
+SPECTRAL_WEIGHT = float(os.getenv("SPECTRAL_WEIGHT", "20"))  # logits per unit of match score
+COSINE_WEIGHT = 0.6  # share of cosine similarity in the match score; the rest is peak positions
+GRID = 1024
+PEAKS = 8
+MIN_POINTS = 8
+
+# range on the grid, unit, peak tolerance (sigma), line width used for typed peak lists and the
+# rolling-minimum baseline window in grid points (0: only the minimum is subtracted; UV-Vis bands
+# are broader than any useful window)
+KINDS = {
+    "raman": {"range": (100.0, 1800.0), "unit": "cm⁻¹", "tolerance": 6.0, "width": 6.0, "baseline": 64},
+    "ftir": {"range": (400.0, 4000.0), "unit": "cm⁻¹", "tolerance": 12.0, "width": 15.0, "baseline": 64},
+    "uv_vis": {"range": (250.0, 900.0), "unit": "nm", "tolerance": 8.0, "width": 15.0, "baseline": 0},
+}
+_STOPWORDS = {"with", "var", "bearing", "and"}
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+class SpectrumError(ValueError):
+    pass
+
+
+def grid(kind: str) -> np.ndarray:
+    lo, hi = KINDS[kind]["range"]
+    return np.linspace(lo, hi, GRID)
+
+
+def find_peaks(vector: np.ndarray, axis: np.ndarray) -> np.ndarray:
+    """Positions of the PEAKS strongest local maxima (above 5% of the maximum), NaN padded."""
+    v = np.convolve(vector, np.ones(3) / 3, mode="same")
+    inner = v[1:-1]
+    idx = np.flatnonzero((inner > v[:-2]) & (inner >= v[2:]) & (inner > 0.05 * v.max())) + 1
+    idx = idx[np.argsort(v[idx])[::-1][:PEAKS]]
+    out = np.full(PEAKS, np.nan, dtype=np.float32)
+    out[:len(idx)] = axis[idx]
+    return out
+
+
+def prepare(kind: str, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(vector [GRID], peaks [PEAKS]) of a measured spectrum: resampled, baseline removed, normalised."""
+    if kind not in KINDS:
+        raise SpectrumError(f"Unknown spectrum kind '{kind}' (expected one of {', '.join(KINDS)})")
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+    order = np.argsort(x)
+    x, y = x[order], y[order]
+    axis = grid(kind)
+    inside = (axis >= x[0]) & (axis <= x[-1]) if len(x) else np.zeros(GRID, dtype=bool)
+    if len(x) < MIN_POINTS or inside.sum() < MIN_POINTS:
+        lo, hi = KINDS[kind]["range"]
+        raise SpectrumError(f"The {kind} spectrum needs at least {MIN_POINTS} points inside {lo:g}–{hi:g} "
+                            f"{KINDS[kind]['unit']}")
+    v = np.interp(axis, x, y)
+    window = KINDS[kind]["baseline"]
+    if window:
+        # Rolling-minimum baseline (fluorescence background, detector offset), smoothed
+        padded = np.pad(v, window // 2, mode="edge")
+        baseline = np.lib.stride_tricks.sliding_window_view(padded, window + 1).min(axis=1)
+        baseline = np.convolve(np.pad(baseline, window // 2, mode="edge"), np.ones(window + 1) / (window + 1),
+                               mode="valid")
+    else:
+        baseline = np.full_like(v, v[inside].min())
+    v = np.where(inside, np.clip(v - np.minimum(baseline, v), 0.0, None), 0.0)
+    norm = np.linalg.norm(v)
+    if norm == 0:
+        raise SpectrumError(f"The {kind} spectrum is flat")
+    v = (v / norm).astype(np.float32)
+    return v, find_peaks(v, axis)
+
+
+def from_peaks(kind: str, positions: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """A spectrum made of Lorentzian lines at typed peak positions (e.g. "418, 378, 750")."""
+    if kind not in KINDS:
+        raise SpectrumError(f"Unknown spectrum kind '{kind}'")
+    lo, hi = KINDS[kind]["range"]
+    positions = [p for p in positions if lo <= p <= hi]
+    if not positions:
+        raise SpectrumError(f"No {kind} peak positions inside {lo:g}–{hi:g} {KINDS[kind]['unit']}")
+    axis = grid(kind)
+    half = KINDS[kind]["width"] / 2
+    v = (1.0 / (1.0 + ((axis[None, :] - np.asarray(positions, dtype=np.float64)[:, None]) / half) ** 2)).sum(axis=0)
+    v = (v / np.linalg.norm(v)).astype(np.float32)
+    peaks = np.full(PEAKS, np.nan, dtype=np.float32)
+    peaks[:min(PEAKS, len(positions))] = positions[:PEAKS]
+    return v, peaks
+
+
+def parse_peaks(text: str) -> List[float]:
+    return [float(m) for m in _NUMBER.findall(text or "")]
+
+
+def parse_spectrum(data: bytes) -> Tuple[np.ndarray, np.ndarray, dict]:
+    """(x, y, header) of a two-column text spectrum (CSV, TSV or whitespace; RRUFF ##KEY=value headers)."""
+    header, xs, ys = {}, [], []
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        line = line.strip()
+        if line.startswith("##"):
+            key, _, value = line[2:].partition("=")
+            header[key.strip().upper()] = value.strip()
+            continue
+        if not line or line.startswith("#"):
+            continue
+        numbers = _NUMBER.findall(line)
+        if len(numbers) >= 2 and not re.match(r"[A-Za-z]", line):
+            xs.append(float(numbers[0]))
+            ys.append(float(numbers[1]))
+    if len(xs) < MIN_POINTS:
+        raise SpectrumError(f"Expected a two-column spectrum (position, intensity) with at least {MIN_POINTS} rows")
+    return np.array(xs), np.array(ys), header
+
+
+def _species(name: str, gem: dict) -> set:
+    """Names a reference may carry to count for a catalogue gem: the gem, its words and its formula's mineral."""
+    words = set(re.findall(r"[a-z]{3,}", name.lower()))
+    for note in re.findall(r"\(([^)]*)\)", gem.get("formula", "")):
+        words |= set(re.findall(r"[a-z]{3,}", note.lower()))
+    return (words - _STOPWORDS) | {name.lower()}
+
+
+class _Shelf:
+    """The references of one kind: memmapped vectors grouped by mineral."""
+
+    def __init__(self, root: str, kind: str):
+        with open(os.path.join(root, f"{kind}.json")) as f:
+            meta = json.load(f)
+        self.kind = kind
+        self.count = meta["count"]
+        self.minerals = meta["minerals"]
+        self.offsets = np.array(meta["offsets"], dtype=np.int64)  # first row of each mineral
+        self.sources = meta["sources"]
+        self.built_at = meta["built_at"]
+        files = meta.get("files") or {"vectors": f"{kind}.vectors.f32", "peaks": f"{kind}.peaks.f32"}  # unversioned builds
+        for name, width in (("vectors", GRID), ("peaks", PEAKS)):
+            size = os.path.getsize(os.path.join(root, files[name]))
+            if size != self.count * width * 4:
+                raise ValueError(f"{files[name]} holds {size} bytes, {kind}.json expects {self.count} rows")
+        self.vectors = np.memmap(os.path.join(root, files["vectors"]), dtype=np.float32, mode="r",
+                                 shape=(self.count, GRID))
+        peaks = np.fromfile(os.path.join(root, files["peaks"]), dtype=np.float32).reshape(self.count, PEAKS)
+        self.ref_peaks = (~np.isnan(peaks)).sum(axis=1)
+        # [PEAKS, N], missing peaks far off the axis: scoring reduces across rows, not along short ones
+        self.peaks_t = np.ascontiguousarray(np.nan_to_num(peaks, nan=-1e4).T)
+
+    def score(self, vector: np.ndarray, peaks: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(score, cosine, peak score) of the query against every reference."""
+        cosine = self.vectors @ vector
+        q = peaks[~np.isnan(peaks)]
+        if len(q) == 0:
+            return cosine, cosine, np.zeros_like(cosine)
+        k = np.float32(-0.5 / KINDS[self.kind]["tolerance"] ** 2)
+        recall = np.zeros(self.count, dtype=np.float32)  # query peaks found in the reference
+        nearest = None  # squared distance of each reference peak to the closest query peak
+        for position in q:
+            d = self.peaks_t - position
+            d *= d
+            recall += np.exp(d.min(axis=0) * k)
+            nearest = d if nearest is None else np.minimum(nearest, d, out=nearest)
+        precision = np.exp(nearest * k).sum(axis=0) / np.maximum(self.ref_peaks, 1)  # reference peaks in the query
+        peak_score = (0.5 * (recall / len(q) + precision)).astype(np.float32)
+        return COSINE_WEIGHT * cosine + (1 - COSINE_WEIGHT) * peak_score, cosine, peak_score
+
+
+class SpectralLibrary:
+    def __init__(self, root: str = LIBRARY_DIR):
+        self.root = root
+        self._shelves: Dict[str, _Shelf] = {}
+        self._gem_maps = {}  # (kind, built_at, catalogue version) -> bool [gems, minerals]
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.matches = 0
+        self._recent_ms = deque(maxlen=1024)
+
+    def load(self):
+        shelves = {}
+        for kind in KINDS:
+            if os.path.exists(os.path.join(self.root, f"{kind}.json")):
+                shelves[kind] = _Shelf(self.root, kind)
+        with self._lock:
+            self._shelves, self._gem_maps, self._loaded = shelves, {}, True
+        return self.status()
+
+    def _shelf(self, kind: str) -> Optional[_Shelf]:
+        if not self._loaded:
+            self.load()
+        return self._shelves.get(kind)
+
+    # ── building ──
+    def build(self, records: Iterable[tuple]) -> dict:
+        """
+        Writes the library from (kind, mineral, source, x, y) records, replacing
+        the kinds present. Spectra that cannot be prepared are skipped and listed.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        prepared: Dict[str, list] = {}
+        errors = []
+        for kind, mineral, source, x, y in records:
+            try:
+                vector, peaks = prepare(kind, x, y)
+            except SpectrumError as e:
+                errors.append({"source": source, "error": str(e)})
+                continue
+            prepared.setdefault(kind, []).append((mineral.strip(), source, vector, peaks))
+        for kind, rows in prepared.items():
+            rows.sort(key=lambda r: r[0].lower())
+            names = [r[0].lower() for r in rows]
+            starts = [i for i in range(len(rows)) if i == 0 or names[i] != names[i - 1]]
+            built_at = time.time()
+            build = f"{kind}-{int(built_at * 1000)}"
+            files = {"vectors": build + ".vectors.f32", "peaks": build + ".peaks.f32"}
+            np.stack([r[2] for r in rows]).tofile(os.path.join(self.root, files["vectors"]))
+            np.stack([r[3] for r in rows]).tofile(os.path.join(self.root, files["peaks"]))
+            meta = {"kind": kind, "count": len(rows), "grid": [*KINDS[kind]["range"], GRID], "files": files,
+                    "minerals": [rows[i][0] for i in starts], "offsets": starts,
+                    "sources": [r[1] for r in rows], "built_at": built_at}
+            pointer = os.path.join(self.root, kind + ".json")
+            previous = _build_files(pointer, kind)
+            with open(pointer + ".tmp", "w") as f:
+                json.dump(meta, f)
+            os.replace(pointer + ".tmp", pointer)  # the swap: readers get the new build or the old one
+            keep = set(files.values()) | previous
+            for path in glob.glob(os.path.join(self.root, f"{kind}[.-]*.f32")):
+                if os.path.basename(path) not in keep:
+                    os.remove(path)
+        self.load()
+        return {"references": {kind: len(rows) for kind, rows in prepared.items()}, "errors": errors}
+
+    # ── matching ──
+    def _gem_map(self, shelf: _Shelf, catalogue) -> np.ndarray:
+        key = (shelf.kind, shelf.built_at, catalogue.version)
+        mapping = self._gem_maps.get(key)
+        if mapping is None:
+            species = [_species(name, catalogue.gem_data[name]) for name in catalogue.gem_names]
+            minerals = [m.lower() for m in shelf.minerals]
+            mapping = np.array([[m in s for m in minerals] for s in species], dtype=bool)
+            self._gem_maps[key] = mapping
+        return mapping
+
+    def match(self, spectra: Dict[str, tuple], catalogue, top: int = 5) -> dict:
+        """
+        Scores the scan's spectra ({kind: (vector, peaks)}) against the library.
+        Returns the best matching minerals per kind and per-gem logits for the
+        catalogue (None when no reference maps to any gem).
+        """
+        start = time.perf_counter()
+        matches, logits = [], np.zeros(len(catalogue.gem_names), dtype=np.float32)
+        informative = False
+        for kind, (vector, peaks) in sorted(spectra.items()):
+            shelf = self._shelf(kind)
+            if shelf is None or shelf.count == 0:
+                continue
+            score, cosine, peak_score = shelf.score(vector, peaks)
+            best = np.maximum.reduceat(score, shelf.offsets)  # best reference per mineral
+            ends = np.append(shelf.offsets[1:], shelf.count)
+            mapping = self._gem_map(shelf, catalogue)
+            for m in np.argsort(best)[::-1][:top]:
+                row = shelf.offsets[m] + int(np.argmax(score[shelf.offsets[m]:ends[m]]))
+                matches.append({
+                    "kind": kind, "mineral": shelf.minerals[m], "source": shelf.sources[row],
+                    "score": round(float(best[m]), 4), "cosine": round(float(cosine[row]), 4),
+                    "peak_score": round(float(peak_score[row]), 4),
+                    "gems": [catalogue.gem_names[g] for g in np.flatnonzero(mapping[:, m])],
+                })
+            gem_best = np.where(mapping, best[None, :], -np.inf).max(axis=1)  # [gems]
+            known = np.isfinite(gem_best)
+            if known.any():
+                informative = True
+                # Gems without a reference of this kind are neither supported nor ruled out
+                gem_best[~known] = np.median(gem_best[known])
+                logits += (SPECTRAL_WEIGHT * (gem_best - gem_best.max())).astype(np.float32)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.matches += 1
+            self._recent_ms.append(elapsed)
+        return {"matches": matches, "logits": logits if informative else None, "ms": round(elapsed, 3)}
+
+    def status(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent_ms)
+            shelves = dict(self._shelves)
+        return {
+            "root": self.root,
+            "kinds": {kind: {"references": s.count, "minerals": len(s.minerals),
+                             "bytes": s.count * GRID * 4, "built_at": s.built_at} for kind, s in shelves.items()},
+            "grid": GRID, "weight": SPECTRAL_WEIGHT,
+            "matches": self.matches,
+            "p50_ms": round(recent[len(recent) // 2], 3) if recent else None,
+            "p99_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 3) if recent else None,
+        }
+
+
+def _build_files(pointer: str, kind: str) -> set:
+    """Data files the <kind>.json at `pointer` refers to (empty if there is none)."""
+    if not os.path.exists(pointer):
+        return set()
+    with open(pointer) as f:
+        files = json.load(f).get("files") or {"vectors": f"{kind}.vectors.f32", "peaks": f"{kind}.peaks.f32"}
+    return set(files.values())
+
+
+spectral_library = SpectralLibrary()
+
+
+def _kind_from_name(path: str) -> Optional[str]:
+    name = os.path.basename(path).lower()
+    for token, kind in (("raman", "raman"), ("infrared", "ftir"), ("ftir", "ftir"), ("uv", "uv_vis")):
+        if token in name:
+            return kind
+    return None
+
+
+def read_files(paths: List[str], kind: Optional[str]):
+    """(kind, mineral, source, x, y) per file; the mineral is the RRUFF ##NAMES= header or the file name."""
+    for path in paths:
+        with open(path, "rb") as f:
+            try:
+                x, y, header = parse_spectrum(f.read())
+            except SpectrumError as e:
+                print(f"  skipped {path}: {e}")
+                continue
+        stem = os.path.splitext(os.path.basename(path))[0]
+        mineral = header.get("NAMES") or stem.split("__")[0].replace("_", " ")
+        yield kind or _kind_from_name(path) or "raman", mineral, header.get("RRUFFID") or stem, x, y
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m services.spectral_library", description=__doc__.split("\n")[1])
+    sub = p.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="Build the library from reference spectra files")
+    b.add_argument("paths", nargs="+", help="Files or directories of two-column spectra")
+    b.add_argument("--kind", choices=list(KINDS), help="Spectrum kind (default: from the file name, else raman)")
+    b.add_argument("--root", default=LIBRARY_DIR)
+    sub.add_parser("status", help="References per kind").add_argument("--root", default=LIBRARY_DIR)
+    args = p.parse_args(argv)
+
+    library = SpectralLibrary(args.root)
+    if args.command == "status":
+        print(json.dumps(library.load(), indent=2))
+        return 0
+    paths = []
+    for path in args.paths:
+        paths += sorted(glob.glob(os.path.join(path, "**", "*.*"), recursive=True)) if os.path.isdir(path) else [path]
+    started = time.perf_counter()
+    result = library.build(read_files(paths, args.kind))
+    for kind, n in result["references"].items():
+        print(f"  {kind}: {n} references, {len(library._shelves[kind].minerals)} minerals")
+    for error in result["errors"]:
+        print(f"  skipped {error['source']}: {error['error']}")
+    print(f"Built in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
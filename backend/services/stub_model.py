@@ -0,0 +1,98 @@
+"""
+Offline stub vision model for Cerberus DeepCrystal
+Drop-in stand-in for the HuggingFace CLIP model/processor pair used by the
+ML pipeline. It needs no network access or downloaded weights, is fully
+deterministic for a given image, and costs a few milliseconds per scan, which
+makes it suitable for load tests, benchmarks and CI boxes.
+
+Enable with DEEPCRYSTAL_MODEL=stub.
+Author: Sudeepa Wanigarathna
+"""
+
+import hashlib
+import numpy as np
+import torch
+from PIL import Image
+
+EMBED_DIM = 512
+IMAGE_SIZE = 224
+_POOL = 8
+_VOCAB = 4096
+_TOKENS = 8
+
+# CLIP preprocessing constants (openai/clip-vit-base-patch32)
+_MEAN = torch.tensor([0.48145466, 0.4578275, 0.40821073]).view(3, 1, 1)
+_STD = torch.tensor([0.26862954, 0.26130258, 0.27577711]).view(3, 1, 1)
+
+
+class _StubOutput:
+    def __init__(self, logits_per_image, image_embeds, text_embeds):
+        self.logits_per_image = logits_per_image
+        self.logits_per_text = logits_per_image.t()
+        self.image_embeds = image_embeds
+        self.text_embeds = text_embeds
+
+
+class StubCLIPProcessor:
+    """Mimics CLIPProcessor: resize + centre crop + normalise, hashed text tokens."""
+
+    def _preprocess(self, image) -> torch.Tensor:
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        image = image.convert("RGB")
+        w, h = image.size
+        scale = IMAGE_SIZE / min(w, h)
+        image = image.resize((max(IMAGE_SIZE, round(w * scale)), max(IMAGE_SIZE, round(h * scale))), Image.BICUBIC)
+        w, h = image.size
+        left, top = (w - IMAGE_SIZE) // 2, (h - IMAGE_SIZE) // 2
+        image = image.crop((left, top, left + IMAGE_SIZE, top + IMAGE_SIZE))
+        arr = torch.from_numpy(np.asarray(image, dtype=np.float32) / 255.0).permute(2, 0, 1)
+        return (arr - _MEAN) / _STD
+
+    def _tokenize(self, text: str) -> list:
+        digest = hashlib.blake2b(text.encode(), digest_size=_TOKENS * 2).digest()
+        return [int.from_bytes(digest[i:i + 2], "little") % _VOCAB for i in range(0, _TOKENS * 2, 2)]
+
+    def __call__(self, text=None, images=None, return_tensors="pt", padding=True, **kwargs):
+        out = {}
+        if text is not None:
+            texts = [text] if isinstance(text, str) else list(text)
+            out["input_ids"] = torch.tensor([self._tokenize(t) for t in texts], dtype=torch.long)
+            out["attention_mask"] = torch.ones_like(out["input_ids"])
+        if images is not None:
+            imgs = images if isinstance(images, (list, tuple)) else [images]
+            out["pixel_values"] = torch.stack([self._preprocess(im) for im in imgs])
+        return out
+
+
+class StubCLIPModel(torch.nn.Module):
+    """
+    Mimics the parts of CLIPModel used by the pipeline.
+    Image features are a fixed random projection of an 8x8 colour pooling of the
+    input; text features are a fixed random bag-of-hashed-tokens embedding.
+    """
+
+    def __init__(self, seed: int = 1337):
+        super().__init__()
+        gen = torch.Generator().manual_seed(seed)
+        self.image_projection = torch.nn.Parameter(
+            torch.randn(3 * _POOL * _POOL, EMBED_DIM, generator=gen), requires_grad=False)
+        self.token_embedding = torch.nn.Parameter(
+            torch.randn(_VOCAB, EMBED_DIM, generator=gen), requires_grad=False)
+        self.logit_scale = torch.nn.Parameter(torch.tensor(np.log(100.0), dtype=torch.float32), requires_grad=False)
+        self.eval()
+
+    def get_image_features(self, pixel_values=None, **kwargs):
+        pooled = torch.nn.functional.adaptive_avg_pool2d(pixel_values, _POOL).flatten(1)
+        return pooled @ self.image_projection
+
+    def get_text_features(self, input_ids=None, attention_mask=None, **kwargs):
+        return self.token_embedding[input_ids].mean(dim=1)
+
+    def forward(self, input_ids=None, attention_mask=None, pixel_values=None, **kwargs):
+        image_embeds = self.get_image_features(pixel_values=pixel_values)
+        text_embeds = self.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+        image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
+        text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
+        logits_per_image = self.logit_scale.exp() * image_embeds @ text_embeds.t()
+        return _StubOutput(logits_per_image, image_embeds, text_embeds)
@@ -0,0 +1,266 @@
+"""
+Valuation engine for Cerberus DeepCrystal
+Prices stones from their catalogue entry's per-carat price range (price_min /
+price_max in USD), scaled by carat weight (carat ** 1.5: larger stones are
+disproportionately rarer), a treatment factor and the natural probability.
+Scans (quote) and parcels (value_parcel, POST /api/analysis/valuate) go
+through the same vectorized price(); a parcel of any size is priced with a
+handful of NumPy operations. The prices differ in one respect: a scan report
+also applies the pipeline's per-scan market spread (a factor of 0.7-1.3 drawn
+from the scan's seeded generator, upper bound only), while a parcel is priced
+without one. The lower bounds agree; quote(..., spread=1.0) matches a parcel
+stone exactly.
+
+Local currencies come from RATES_FILE (data/exchange_rates.json), units per
+USD:
+
+    {"base": "USD", "as_of": "2025-06-30", "rates": {"LKR": 308.0, "EUR": 0.92, ...}}
+
+The table is cached in memory and re-read when the file changes (checked at
+most every RATES_CHECK_INTERVAL seconds) or on POST /api/admin/rates/reload.
+Without the file only USD and LKR are available.
+Author: Sudeepa Wanigarathna
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Sequence
+
+import numpy as np
+
+from services.rollups import PRICE_BAND_EDGES, PRICE_BANDS
+
+RATES_FILE = os.getenv("RATES_FILE", "data/exchange_rates.json")
+RATES_CHECK_INTERVAL = float(os.getenv("RATES_CHECK_INTERVAL", "60"))
+LOCAL_CURRENCY = os.getenv("VALUATION_LOCAL_CURRENCY", "LKR")  # currency_local of scan reports
+VALUATION_MAX_STONES = int(os.getenv("VALUATION_MAX_STONES", "100000"))
+VALUATION_MAX_CARAT = float(os.getenv("VALUATION_MAX_CARAT", "100000"))  # per stone; keeps carat ** 1.5 finite
+CARAT_EXPONENT = 1.5
+BUILTIN_RATES = {"USD": 1.0, "LKR": 308.0}
+
+TREATMENT_FACTORS = {
+    "Natural (Untreated)": 1.0,
+    "Heat Treated": 0.80,
+    "Beryllium Diffusion": 0.70,
+    "Coated": 0.60,
+    "Glass Filled": 0.40,
+    "Fracture Filling": 0.40,
+    "Resin Filled": 0.40,
+    "Laser Drilled": 0.40,
+    "Synthetic": 0.05,
+}
+# treatment_probs keys of a scan report, so parcels can be built from exported reports
+TREATMENT_ALIASES = {
+    "natural": "Natural (Untreated)", "untreated": "Natural (Untreated)", "heat_treated": "Heat Treated",
+    "diffusion_treated": "Beryllium Diffusion", "coated": "Coated", "glass_filled": "Glass Filled",
+    "fracture_filling": "Fracture Filling", "resin_filled": "Resin Filled", "laser_drilled": "Laser Drilled",
+    "synthetic": "Synthetic",
+}
+_TREATMENT_NAMES = list(TREATMENT_FACTORS)
+_TREATMENT_INDEX = {**{name.lower(): i for i, name in enumerate(_TREATMENT_NAMES)},
+                    **{alias: _TREATMENT_NAMES.index(name) for alias, name in TREATMENT_ALIASES.items()}}
+_FACTOR_ARRAY = np.array(list(TREATMENT_FACTORS.values()))
+
+
+class ValuationError(ValueError):
+    pass
+
+
+class RateTable:
+    """Exchange rates (units per USD), cached and re-read when RATES_FILE changes."""
+
+    def __init__(self, path: str = RATES_FILE, check_interval: float = RATES_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._table = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> dict:
+        table = self._table
+        if table is None or time.monotonic() - self._checked >= self.check_interval:
+            with self._lock:
+                self._checked = time.monotonic()
+                mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+                if self._table is None or mtime != self._mtime:
+                    self._load(mtime)
+            table = self._table
+        return table
+
+    def _load(self, mtime, strict: bool = False):
+        """Caller holds _lock. A broken file keeps the previous table (and raises when strict)."""
+        try:
+            if mtime is None:
+                table = {"base": "USD", "as_of": None, "source": "built-in", "rates": dict(BUILTIN_RATES)}
+            else:
+                with open(self.path, encoding="utf-8") as f:
+                    document = json.load(f)
+                if document.get("base", "USD") != "USD":
+                    raise ValuationError("rates must be quoted per USD")
+                rates = {code.upper(): float(rate) for code, rate in document["rates"].items()}
+                if any(not rate > 0 for rate in rates.values()):
+                    raise ValuationError("rates must be positive")
+                table = {"base": "USD", "as_of": document.get("as_of"), "source": self.path,
+                         "rates": {"USD": 1.0, **rates}}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            if strict or self._table is None:
+                raise
+            print(f"Exchange rates not reloaded from {self.path}: {e}")
+            return
+        self._table, self._mtime = table, mtime
+        self.reloads += 1
+
+    def reload(self) -> dict:
+        with self._lock:
+            self._checked = time.monotonic()
+            self._load(os.path.getmtime(self.path) if os.path.exists(self.path) else None, strict=True)
+        return self.status()
+
+    def rate(self, currency: str) -> tuple:
+        """(units per USD, table) for a currency code."""
+        table = self.get()
+        rate = table["rates"].get(currency.upper())
+        if rate is None:
+            raise ValuationError(f"Unknown currency '{currency}'. Available: {', '.join(sorted(table['rates']))}")
+        return rate, table
+
+    def status(self) -> dict:
+        table = self.get()
+        return {"base": table["base"], "as_of": table["as_of"], "source": table["source"],
+                "currencies": len(table["rates"]), "rates": table["rates"], "reloads": self.reloads}
+
+
+rates = RateTable()
+
+
+def treatment_index(treatments: Sequence[str]) -> np.ndarray:
+    """Index into TREATMENT_FACTORS for each treatment name (display names or treatment_probs keys)."""
+    names, inverse = np.unique(np.asarray(treatments, dtype=object), return_inverse=True)
+    lookup = [_TREATMENT_INDEX.get(str(name).strip().lower()) for name in names]
+    unknown = [str(name) for name, i in zip(names, lookup) if i is None]
+    if unknown:
+        raise ValuationError(f"Unknown treatment(s): {', '.join(unknown[:10])}. "
+                             f"Known: {', '.join(_TREATMENT_NAMES)}")
+    return np.asarray(lookup, dtype=np.int64)[inverse.reshape(-1)]
+
+
+def round2(values: np.ndarray) -> np.ndarray:
+    """Rounds exactly like Python's round(x, 2); np.round alone can differ when x * 100 lands near .5."""
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 100
+    rounded = np.rint(scaled) / 100
+    tie = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    if len(tie):
+        rounded[tie] = [round(v, 2) for v in values[tie].tolist()]
+    return rounded
+
+
+def price(base_min, base_max, carats, treatment_factors, natural_probs, spread=1.0) -> tuple:
+    """USD (min, max) arrays, rounded to cents. All arguments broadcast; spread scales the max only."""
+    carat_factor = np.asarray(carats, dtype=np.float64) ** CARAT_EXPONENT
+    price_min = np.asarray(base_min, dtype=np.float64) * treatment_factors * carat_factor * natural_probs
+    price_max = np.asarray(base_max, dtype=np.float64) * treatment_factors * carat_factor * natural_probs * spread
+    return round2(np.atleast_1d(price_min)), round2(np.atleast_1d(price_max))
+
+
+def quote(gem: dict, carat: float, treatment: str, natural_prob: float, spread: float = 1.0,
+          currency: str = LOCAL_CURRENCY) -> dict:
+    """Price of one scanned stone (the scan report's price block); spread=1.0 gives the parcel price."""
+    factor = float(_FACTOR_ARRAY[treatment_index([treatment])[0]])
+    price_min, price_max = price(gem["price_min"], gem["price_max"], carat, factor, natural_prob, spread)
+    rate, _ = rates.rate(currency)
+    min_usd, max_usd = float(price_min[0]), float(price_max[0])
+    return {
+        "min_usd": min_usd, "max_usd": max_usd,
+        "min_local": round(min_usd * rate, 2), "max_local": round(max_usd * rate, 2),
+        "currency_local": currency.upper(), "per_carat": True,
+        "factors": [
+            f"Carat weight: {carat:.2f} ct",
+            f"Treatment factor: {factor:.0%}",
+            f"Natural probability: {natural_prob:.0%}",
+            f"Dominant treatment: {treatment}",
+        ],
+    }
+
+
+def value_parcel(gem_data: dict, gems: Sequence[str], carats: Sequence[float], treatments: Sequence[str],
+                 natural_probs: Sequence[float], currency: str = LOCAL_CURRENCY,
+                 include_stones: bool = True) -> dict:
+    """Prices a lot of stones (parallel columns) and summarises it: totals, price bands, per gem and treatment."""
+    n = len(gems)
+    if not n:
+        raise ValuationError("The parcel has no stones.")
+    if n > VALUATION_MAX_STONES:
+        raise ValuationError(f"At most {VALUATION_MAX_STONES} stones can be valued per request.")
+    if not len(carats) == len(treatments) == len(natural_probs) == n:
+        raise ValuationError("gems, carats, treatments and natural probabilities must have the same length.")
+    carats = np.asarray(carats, dtype=np.float64)
+    natural_probs = np.asarray(natural_probs, dtype=np.float64)
+    bad = np.flatnonzero(~(np.isfinite(carats) & (carats > 0) & (carats <= VALUATION_MAX_CARAT)))
+    if len(bad):
+        raise ValuationError(f"Carat weight must be positive and at most {VALUATION_MAX_CARAT:g} ct "
+                             f"(stones {', '.join(map(str, bad[:10].tolist()))}).")
+    bad = np.flatnonzero(~((natural_probs >= 0) & (natural_probs <= 1)))
+    if len(bad):
+        raise ValuationError(f"Natural probability must be between 0 and 1 (stones {', '.join(map(str, bad[:10].tolist()))}).")
+
+    gem_names, gem_idx = np.unique(np.asarray(gems, dtype=object), return_inverse=True)
+    gem_idx = gem_idx.reshape(-1)
+    unknown = [str(g) for g in gem_names if g not in gem_data]
+    if unknown:
+        raise ValuationError(f"Unknown gem(s): {', '.join(unknown[:10])}")
+    base_min = np.array([gem_data[g]["price_min"] for g in gem_names], dtype=np.float64)[gem_idx]
+    base_max = np.array([gem_data[g]["price_max"] for g in gem_names], dtype=np.float64)[gem_idx]
+    t_idx = treatment_index(treatments)
+
+    rate, table = rates.rate(currency)
+    min_usd, max_usd = price(base_min, base_max, carats, _FACTOR_ARRAY[t_idx], natural_probs)
+    min_local, max_local = round2(min_usd * rate), round2(max_usd * rate)
+    mid_usd = (min_usd + max_usd) / 2
+    total_max = float(max_usd.sum())
+    if not np.isfinite(total_max * rate):  # extreme catalogue prices or rates; JSON cannot carry inf
+        raise ValuationError("The parcel's value is too large to compute.")
+
+    def groups(names, idx):
+        count = np.bincount(idx, minlength=len(names))
+        sums = [np.bincount(idx, weights=w, minlength=len(names)) for w in (carats, min_usd, max_usd)]
+        rows = [{"stones": int(count[i]), "carats": round(float(sums[0][i]), 3),
+                 "min_usd": round(float(sums[1][i]), 2), "max_usd": round(float(sums[2][i]), 2),
+                 "share_of_max": round(float(sums[2][i]) / total_max, 4) if total_max else 0.0}
+                for i in range(len(names))]
+        return sorted(({"name": str(name), **row} for name, row in zip(names, rows) if row["stones"]),
+                      key=lambda r: r["max_usd"], reverse=True)
+
+    bands = np.bincount(np.searchsorted(PRICE_BAND_EDGES, max_usd, side="right"), minlength=len(PRICE_BANDS))
+    p10, p50, p90 = np.percentile(mid_usd, [10, 50, 90])
+    result = {
+        "currency": currency.upper(),
+        "rate": rate,
+        "rates_as_of": table["as_of"],
+        "stones": n,
+        "carats": round(float(carats.sum()), 3),
+        "totals": {
+            "min_usd": round(float(min_usd.sum()), 2), "max_usd": round(total_max, 2),
+            "min_local": round(float(min_local.sum()), 2), "max_local": round(float(max_local.sum()), 2),
+        },
+        "distribution": {
+            "mid_usd": {"mean": round(float(mid_usd.mean()), 2), "p10": round(float(p10), 2),
+                        "p50": round(float(p50), 2), "p90": round(float(p90), 2),
+                        "max": round(float(mid_usd.max()), 2)},
+            "price_bands": dict(zip(PRICE_BANDS, bands.tolist())),
+        },
+        "by_gem": groups(gem_names, gem_idx),
+        "by_treatment": groups(_TREATMENT_NAMES, t_idx),
+    }
+    if include_stones:
+        result["items"] = [
+            {"gem": g, "carat": c, "treatment": _TREATMENT_NAMES[t], "min_usd": a, "max_usd": b,
+             "min_local": la, "max_local": lb}
+            for g, c, t, a, b, la, lb in zip(gems, carats.tolist(), t_idx.tolist(), min_usd.tolist(),
+                                             max_usd.tolist(), min_local.tolist(), max_local.tolist())
+        ]
+    return result
@@ -0,0 +1,331 @@
+"""
+Webhook notifications for Cerberus DeepCrystal
+Clients (X-Client-Id) subscribe a URL to events; "scan.completed" is raised by
+every scan and "batch.completed" by the offline batch analyzer.
+
+Delivery uses a transactional outbox: enqueue() looks up the client's
+subscriptions and adds one webhook_outbox row per match in the caller's
+transaction (the same commit as the report), so the scan itself never waits
+on the network and an event can't be lost between "report saved" and
+"notification sent". A dispatcher task in each worker then:
+
+  - claims due rows with a short lease (safe with several workers/nodes)
+  - POSTs them through one pooled, keep-alive httpx.AsyncClient, at most
+    WEBHOOK_HOST_CONCURRENCY requests in flight per destination host
+  - signs the body: X-DeepCrystal-Signature: sha256=HMAC(secret, body)
+  - marks 2xx as delivered; anything else (including a bad URL or a
+    destination that fails the address check) is retried with exponential
+    backoff and jitter (WEBHOOK_BACKOFF_BASE doubling up to
+    WEBHOOK_BACKOFF_MAX) and gives up after WEBHOOK_MAX_ATTEMPTS
+
+Webhook URLs must resolve to public addresses only: loopback, private,
+link-local (cloud metadata), multicast and reserved addresses are refused when
+subscribing and checked again before each delivery (the host's addresses are
+re-resolved at most every DESTINATION_CHECK_TTL seconds), and redirects are
+not followed. WEBHOOK_ALLOW_PRIVATE=1 lifts this for development.
+
+The dispatcher is woken right after a local scan commits and otherwise polls
+every WEBHOOK_POLL_INTERVAL seconds (retries, other workers, batch jobs).
+stats() reports backlog, throughput and delivery lag (event created ->
+delivered).
+Author: Sudeepa Wanigarathna
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import secrets
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import func, select
+
+from database import engine, WebhookOutbox, WebhookSubscription
+
+WEBHOOK_EVENTS = ("scan.completed", "batch.completed")
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1"))
+WEBHOOK_BATCH = int(os.getenv("WEBHOOK_BATCH", "200"))
+WEBHOOK_HOST_CONCURRENCY = int(os.getenv("WEBHOOK_HOST_CONCURRENCY", "8"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "2"))
+WEBHOOK_BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", "3600"))
+WEBHOOK_LEASE = 2 * WEBHOOK_TIMEOUT + 5  # a claimed row is retried if its worker dies mid-delivery
+WEBHOOK_STOP_TIMEOUT = 5.0  # seconds stop() lets a batch in flight finish; unfinished rows are retried after their lease
+WEBHOOK_ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "0") == "1"
+DESTINATION_CHECK_TTL = 60.0
+
+
+class UnsafeDestination(ValueError):
+    """A webhook URL that is malformed or resolves to a non-public address."""
+
+
+def _check_addresses(host: str, infos: list):
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise UnsafeDestination(f"Webhook host '{host}' resolves to a non-public address ({address}).")
+
+
+def _split(url: str) -> tuple:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeDestination("Webhook URL must be an absolute http(s) URL.")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise UnsafeDestination("Webhook URL has an invalid port.")
+    return parts.hostname, port
+
+
+def check_destination(url: str):
+    """Raises UnsafeDestination unless `url` is http(s) and its host resolves to public addresses only."""
+    host, port = _split(url)
+    if WEBHOOK_ALLOW_PRIVATE:
+        return
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise UnsafeDestination(f"Webhook host '{host}' does not resolve: {e}")
+    _check_addresses(host, infos)
+
+
+def sign(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before retry number `attempts` (1-based), with +-50% jitter."""
+    return min(WEBHOOK_BACKOFF_MAX, WEBHOOK_BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+
+class WebhookDispatcher:
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.in_flight = 0
+        self._lags = deque(maxlen=2000)  # seconds from event creation to delivery
+        self._delivered_at = deque(maxlen=10000)  # monotonic timestamps, for throughput
+        self._checked_hosts = {}  # (host, port) -> monotonic time its addresses last passed the check
+        self._wake = None
+        self._loop = None
+        self._task = None
+        self._stopping = False
+        self._client = None
+        self._host_limits = {}
+
+    # ── subscriptions ──
+    def subscribe(self, db, client_id: str, url: str, events: Optional[list] = None) -> WebhookSubscription:
+        """Raises UnsafeDestination for URLs that fail check_destination."""
+        check_destination(url)
+        subscription = WebhookSubscription(client_id=client_id, url=url, secret=secrets.token_hex(24),
+                                           events=list(events or WEBHOOK_EVENTS), active=True)
+        db.add(subscription)
+        db.commit()
+        db.refresh(subscription)
+        return subscription
+
+    def unsubscribe(self, db, client_id: str, subscription_id: int) -> bool:
+        subscription = db.query(WebhookSubscription).filter_by(id=subscription_id, client_id=client_id).first()
+        if subscription is None:
+            return False
+        subscription.active = False
+        db.commit()
+        return True
+
+    # ── producer side ──
+    def enqueue(self, conn, client_id: str, event: str, payload: dict) -> int:
+        """
+        Adds outbox rows for the client's subscriptions to `conn` (a Session or
+        Connection) without committing. The subscriptions are read in the same
+        transaction (an indexed lookup by client id), so a subscription made on
+        any worker applies from the next scan.
+        """
+        t = WebhookSubscription.__table__
+        rows = conn.execute(select(t.c.id, t.c.events).where(t.c.client_id == client_id, t.c.active.is_(True))).all()
+        targets = [sub_id for sub_id, events in rows if event in (events or WEBHOOK_EVENTS)]
+        if not targets:
+            return 0
+        body = {"event": event, "client_id": client_id, "data": payload}
+        now = datetime.utcnow()
+        rows = [{"subscription_id": sub_id, "event": event, "payload": body, "status": "pending", "attempts": 0,
+                 "next_attempt_at": now, "created_at": now} for sub_id in targets]
+        conn.execute(WebhookOutbox.__table__.insert(), rows)
+        return len(rows)
+
+    def notify(self):
+        """Wakes the dispatcher after the transaction holding new events has committed."""
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # ── dispatcher ──
+    def _claim(self) -> list:
+        """Leases up to WEBHOOK_BATCH due rows to this worker and returns them with their subscription."""
+        o, s = WebhookOutbox.__table__, WebhookSubscription.__table__
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            due = select(o.c.id).where(o.c.status == "pending", o.c.next_attempt_at <= now) \
+                .order_by(o.c.next_attempt_at).limit(WEBHOOK_BATCH)
+            if conn.dialect.name == "postgresql":
+                due = due.with_for_update(skip_locked=True)
+            ids = [row[0] for row in conn.execute(due)]
+            if not ids:
+                return []
+            conn.execute(o.update().where(o.c.id.in_(ids), o.c.status == "pending", o.c.next_attempt_at <= now)
+                         .values(lease_owner=self.worker_id, next_attempt_at=now + timedelta(seconds=WEBHOOK_LEASE)))
+            return conn.execute(
+                select(o.c.id, o.c.event, o.c.payload, o.c.attempts, o.c.created_at, s.c.url, s.c.secret, s.c.active)
+                .join(s, s.c.id == o.c.subscription_id)
+                .where(o.c.id.in_(ids), o.c.lease_owner == self.worker_id)).all()
+
+    def _record(self, outcomes: list):
+        """Writes delivery outcomes [(id, status, attempts, next_attempt_at, error, delivered_at)] in one transaction."""
+        o = WebhookOutbox.__table__
+        with engine.begin() as conn:
+            for row_id, status, attempts, next_at, error, delivered_at in outcomes:
+                conn.execute(o.update().where(o.c.id == row_id).values(
+                    status=status, attempts=attempts, next_attempt_at=next_at, last_error=error,
+                    delivered_at=delivered_at, lease_owner=None))
+
+    async def _check_host(self, url: str):
+        """check_destination at delivery time (DNS may have changed since subscribing), cached per host."""
+        host, port = _split(url)
+        if WEBHOOK_ALLOW_PRIVATE or time.monotonic() - self._checked_hosts.get((host, port), -DESTINATION_CHECK_TTL) \
+                < DESTINATION_CHECK_TTL:
+            return
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise UnsafeDestination(f"Webhook host '{host}' does not resolve: {e}")
+        _check_addresses(host, infos)
+        self._checked_hosts[(host, port)] = time.monotonic()
+
+    async def _deliver(self, row) -> tuple:
+        attempts = row.attempts + 1
+        if not row.active:
+            return row.id, "cancelled", row.attempts, None, "subscription removed", None
+        body = json.dumps({**row.payload, "delivery_id": row.id, "created_at": row.created_at.isoformat()},
+                          ensure_ascii=False, default=str).encode()
+        headers = {"Content-Type": "application/json", "X-DeepCrystal-Event": row.event,
+                   "X-DeepCrystal-Delivery": str(row.id), "X-DeepCrystal-Signature": sign(row.secret, body)}
+        host = urlsplit(row.url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(WEBHOOK_HOST_CONCURRENCY)
+        error = None
+        async with limit:
+            self.in_flight += 1
+            try:
+                await self._check_host(row.url)
+                response = await self._client.post(row.url, content=body, headers=headers)
+                if 200 <= response.status_code < 300:
+                    now = datetime.utcnow()
+                    self.delivered += 1
+                    self._lags.append((now - row.created_at).total_seconds())
+                    self._delivered_at.append(time.monotonic())
+                    return row.id, "delivered", attempts, None, None, now
+                error = f"HTTP {response.status_code}"
+            except Exception as e:  # any failure is this row's outcome, never the whole batch's
+                error = f"{type(e).__name__}: {e}"[:500]
+            finally:
+                self.in_flight -= 1
+        if attempts >= WEBHOOK_MAX_ATTEMPTS:
+            self.failed += 1
+            return row.id, "failed", attempts, None, error, None
+        self.retried += 1
+        return row.id, "pending", attempts, datetime.utcnow() + timedelta(seconds=backoff(attempts)), error, None
+
+    async def run_once(self) -> int:
+        """Claims and delivers one batch of due events. Returns how many were attempted."""
+        rows = await asyncio.to_thread(self._claim)
+        if rows:
+            outcomes = await asyncio.gather(*(self._deliver(row) for row in rows))
+            await asyncio.to_thread(self._record, outcomes)
+        return len(rows)
+
+    async def _run(self):
+        # Ends on the _stopping flag: wait_for() can swallow a cancel that arrives as the wake event is set
+        while not self._stopping:
+            try:
+                if await self.run_once() >= WEBHOOK_BATCH:
+                    continue  # backlog: keep going without waiting
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Webhook dispatcher error: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=WEBHOOK_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def start(self):
+        """Starts the dispatcher task on the running event loop (once per process)."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._client = httpx.AsyncClient(
+            timeout=WEBHOOK_TIMEOUT,
+            limits=httpx.Limits(max_connections=256, max_keepalive_connections=64, keepalive_expiry=30),
+            headers={"User-Agent": "Cerberus-DeepCrystal-Webhooks/1.0"}, follow_redirects=False)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        done, _ = await asyncio.wait({self._task}, timeout=WEBHOOK_STOP_TIMEOUT)
+        if not done:
+            self._task.cancel()
+            await asyncio.wait({self._task}, timeout=WEBHOOK_STOP_TIMEOUT)
+        await self._client.aclose()
+        self._task = self._client = self._loop = None
+
+    def stats(self) -> dict:
+        o = WebhookOutbox.__table__
+        with engine.connect() as conn:
+            backlog = dict(conn.execute(select(o.c.status, func.count()).group_by(o.c.status)).all())
+            oldest = conn.execute(select(func.min(o.c.created_at)).where(o.c.status == "pending")).scalar()
+        lags = sorted(self._lags)
+        now = time.monotonic()
+        recent = sum(1 for t in self._delivered_at if now - t <= 60)
+        pick = (lambda q: round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 1) if lags else None)
+        return {
+            "worker": self.worker_id,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retried": self.retried,
+            "in_flight": self.in_flight,
+            "deliveries_per_s_last_min": round(recent / 60, 2),
+            "lag_ms": {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)},
+            "outbox": {status: backlog.get(status, 0) for status in ("pending", "delivered", "failed", "cancelled")},
+            "oldest_pending_s": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+        }
+
+
+dispatcher = WebhookDispatcher()
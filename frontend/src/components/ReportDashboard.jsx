@@ -11,6 +11,8 @@ const COUNTRY_FLAGS = {
     'Brazil (Paraíba)': '🇧🇷',
 }
 
+const SPECTRUM_LABELS = { raman: 'Raman', ftir: 'FTIR', uv_vis: 'UV-Vis' }
+
 function ConfidenceMeter({ value }) {
     const pct = Math.round(value * 100)
     const r = 56
@@ -90,7 +92,7 @@ export default function ReportDashboard({ report }) {
                 <span className="cert-icon">🔐</span>
                 <div style={{ flex: 1 }}>
                     <div className="cert-label">Cerberus DeepCrystal Blockchain Certificate</div>
-                    <div className="cert-id">{report.blockchain_id}</div>
+                    <div className="cert-id">{report.blockchain_id || 'Issuing certificate…'}</div>
                     <div className="cert-hash">SHA-256: Session {report.session_id?.slice(0, 16)}...</div>
                 </div>
                 {report.qr_code_url ? (
@@ -100,6 +102,23 @@ export default function ReportDashboard({ report }) {
                 )}
             </div>
 
+            {/* ── Seen Before (near-duplicate photo) ── */}
+            {report.seen_before && (
+                <div className="card" style={{ marginBottom: 20, borderColor: 'var(--warning)' }}>
+                    <div className="section-title"><span className="section-title-icon">⚠️</span> Stone Seen Before</div>
+                    <div style={{ fontSize: 13, color: 'var(--text-muted)', marginBottom: 8 }}>
+                        A near-identical photo was analysed previously. Check the earlier certificates before accepting this claim.
+                    </div>
+                    {(report.similar_scans || []).map((s, i) => (
+                        <div key={i} style={{ fontSize: 13, padding: '4px 0' }}>
+                            <span style={{ color: 'var(--warning)', fontWeight: 600 }}>{(s.similarity * 100).toFixed(1)}%</span>
+                            {' · '}{s.mineral_name || 'Unknown'}{' · '}{s.blockchain_id || s.session_id}
+                            {s.created_at && <span style={{ color: 'var(--text-muted)' }}> · {new Date(s.created_at).toLocaleString()}</span>}
+                        </div>
+                    ))}
+                </div>
+            )}
+
             {/* ── Gem Identity Banner ── */}
             <div className="gem-banner" style={{ marginBottom: 20 }}>
                 <div className="gem-name">{report.mineral_name}</div>
@@ -107,11 +126,16 @@ export default function ReportDashboard({ report }) {
                 <div className="gem-tags">
                     <span className="gem-tag tag-system">⬡ {report.crystal_system}</span>
                     <span className="gem-tag tag-class">{report.geological_class}</span>
-                    {report.natural_probability > 0.6
+                    {report.natural_probability == null ? null : report.natural_probability > 0.6
                         ? <span className="gem-tag tag-nat">✓ Likely Natural</span>
                         : <span className="gem-tag tag-synth">⚠ Possible Synthetic</span>
                     }
                     <span className="gem-tag tag-category">Mohs {report.mohs_hardness}</span>
+                    {report.tta && (
+                        <span className="gem-tag tag-system" title={`${report.tta.augmentations} augmentations, ${report.tta.strategy}`}>
+                            TTA agreement {(report.tta.agreement * 100).toFixed(0)}%
+                        </span>
+                    )}
                 </div>
             </div>
 
@@ -249,6 +273,27 @@ export default function ReportDashboard({ report }) {
                     </div>
                 </div>
 
+                {/* ── Spectral Library Matches (lab) ── */}
+                {report.spectral_matches?.length > 0 && (
+                    <div className="card report-full">
+                        <div className="section-title"><span className="section-title-icon">📈</span> Spectral Library Matches</div>
+                        <div style={{ marginBottom: 12, fontSize: 12, color: 'var(--text-muted)' }}>
+                            Best matching reference per mineral (spectrum shape and peak positions); weighed into the identification above.
+                        </div>
+                        <div className="progress-list">
+                            {report.spectral_matches.map((m, i) => (
+                                <div key={i}>
+                                    <ProgressBar label={`${SPECTRUM_LABELS[m.kind] || m.kind} · ${m.mineral}`} value={Math.max(0, m.score)} className="fill-natural" />
+                                    <div style={{ fontSize: 11, color: 'var(--text-muted)', marginTop: -4, marginBottom: 6 }}>
+                                        {m.source} · cosine {m.cosine.toFixed(2)} · peaks {m.peak_score.toFixed(2)}
+                                        {m.gems.length > 0 && ` · supports ${m.gems.join(', ')}`}
+                                    </div>
+                                </div>
+                            ))}
+                        </div>
+                    </div>
+                )}
+
                 {/* ── Inclusion Analysis ── */}
                 <div className="card report-full">
                     <div className="section-title"><span className="section-title-icon">🔬</span> Inclusion Pattern Analysis</div>
@@ -2,20 +2,38 @@ import React, { useEffect, useState } from 'react'
 
 export default function DashboardPage({ tier, onNavigate }) {
     const [history, setHistory] = useState([])
+    const [stats, setStats] = useState(null)
     const [loading, setLoading] = useState(true)
 
     useEffect(() => {
-        fetch('/api/analysis/history?limit=5')
-            .then(r => r.ok ? r.json() : [])
-            .then(data => { setHistory(Array.isArray(data) ? data : []); setLoading(false) })
-            .catch(() => setLoading(false))
+        fetch('/api/analysis/stats?days=30').then(r => r.ok ? r.json() : null).catch(() => null)
+            .then(summary => {
+                setStats(summary)
+                setLoading(false)
+            })
     }, [])
 
-    const totalScans = history.length
-    const avgConf = history.length
-        ? (history.reduce((s, r) => s + (r.confidence_score || 0), 0) / history.length * 100).toFixed(1)
-        : '--'
-    const gemNames = [...new Set(history.map(r => r.mineral_name))].length
+    // Recent scans are pushed by the live feed (the newest 5 first); EventSource reconnects and resumes by itself
+    useEffect(() => {
+        const feed = new EventSource('/api/analysis/feed?backlog=5')
+        feed.addEventListener('scan', e => {
+            const row = JSON.parse(e.data)
+            setHistory(prev => [row, ...prev.filter(r => r.session_id !== row.session_id)].slice(0, 5))
+        })
+        // Missed more than the server keeps: reload the list once
+        feed.addEventListener('resync', () => {
+            fetch('/api/analysis/history?limit=5').then(r => r.ok ? r.json() : []).catch(() => [])
+                .then(rows => setHistory(Array.isArray(rows) ? rows : []))
+        })
+        return () => feed.close()
+    }, [])
+
+    const totals = stats?.totals || {}
+    const totalScans = totals.scans ?? 0
+    const avgConf = totals.avg_confidence != null ? (totals.avg_confidence * 100).toFixed(1) : '--'
+    const gemNames = totals.unique_minerals ?? 0
+    const topMinerals = (stats?.by_mineral || []).slice(0, 5)
+    const treatments = Object.entries(stats?.treatments || {}).sort((a, b) => b[1] - a[1])
 
     return (
         <div className="animate-in">
@@ -29,7 +47,7 @@ export default function DashboardPage({ tier, onNavigate }) {
                 <div className="stat-card">
                     <div className="stat-card-icon">💎</div>
                     <div className="stat-card-value">{loading ? '–' : totalScans}</div>
-                    <div className="stat-card-label">Scans This Session</div>
+                    <div className="stat-card-label">Scans (30 Days)</div>
                 </div>
                 <div className="stat-card">
                     <div className="stat-card-icon">🎯</div>
@@ -100,6 +118,37 @@ export default function DashboardPage({ tier, onNavigate }) {
                 </div>
             </div>
 
+            {/* Last 30 Days (from the analytics rollups) */}
+            {totalScans > 0 && (
+                <div style={{ display: 'grid', gridTemplateColumns: '1fr 1fr', gap: 20, marginBottom: 24 }}>
+                    <div className="card">
+                        <div className="section-title"><span className="section-title-icon">📈</span> Top Gems · Last 30 Days</div>
+                        {topMinerals.map(m => (
+                            <div key={m.mineral_name} style={{ display: 'flex', justifyContent: 'space-between', fontSize: 13, padding: '4px 0', borderBottom: '1px solid rgba(255,255,255,0.04)' }}>
+                                <span className="mineral-name-cell">{m.mineral_name}</span>
+                                <span style={{ color: 'var(--text-muted)' }}>
+                                    {m.scans} scans · {(m.avg_natural_probability * 100).toFixed(0)}% natural · avg ${m.avg_price_max_usd?.toLocaleString()}
+                                </span>
+                            </div>
+                        ))}
+                    </div>
+                    <div className="card">
+                        <div className="section-title"><span className="section-title-icon">🔥</span> Treatments · Last 30 Days</div>
+                        {treatments.map(([name, count]) => (
+                            <div key={name} style={{ fontSize: 13, padding: '4px 0' }}>
+                                <div style={{ display: 'flex', justifyContent: 'space-between' }}>
+                                    <span>{name}</span>
+                                    <span style={{ color: 'var(--text-muted)' }}>{(count / totalScans * 100).toFixed(1)}%</span>
+                                </div>
+                                <div style={{ height: 4, borderRadius: 2, background: 'rgba(255,255,255,0.06)' }}>
+                                    <div style={{ width: `${count / totalScans * 100}%`, height: '100%', borderRadius: 2, background: 'var(--accent)' }} />
+                                </div>
+                            </div>
+                        ))}
+                    </div>
+                </div>
+            )}
+
             {/* Recent History */}
             {history.length > 0 && (
                 <div className="card">
@@ -7,6 +7,53 @@ const MODE_INFO = {
     lab: { label: 'Lab License', desc: 'Spectral inputs · Research mode · API', class: 'active-lab' },
 }
 
+// Events of /api/analysis/scan/stream, in the order the server sends them
+const SCAN_STAGES = [
+    ['identification', 'Identification'],
+    ['treatment', 'Treatment & Inclusions'],
+    ['valuation', 'Price & Origin'],
+    ['certificate', 'Certificate'],
+]
+
+// Reads a Server-Sent Events response body, calling onEvent(event, data) per message
+async function readEvents(res, onEvent) {
+    const reader = res.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    for (;;) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        let end
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, end)
+            buffer = buffer.slice(end + 2)
+            let event = 'message'
+            const data = []
+            message.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim()
+                else if (line.startsWith('data:')) data.push(line.slice(5).trim())
+            })
+            if (data.length) onEvent(event, JSON.parse(data.join('\n')))
+        }
+    }
+}
+
+// Reasons reported by the upload quality gate, each with what to change
+function QualityReasons({ reasons, multiView, markFlags }) {
+    return (
+        <ul style={{ margin: '8px 0 0', paddingLeft: 20 }}>
+            {reasons.map((r, i) => (
+                <li key={i}>
+                    {multiView && r.filename ? <strong>{r.filename}: </strong> : null}
+                    {r.message}
+                    {markFlags && r.severity === 'flag' ? ' (warning)' : ''}
+                </li>
+            ))}
+        </ul>
+    )
+}
+
 export default function ScanPage({ tier }) {
     const [mode, setMode] = useState(tier || 'pro')
     const [images, setImages] = useState([])
@@ -14,6 +61,9 @@ export default function ScanPage({ tier }) {
     const [scanning, setScanning] = useState(false)
     const [report, setReport] = useState(null)
     const [error, setError] = useState(null)
+    const [rejected, setRejected] = useState([])
+    const [stages, setStages] = useState({})
+    const [timings, setTimings] = useState(null)
     const fileInputRef = useRef(null)
 
     const [manualInputs, setManualInputs] = useState({
@@ -25,7 +75,11 @@ export default function ScanPage({ tier }) {
         hardness_result: '',
         carat_weight: '',
         uv_fluorescence: '',
+        raman: '',
+        ftir: '',
+        uv_vis: '',
     })
+    const [spectra, setSpectra] = useState({})
 
     const handleFiles = useCallback((files) => {
         const valid = Array.from(files).filter(f => f.type.startsWith('image/'))
@@ -38,6 +92,7 @@ export default function ScanPage({ tier }) {
         setImages(previewURLs)
         setReport(null)
         setError(null)
+        setRejected([])
     }, [])
 
     const handleDrop = (e) => {
@@ -57,16 +112,28 @@ export default function ScanPage({ tier }) {
         }
         setScanning(true)
         setError(null)
+        setRejected([])
         setReport(null)
+        setStages({})
+        setTimings(null)
 
         try {
             const formData = new FormData()
-            formData.append('image', images[0].file)
+            // Multi-view fusion is a lab feature; other modes scan the first view
+            const views = mode === 'lab' ? images : images.slice(0, 1)
+            views.forEach(img => formData.append('image', img.file))
             formData.append('mode', mode)
 
+            // Spectra (lab mode): a two-column file per kind, or typed peak positions
+            const spectralFields = ['raman', 'ftir', 'uv_vis']
+            if (mode === 'lab') {
+                Object.entries(spectra).forEach(([k, file]) => file && formData.append(k, file))
+            }
+
             // Clean manual inputs: only include non-empty values
             const cleanInputs = {}
             Object.entries(manualInputs).forEach(([k, v]) => {
+                if (spectralFields.includes(k) && (mode !== 'lab' || spectra[k])) return
                 if (v !== '') {
                     const numFields = ['refractive_index', 'specific_gravity', 'hardness_result', 'carat_weight']
                     cleanInputs[k] = numFields.includes(k) ? parseFloat(v) || v : v
@@ -74,16 +141,36 @@ export default function ScanPage({ tier }) {
             })
             formData.append('manual_data', JSON.stringify(cleanInputs))
 
-            const res = await fetch('/api/analysis/scan', {
+            // Streamed scan: the headline result renders while the certificate is still being issued
+            const res = await fetch('/api/analysis/scan/stream', {
                 method: 'POST',
+                // The tier header lets the server check the daily quota before the upload is sent
+                headers: { 'X-Tier': mode },
                 body: formData,
             })
             if (!res.ok) {
                 const errData = await res.json()
+                // 422 from the quality gate: the photo never reached the model; show what to change
+                if (errData.detail && errData.detail.reasons) {
+                    setRejected([...errData.detail.reasons, ...errData.detail.flags])
+                    throw new Error(errData.detail.message)
+                }
                 throw new Error(errData.detail || 'Analysis failed')
             }
-            const data = await res.json()
-            setReport(data)
+            let finished = false
+            await readEvents(res, (event, data) => {
+                const { elapsed_ms, ...fields } = data
+                if (event === 'error') throw new Error(data.detail || 'Analysis failed')
+                if (event === 'complete') {
+                    finished = true
+                    setReport(data.report)
+                    setTimings(data.timings)
+                    return
+                }
+                setReport(prev => ({ ...prev, ...fields }))
+                setStages(prev => ({ ...prev, [event]: elapsed_ms }))
+            })
+            if (!finished) throw new Error('Connection to the analysis engine was lost before the report was complete.')
         } catch (err) {
             setError(err.message || 'Could not connect to the analysis engine. Ensure the backend is running.')
         } finally {
@@ -167,16 +254,31 @@ export default function ScanPage({ tier }) {
                             <div className="panel-title">🔬 Spectral Data Input</div>
                             <div style={{ display: 'grid', gridTemplateColumns: '1fr 1fr', gap: 12, marginTop: 12 }}>
                                 {[
-                                    { label: 'Raman Shift (cm⁻¹)', field: 'raman', placeholder: 'e.g. 418' },
+                                    { label: 'Raman Shift (cm⁻¹)', field: 'raman', placeholder: 'e.g. 418, 378, 750' },
                                     { label: 'FTIR Peak (cm⁻¹)', field: 'ftir', placeholder: 'e.g. 3309' },
                                     { label: 'UV-Vis (nm)', field: 'uv_vis', placeholder: 'e.g. 550' },
                                 ].map(({ label, field, placeholder }) => (
                                     <div key={field} className="form-group">
                                         <label className="form-label">{label}</label>
-                                        <input className="form-input" placeholder={placeholder} />
+                                        <input
+                                            className="form-input"
+                                            placeholder={spectra[field] ? spectra[field].name : placeholder}
+                                            disabled={!!spectra[field]}
+                                            value={spectra[field] ? '' : manualInputs[field]}
+                                            onChange={e => handleInputChange(field, e.target.value)}
+                                        />
+                                        <input
+                                            type="file"
+                                            accept=".txt,.csv,.tsv,.dat"
+                                            style={{ fontSize: 11, marginTop: 4 }}
+                                            onChange={e => setSpectra(prev => ({ ...prev, [field]: e.target.files[0] || null }))}
+                                        />
                                     </div>
                                 ))}
                             </div>
+                            <div style={{ fontSize: 11, color: 'var(--text-muted)', marginTop: 8 }}>
+                                Type peak positions, or attach the full spectrum (two columns: position, intensity). Both are matched against the reference library.
+                            </div>
                         </div>
                     )}
                 </div>
@@ -270,6 +372,23 @@ export default function ScanPage({ tier }) {
                     marginBottom: 16
                 }}>
                     ⚠️ {error}
+                    {rejected.length > 0 && <QualityReasons reasons={rejected} multiView={images.length > 1} markFlags />}
+                </div>
+            )}
+
+            {/* Quality warnings: the scan ran, but the photo may limit its accuracy */}
+            {report?.quality?.reasons?.length > 0 && (
+                <div style={{
+                    background: 'rgba(255,170,0,0.08)',
+                    border: '1px solid rgba(255,170,0,0.3)',
+                    borderRadius: 'var(--radius-sm)',
+                    padding: '12px 16px',
+                    color: 'var(--warning)',
+                    fontSize: 13,
+                    marginBottom: 16
+                }}>
+                    📷 Photo quality may limit this result:
+                    <QualityReasons reasons={report.quality.reasons} multiView={images.length > 1} />
                 </div>
             )}
 
@@ -287,6 +406,20 @@ export default function ScanPage({ tier }) {
                 )}
             </button>
 
+            {/* Stage progress (streamed scan) */}
+            {(scanning || timings) && Object.keys(stages).length > 0 && (
+                <div style={{ display: 'flex', gap: 16, flexWrap: 'wrap', fontSize: 12, color: 'var(--text-muted)', marginTop: -20, marginBottom: 20 }}>
+                    {SCAN_STAGES.map(([key, label]) => (
+                        <span key={key} style={{ color: key in stages ? 'var(--success)' : undefined }}>
+                            {key in stages ? `✓ ${label} · ${stages[key].toFixed(0)} ms` : `… ${label}`}
+                        </span>
+                    ))}
+                    {timings && (
+                        <span>First result in {timings.first_result_ms.toFixed(0)} ms · full report in {timings.total_ms.toFixed(0)} ms</span>
+                    )}
+                </div>
+            )}
+
             {/* Report */}
             {report && <ReportDashboard report={report} />}
 